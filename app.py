@@ -1,8 +1,17 @@
 from flask import Flask, render_template, redirect, url_for, request, jsonify
 from flask_migrate import Migrate
+from sqlalchemy import inspect
 from sqlalchemy.exc import SQLAlchemyError
 from werkzeug.exceptions import HTTPException
 from extensions import db
+from db_routing import init_db_routing, read_replica
+from faction_events import init_faction_events
+from assets import init_assets
+from faction_directory import init_faction_directory
+from stats_rollup import init_stats_rollup
+from stats_partitions import init_stats_partitions
+from percentiles import init_percentiles
+from faction_export import init_faction_export
 from flask_login import LoginManager, current_user
 import os
 import logging
@@ -28,14 +37,41 @@ def create_app():
         app.logger.warning("DATABASE_URL is not set")
 
     app.config["SQLALCHEMY_DATABASE_URI"] = database_url
+
+    replica_url = os.environ.get("DATABASE_REPLICA_URL")
+    if replica_url:
+        app.logger.info("DATABASE_REPLICA_URL is set, routing read-only requests to the replica")
+        app.config["SQLALCHEMY_BINDS"] = {"replica": replica_url}
+    app.config["REPLICA_MAX_LAG_SECONDS"] = float(os.environ.get("REPLICA_MAX_LAG_SECONDS", 5))
     app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
         "pool_recycle": 300,
         "pool_pre_ping": True,
     }
     app.config['SECRET_KEY'] = os.urandom(24)
+    # Static assets are revalidated with ETags once this expires.
+    app.config['SEND_FILE_MAX_AGE_DEFAULT'] = int(os.environ.get("STATIC_MAX_AGE", 300))
+    app.config['ESBUILD_COMMAND'] = os.environ.get("ESBUILD_COMMAND")
+    app.config['FACTION_SUMMARY_REFRESH_SECONDS'] = int(os.environ.get("FACTION_SUMMARY_REFRESH_SECONDS", 300))
+    app.config['STATS_ROLLUP_INTERVAL_SECONDS'] = int(os.environ.get("STATS_ROLLUP_INTERVAL_SECONDS", 60))
+    app.config['STATS_ROLLUP_BATCH_SIZE'] = int(os.environ.get("STATS_ROLLUP_BATCH_SIZE", 5000))
+    app.config['STATS_ROLLUP_LAG_SECONDS'] = int(os.environ.get("STATS_ROLLUP_LAG_SECONDS", 60))
+    app.config['STATS_PARTITION_MONTHS_AHEAD'] = int(os.environ.get("STATS_PARTITION_MONTHS_AHEAD", 3))
+    app.config['STATS_PARTITION_MAINTENANCE_SECONDS'] = int(os.environ.get("STATS_PARTITION_MAINTENANCE_SECONDS", 86400))
+    app.config['STATS_ARCHIVE_AFTER_MONTHS'] = int(os.environ.get("STATS_ARCHIVE_AFTER_MONTHS", 0))
+    if os.environ.get("STATS_ARCHIVE_DIR"):
+        app.config['STATS_ARCHIVE_DIR'] = os.environ["STATS_ARCHIVE_DIR"]
+    app.config['PERCENTILE_REBUILD_SECONDS'] = int(os.environ.get("PERCENTILE_REBUILD_SECONDS", 0))
+    if os.environ.get("EXPORT_DIR"):
+        app.config['EXPORT_DIR'] = os.environ["EXPORT_DIR"]
+    app.config['EXPORT_WORKERS'] = int(os.environ.get("EXPORT_WORKERS", 2))
+    app.config['EXPORT_CLEANUP_SECONDS'] = int(os.environ.get("EXPORT_CLEANUP_SECONDS", 3600))
+    app.config['FACTION_EVENTS_BROKER_URL'] = os.environ.get("FACTION_EVENTS_BROKER_URL")
 
     # Initialize SQLAlchemy with the app
     db.init_app(app)
+    init_db_routing(app)
+    init_faction_events(app)
+    init_assets(app)
 
     # Initialize Flask-Migrate
     migrate = Migrate(app, db)
@@ -54,11 +90,12 @@ def create_app():
     from models import User, Faction, Stats, FeatureAccess
 
     # Register blueprints
-    from routes import auth, stats, factions, admin
+    from routes import auth, stats, factions, admin, dashboard as dashboard_routes
     app.register_blueprint(auth.bp)
     app.register_blueprint(stats.bp)
     app.register_blueprint(factions.bp)
     app.register_blueprint(admin.bp)
+    app.register_blueprint(dashboard_routes.bp)
 
     # Routes
     @app.route('/')
@@ -77,9 +114,12 @@ def create_app():
         return render_template('login.html')
 
     @app.route('/dashboard')
+    @read_replica
     def dashboard():
         app.logger.info(f"Received request for dashboard page from {request.remote_addr}")
-        return render_template('dashboard.html')
+        # Inline the bootstrap payload so the first paint needs no extra requests.
+        bootstrap = dashboard_routes.build_dashboard_bootstrap(current_user) if current_user.is_authenticated else None
+        return render_template('dashboard.html', bootstrap=bootstrap)
 
     @app.route('/health')
     def health_check():
@@ -147,10 +187,19 @@ def create_app():
             app.logger.error(f'Unexpected error while ensuring admin exists: {str(e)}')
 
     with app.app_context():
-        db.create_all()
+        # Databases under Alembic get their tables from `flask db upgrade`;
+        # create_all would build new tables before the migrations that add them.
+        if not inspect(db.engine).has_table('alembic_version'):
+            db.create_all()
         ensure_admin_exists()
         app.logger.info("Database tables created and admin user ensured")
 
+    init_stats_partitions(app)
+    init_faction_directory(app)
+    init_stats_rollup(app)
+    init_percentiles(app)
+    init_faction_export(app)
+
     return app
 
 app = create_app()
@@ -0,0 +1,195 @@
+"""ASGI entry point with an asyncio read path for dashboard polling.
+
+Run with ``uvicorn asgi:application``. Requests under ``/async`` are served by
+coroutines on SQLAlchemy's async engine, so a waiting database query does not
+hold a worker thread; every other path is handed to the regular Flask app.
+"""
+from asgiref.wsgi import WsgiToAsgi
+from itsdangerous import BadSignature
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from werkzeug.http import parse_cookie
+from app import app as flask_app
+from models import User, Faction, Stats, FeatureAccess
+from routes.stats import build_stats_data
+from routes.factions import build_member_list, build_faction_details
+from snapshots import LOOKBACK
+from stats_partitions import recent_archived_snapshots
+from utils import utcnow
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+ASYNC_PREFIX = '/async'
+ASYNC_DRIVERS = {
+    'postgres': 'postgresql+asyncpg',
+    'postgresql': 'postgresql+asyncpg',
+    'postgresql+psycopg2': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+
+class APIError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def async_database_url(database_url):
+    url = make_url(database_url)
+    url = url.set(drivername=ASYNC_DRIVERS.get(url.drivername, url.drivername))
+    if url.drivername == 'postgresql+asyncpg' and 'sslmode' in url.query:
+        # asyncpg does not understand libpq's sslmode parameter.
+        query = dict(url.query)
+        query['ssl'] = query.pop('sslmode')
+        url = url.set(query=query)
+    return url
+
+
+async def latest_snapshots(session, user_id, count):
+    """snapshots.latest_snapshots on the async engine. Archived months are read
+    in a worker thread, as the archive reader is synchronous."""
+    cutoff = utcnow() - LOOKBACK
+    query = select(Stats).filter_by(user_id=user_id).order_by(Stats.timestamp.desc(), Stats.id.desc())
+    rows = (await session.execute(query.where(Stats.timestamp >= cutoff).limit(count))).scalars().all()
+    if len(rows) < count:
+        rows += (await session.execute(query.where(Stats.timestamp < cutoff).limit(count - len(rows)))).scalars().all()
+    if len(rows) < count:
+        rows += await asyncio.to_thread(recent_archived, user_id, count - len(rows))
+    return rows
+
+
+def recent_archived(user_id, limit):
+    with flask_app.app_context():
+        return recent_archived_snapshots(user_id, limit=limit)
+
+
+async def get_stats(session, user):
+    rows = await latest_snapshots(session, user.id, 2)
+    if not rows:
+        raise APIError(404, 'No stats found')
+    return build_stats_data(rows[0], rows[1] if len(rows) > 1 else None)
+
+
+async def get_faction(session, user):
+    if user.faction_id is None:
+        raise APIError(400, 'You are not in a faction')
+    return await session.get(Faction, user.faction_id)
+
+
+async def get_faction_details(session, user):
+    return build_faction_details(await get_faction(session, user), user)
+
+
+async def get_faction_members(session, user):
+    faction = await get_faction(session, user)
+    members = (await session.execute(select(User).filter_by(faction_id=faction.id))).scalars().all()
+    return {'members': build_member_list(members)}
+
+
+async def get_dashboard_bootstrap(session, user):
+    payload = {'stats': None, 'faction': None, 'members': [], 'features': {}}
+    try:
+        payload['stats'] = await get_stats(session, user)
+    except APIError:
+        pass
+    if user.faction_id is not None:
+        payload['faction'] = await get_faction_details(session, user)
+        payload['members'] = (await get_faction_members(session, user))['members']
+    features = (await session.execute(select(FeatureAccess).filter_by(user_id=user.id))).scalars().all()
+    payload['features'] = {access.feature: access.enabled for access in features}
+    return payload
+
+
+class AsyncReadAPI:
+    """ASGI application serving the async read views and delegating the rest to
+    Flask. The Flask session cookie is decoded here so the same Flask-Login
+    session authenticates both paths."""
+
+    routes = {
+        '/stats': get_stats,
+        '/faction/details': get_faction_details,
+        '/faction/members': get_faction_members,
+        '/dashboard/bootstrap': get_dashboard_bootstrap,
+    }
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.wsgi_app = WsgiToAsgi(flask_app)
+        self.engine = create_async_engine(
+            async_database_url(flask_app.config['SQLALCHEMY_DATABASE_URI']),
+            pool_recycle=300,
+            pool_pre_ping=True,
+        )
+        self.sessionmaker = async_sessionmaker(self.engine, expire_on_commit=False)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http' and scope['path'].startswith(ASYNC_PREFIX + '/'):
+            await self.handle(scope, send)
+        else:
+            await self.wsgi_app(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.engine.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def handle(self, scope, send):
+        view = self.routes.get(scope['path'][len(ASYNC_PREFIX):])
+        try:
+            if view is None:
+                raise APIError(404, 'Not found')
+            if scope['method'] not in ('GET', 'HEAD'):
+                raise APIError(405, 'Method not allowed')
+            user_id = self.session_user_id(scope)
+            if user_id is None:
+                raise APIError(401, 'Login required')
+            async with self.sessionmaker() as session:
+                user = await session.get(User, int(user_id))
+                if user is None:
+                    raise APIError(401, 'Login required')
+                status, body = 200, await view(session, user)
+        except APIError as e:
+            status, body = e.status, {'error': e.message}
+        except Exception as e:
+            logger.error(f"Error in async read view {scope['path']}: {str(e)}")
+            status, body = 500, {'error': 'An unexpected error occurred', 'details': str(e)}
+        await self.send_json(send, status, body)
+
+    def session_user_id(self, scope):
+        headers = dict(scope['headers'])
+        cookies = parse_cookie(headers.get(b'cookie', b'').decode('latin-1'))
+        cookie = cookies.get(self.flask_app.config['SESSION_COOKIE_NAME'])
+        serializer = self.flask_app.session_interface.get_signing_serializer(self.flask_app)
+        if not cookie or serializer is None:
+            return None
+        try:
+            max_age = int(self.flask_app.permanent_session_lifetime.total_seconds())
+            return serializer.loads(cookie, max_age=max_age).get('_user_id')
+        except BadSignature:
+            return None
+
+    async def send_json(self, send, status, body):
+        data = self.flask_app.json.dumps(body, separators=(',', ':')).encode()
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(data)).encode()),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': data})
+
+
+application = AsyncReadAPI(flask_app)
@@ -0,0 +1,180 @@
+"""Build step for static assets.
+
+``flask assets build`` minifies every script and stylesheet under ``static/``,
+compiles the JSX dashboard components, concatenates the dashboard scripts into
+one bundle, and writes content-hashed copies plus ``.gz``/``.br`` variants to
+``static/dist`` together with a manifest. Once a manifest exists,
+``url_for('static', filename=...)`` resolves to the hashed files, which are
+served precompressed with immutable cache headers.
+"""
+from flask import request, send_from_directory
+from werkzeug.security import safe_join
+import click
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import shlex
+import shutil
+import subprocess
+
+logger = logging.getLogger(__name__)
+
+DIST_DIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+IMMUTABLE_MAX_AGE = 31536000
+
+# Bundles are built from several sources, in order, and replace them on pages
+# once built. Sources listed here may contain JSX.
+BUNDLES = {
+    'js/dashboard.js': [
+        'js/number_formatting.js',
+        'js/dashboard_bootstrap.js',
+        'js/stats.js',
+        'js/factions.js',
+        'js/StatisticsDashboard.js',
+    ],
+}
+
+LOADERS = {'.js': 'jsx', '.css': 'css'}
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+class AssetBuildError(click.ClickException):
+    pass
+
+
+def esbuild_command(app):
+    command = app.config.get('ESBUILD_COMMAND')
+    if command:
+        return shlex.split(command)
+    if shutil.which('esbuild'):
+        return ['esbuild']
+    if shutil.which('npx'):
+        return ['npx', '--yes', 'esbuild']
+    raise AssetBuildError('esbuild was not found; install it or set ESBUILD_COMMAND')
+
+
+def minify(command, source, loader):
+    result = subprocess.run(
+        command + [f'--loader={loader}', '--minify', '--target=es2017'],
+        input=source.encode(), capture_output=True,
+    )
+    if result.returncode != 0:
+        raise AssetBuildError(result.stderr.decode())
+    return result.stdout
+
+
+def compress(path, data):
+    with open(path + '.gz', 'wb') as f:
+        f.write(gzip.compress(data, compresslevel=9, mtime=0))
+    try:
+        import brotli
+    except ImportError:
+        logger.warning("brotli is not installed, skipping .br variants")
+        return
+    with open(path + '.br', 'wb') as f:
+        f.write(brotli.compress(data, quality=11))
+
+
+def collect_sources(static_folder):
+    sources = {}
+    for root, dirs, files in os.walk(static_folder):
+        dirs[:] = [d for d in dirs if os.path.join(root, d) != os.path.join(static_folder, DIST_DIR)]
+        for name in files:
+            if os.path.splitext(name)[1] in LOADERS:
+                path = os.path.relpath(os.path.join(root, name), static_folder).replace(os.sep, '/')
+                sources[path] = [path]
+    sources.update(BUNDLES)
+    return sources
+
+
+def build_assets(app):
+    static_folder = app.static_folder
+    dist_folder = os.path.join(static_folder, DIST_DIR)
+    command = esbuild_command(app)
+
+    shutil.rmtree(dist_folder, ignore_errors=True)
+    manifest = {}
+    for name, parts in sorted(collect_sources(static_folder).items()):
+        source = ''
+        for part in parts:
+            with open(os.path.join(static_folder, part), encoding='utf-8') as f:
+                source += f.read() + '\n'
+
+        stem, ext = os.path.splitext(name)
+        data = minify(command, source, LOADERS[ext])
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        hashed_name = f'{DIST_DIR}/{stem}.{digest}{ext}'
+
+        output = os.path.join(static_folder, hashed_name)
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+        with open(output, 'wb') as f:
+            f.write(data)
+        compress(output, data)
+        manifest[name] = hashed_name
+        click.echo(f'{name} -> {hashed_name} ({len(data)} bytes)')
+
+    with open(os.path.join(dist_folder, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def load_manifest(app):
+    path = os.path.join(app.static_folder, DIST_DIR, MANIFEST_NAME)
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def init_assets(app):
+    app.extensions['asset_manifest'] = load_manifest(app)
+    if app.extensions['asset_manifest']:
+        app.logger.info("Serving fingerprinted static assets")
+
+    @app.url_defaults
+    def fingerprint_static_urls(endpoint, values):
+        if endpoint == 'static' and 'filename' in values:
+            values['filename'] = app.extensions['asset_manifest'].get(values['filename'], values['filename'])
+
+    @app.context_processor
+    def asset_helpers():
+        return {'asset_built': lambda name: name in app.extensions['asset_manifest']}
+
+    def static(filename):
+        if not filename.startswith(DIST_DIR + '/'):
+            return app.send_static_file(filename)
+
+        # Hashed files never change, so they can be cached forever and served
+        # from their precompressed variant when the client accepts it.
+        response = None
+        for encoding, suffix in ENCODINGS:
+            path = safe_join(app.static_folder, filename + suffix)
+            if encoding in request.accept_encodings and path and os.path.isfile(path):
+                response = send_from_directory(app.static_folder, filename + suffix,
+                                               mimetype=mimetypes.guess_type(filename)[0])
+                response.headers['Content-Encoding'] = encoding
+                break
+        if response is None:
+            response = app.send_static_file(filename)
+        response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+        return response
+
+    app.view_functions['static'] = static
+
+    @app.cli.group()
+    def assets():
+        """Static asset commands."""
+
+    @assets.command('build')
+    def build():
+        """Compile, fingerprint and precompress static assets."""
+        app.extensions['asset_manifest'] = build_assets(app)
+        click.echo(f'Wrote {len(app.extensions["asset_manifest"])} assets to static/{DIST_DIR}')
@@ -0,0 +1,145 @@
+"""Load-test and benchmark runner.
+
+    python -m benchmarks run --users 2000 --factions 40 --snapshots 30 --driver wsgi
+    python -m benchmarks compare benchmarks/results/<old>.json benchmarks/results/<new>.json
+
+``run`` loads a seeded synthetic dataset into ``--database-url`` (a fresh
+SQLite file by default; the database is wiped), runs the selected scenarios and
+writes one JSON result per run under ``benchmarks/results``, named after the
+current git commit so runs can be compared across commits.
+"""
+from datetime import datetime, timezone
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, cwd=REPO_ROOT,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run(options):
+    os.environ['DATABASE_URL'] = options.database_url
+    # The app reads DATABASE_URL when it is imported.
+    from app import app
+    from extensions import db
+    from benchmarks.datagen import generate
+    from benchmarks.harness import Recorder, TestClientDriver, WSGIServerDriver, ASGIServerDriver
+    from benchmarks.scenarios import SCENARIOS
+
+    options.postgres = options.database_url.startswith('postgres')
+    started = time.perf_counter()
+    with app.app_context():
+        generate(db, options.users, options.factions, options.snapshots, seed=options.seed)
+    load_time = time.perf_counter() - started
+    print(f'Loaded {options.users} users, {options.factions} factions, '
+          f'{options.users * options.snapshots} stats rows in {load_time:.1f}s')
+
+    drivers = {
+        'client': lambda: TestClientDriver(app),
+        'wsgi': lambda: WSGIServerDriver(app),
+        'asgi': lambda: ASGIServerDriver(),
+    }
+    driver = drivers[options.driver]()
+    driver.start()
+    results = {}
+    try:
+        for name in options.scenarios:
+            recorder = Recorder()
+            wall_time = SCENARIOS[name](driver, recorder, options)
+            if wall_time is None:
+                continue
+            results[name] = recorder.summary(wall_time)
+            print_summary(name, results[name])
+    finally:
+        driver.stop()
+
+    record = {
+        'commit': git_commit(),
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'driver': options.driver,
+        'database': 'postgresql' if options.postgres else 'sqlite',
+        'dataset': {'users': options.users, 'factions': options.factions,
+                    'snapshots': options.snapshots, 'seed': options.seed},
+        'concurrency': options.concurrency,
+        'requests': options.requests,
+        'load_seconds': round(load_time, 2),
+        'scenarios': results,
+    }
+    os.makedirs(options.output, exist_ok=True)
+    path = os.path.join(options.output, f"{record['commit']}-{options.driver}-{int(time.time())}.json")
+    with open(path, 'w') as f:
+        json.dump(record, f, indent=2)
+    print(f'Results written to {path}')
+
+
+def print_summary(scenario, summary):
+    print(f'\n{scenario}')
+    print(f"  {'endpoint':<32}{'reqs':>7}{'errs':>6}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for endpoint, row in summary.items():
+        print(f"  {endpoint:<32}{row['requests']:>7}{row['errors']:>6}{row['throughput_rps']:>10}"
+              f"{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}")
+
+
+def compare(options):
+    with open(options.baseline) as f:
+        baseline = json.load(f)
+    with open(options.candidate) as f:
+        candidate = json.load(f)
+    print(f"{baseline['commit']} -> {candidate['commit']}")
+    for scenario, endpoints in candidate['scenarios'].items():
+        print(f'\n{scenario}')
+        for endpoint, row in endpoints.items():
+            before = baseline['scenarios'].get(scenario, {}).get(endpoint)
+            if before is None:
+                print(f"  {endpoint:<32} new: p95 {row['p95_ms']} ms, {row['throughput_rps']} rps")
+                continue
+            change = (row['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100 if before['p95_ms'] else 0
+            print(f"  {endpoint:<32} p95 {before['p95_ms']} -> {row['p95_ms']} ms ({change:+.1f}%), "
+                  f"rps {before['throughput_rps']} -> {row['throughput_rps']}")
+
+
+def main(argv=None):
+    from benchmarks.scenarios import SCENARIOS
+
+    parser = argparse.ArgumentParser(prog='python -m benchmarks')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='load synthetic data and run scenarios')
+    run_parser.add_argument('--database-url', default='sqlite:///' + os.path.join(tempfile.gettempdir(), 'mafiamanager-bench.db'))
+    run_parser.add_argument('--users', type=int, default=1000)
+    run_parser.add_argument('--factions', type=int, default=20)
+    run_parser.add_argument('--snapshots', type=int, default=20)
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--driver', choices=['client', 'wsgi', 'asgi'], default='client')
+    run_parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS), default=sorted(SCENARIOS))
+    run_parser.add_argument('--concurrency', type=int, default=8)
+    run_parser.add_argument('--requests', type=int, default=50, help='iterations per worker')
+    run_parser.add_argument('--output', default=RESULTS_DIR)
+
+    compare_parser = commands.add_parser('compare', help='compare two result files')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('candidate')
+
+    options = parser.parse_args(argv)
+    if options.command == 'run':
+        if options.users < max(options.factions, 1):
+            parser.error('--users must be at least --factions')
+        run(options)
+    else:
+        compare(options)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
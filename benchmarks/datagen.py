@@ -0,0 +1,111 @@
+"""Fast, seeded synthetic data for benchmarks.
+
+Rows are bulk-inserted with Core ``executemany`` in batches, and every user
+shares one precomputed password hash, so loading hundreds of thousands of
+``Stats`` rows takes seconds rather than minutes.
+"""
+from collections import Counter
+from datetime import timedelta
+from sqlalchemy import insert, update, text
+from werkzeug.security import generate_password_hash
+from faction_directory import refresh_faction_summaries
+from metrics import COUNTER_COLUMNS
+from percentiles import rebuild_sketches
+from stats_partitions import INITIAL_MONTHS_AHEAD, ensure_partitions, month_start
+from utils import utcnow
+import random
+
+BENCHMARK_PASSWORD = 'benchmark'
+FACTIONLESS_SHARE = 0.2
+
+
+def username(i):
+    return f'user{i}'
+
+
+def insert_batches(connection, table, rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            connection.execute(insert(table), batch)
+            batch = []
+    if batch:
+        connection.execute(insert(table), batch)
+
+
+def faction_rows(users, factions):
+    member_counts = Counter(faction_of(i, users, factions) for i in range(users))
+    for j in range(factions):
+        yield {
+            'id': j + 1,
+            'name': f'faction{j}',
+            'invitation_code': f'bench{j:010d}',
+            # User j is always the first member assigned to faction j. leader_id
+            # is set once the users exist.
+            'leader_username': username(j),
+            'member_count': member_counts[j + 1],
+            'membership_version': 0,
+        }
+
+
+def faction_of(i, users, factions):
+    # Every faction gets at least its leader; the last users stay factionless.
+    members = max(int(users * (1 - FACTIONLESS_SHARE)), factions)
+    return i % factions + 1 if factions and i < members else None
+
+
+def user_rows(users, factions, password_hash):
+    for i in range(users):
+        yield {
+            'id': i + 1,
+            'username': username(i),
+            'email': f'{username(i)}@example.com',
+            'password_hash': password_hash,
+            'is_admin': i == 0,
+            'faction_id': faction_of(i, users, factions),
+        }
+
+
+def stats_rows(users, snapshots, rng, now):
+    for i in range(users):
+        values = {field: rng.randint(0, 1000) for field in COUNTER_COLUMNS}
+        for k in range(snapshots):
+            for field in COUNTER_COLUMNS:
+                values[field] += rng.randint(0, 500)
+            yield {
+                'user_id': i + 1,
+                'timestamp': now - timedelta(hours=snapshots - k),
+                **values,
+            }
+
+
+def generate(db, users, factions, snapshots, seed=0, batch_size=5000):
+    """Recreate all tables and fill them with ``users`` users spread over
+    ``factions`` factions, each with ``snapshots`` Stats rows."""
+    from models import User, Faction, Stats
+
+    rng = random.Random(seed)
+    now = utcnow().replace(microsecond=0)
+    password_hash = generate_password_hash(BENCHMARK_PASSWORD)
+
+    db.drop_all()
+    db.create_all()
+    with db.engine.begin() as connection:
+        # create_all only creates partitions from this month on.
+        ensure_partitions(connection, INITIAL_MONTHS_AHEAD, since=month_start(now - timedelta(hours=snapshots)))
+        insert_batches(connection, Faction.__table__, faction_rows(users, factions), batch_size)
+        insert_batches(connection, User.__table__, user_rows(users, factions, password_hash), batch_size)
+        # Faction j + 1 is led by user j, whose id is also j + 1.
+        connection.execute(update(Faction.__table__).values(leader_id=Faction.__table__.c.id))
+        insert_batches(connection, Stats.__table__, stats_rows(users, snapshots, rng, now), batch_size)
+        if connection.dialect.name == 'postgresql':
+            # Explicit ids do not advance the sequences used by later inserts.
+            for table in ('user', 'faction'):
+                connection.execute(text(
+                    f"SELECT setval(pg_get_serial_sequence('\"{table}\"', 'id'), "
+                    f"(SELECT COALESCE(MAX(id), 1) FROM \"{table}\"))"
+                ))
+    # Writes through the app keep these current; bulk loads have to rebuild them.
+    rebuild_sketches()
+    refresh_faction_summaries()
@@ -0,0 +1,168 @@
+"""Drivers that issue requests against the app, and the latency recorder.
+
+Every driver hands out sessions with their own cookies, so each simulated
+player stays logged in independently:
+
+* ``client`` calls the Flask test client in-process (no network, no server),
+* ``wsgi`` runs the app on a threaded Werkzeug server and talks HTTP,
+* ``asgi`` serves ``asgi.application`` with uvicorn, which adds the async
+  ``/async/...`` read path to compare against the sync views.
+"""
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import CookieJar
+from werkzeug.serving import make_server
+import json
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+
+
+class Response:
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body)
+
+
+class TestClientSession:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, json=None, headers=None):
+        response = self.client.open(path, method=method, json=json, headers=headers)
+        return Response(response.status_code, response.headers, response.get_data())
+
+
+class HTTPSession:
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()))
+
+    def request(self, method, path, json=None, headers=None):
+        data = None
+        headers = dict(headers or {})
+        if json is not None:
+            data = _json_dumps(json)
+            headers['Content-Type'] = 'application/json'
+        request = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+        try:
+            with self.opener.open(request) as response:
+                return Response(response.status, response.headers, response.read())
+        except urllib.error.HTTPError as e:
+            return Response(e.code, e.headers, e.read())
+
+
+def _json_dumps(value):
+    return json.dumps(value).encode()
+
+
+class TestClientDriver:
+    name = 'client'
+
+    def __init__(self, app):
+        self.app = app
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def session(self):
+        return TestClientSession(self.app)
+
+
+class WSGIServerDriver:
+    name = 'wsgi'
+
+    def __init__(self, app, host='127.0.0.1'):
+        self.app = app
+        self.host = host
+        self.server = None
+
+    def start(self):
+        self.server = make_server(self.host, 0, self.app, threaded=True)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+
+    def session(self):
+        return HTTPSession(f'http://{self.host}:{self.server.server_port}')
+
+
+class ASGIServerDriver:
+    name = 'asgi'
+
+    def __init__(self, host='127.0.0.1', port=8765):
+        self.host = host
+        self.port = port
+        self.server = None
+
+    def start(self):
+        import uvicorn
+        from asgi import application
+        config = uvicorn.Config(application, host=self.host, port=self.port, log_level='warning')
+        self.server = uvicorn.Server(config)
+        threading.Thread(target=self.server.run, daemon=True).start()
+        while not self.server.started:
+            time.sleep(0.05)
+
+    def stop(self):
+        self.server.should_exit = True
+
+    def session(self):
+        return HTTPSession(f'http://{self.host}:{self.port}')
+
+
+class Recorder:
+    """Collects per-endpoint latencies and summarizes them."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latencies = defaultdict(list)
+        self._errors = defaultdict(int)
+
+    def timed(self, name, session, method, path, expected=(200,), **kwargs):
+        started = time.perf_counter()
+        response = session.request(method, path, **kwargs)
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._latencies[name].append(elapsed)
+            if response.status not in expected:
+                self._errors[name] += 1
+        return response
+
+    def summary(self, wall_time):
+        results = {}
+        for name, latencies in sorted(self._latencies.items()):
+            results[name] = {
+                'requests': len(latencies),
+                'errors': self._errors[name],
+                'throughput_rps': round(len(latencies) / wall_time, 2) if wall_time else None,
+                'p50_ms': percentile_ms(latencies, 50),
+                'p95_ms': percentile_ms(latencies, 95),
+                'p99_ms': percentile_ms(latencies, 99),
+            }
+        return results
+
+
+def percentile_ms(latencies, p):
+    if len(latencies) == 1:
+        return round(latencies[0] * 1000, 3)
+    return round(statistics.quantiles(latencies, n=100, method='inclusive')[p - 1] * 1000, 3)
+
+
+def run_workers(worker, concurrency):
+    """Run ``worker(index)`` on ``concurrency`` threads and return the wall time."""
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(worker, index) for index in range(concurrency)]:
+            future.result()
+    return time.perf_counter() - started
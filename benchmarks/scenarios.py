@@ -0,0 +1,100 @@
+"""Scripted load scenarios.
+
+Each scenario takes a driver, a recorder and the run options, and returns the
+wall time it spent issuing requests. Setup such as logging players in happens
+before the clock starts.
+"""
+from benchmarks.datagen import BENCHMARK_PASSWORD, username
+from metrics import COUNTER_COLUMNS
+from benchmarks.harness import run_workers
+
+SCENARIOS = {}
+
+
+def scenario(name):
+    def decorator(f):
+        SCENARIOS[name] = f
+        return f
+    return decorator
+
+
+def login(session, i):
+    response = session.request('POST', '/login', json={'username': username(i), 'password': BENCHMARK_PASSWORD})
+    if response.status != 200:
+        raise RuntimeError(f'Could not log in as {username(i)}: {response.status}')
+    return session
+
+
+def player_sessions(driver, options):
+    # Spread players over the dataset so requests do not all hit one user.
+    step = max(options.users // options.concurrency, 1)
+    return [login(driver.session(), (index * step) % options.users) for index in range(options.concurrency)]
+
+
+@scenario('login_storm')
+def login_storm(driver, recorder, options):
+    def worker(index):
+        for n in range(options.requests):
+            i = (index * options.requests + n) % options.users
+            recorder.timed('POST /login', driver.session(), 'POST', '/login',
+                           json={'username': username(i), 'password': BENCHMARK_PASSWORD})
+    return run_workers(worker, options.concurrency)
+
+
+def poll(recorder, session, paths, n, etags):
+    # Polling clients revalidate with If-None-Match after their first fetch.
+    for path in paths:
+        headers = {'If-None-Match': etags[path]} if path in etags and n else None
+        response = recorder.timed(f'GET {path}', session, 'GET', path, expected=(200, 304), headers=headers)
+        if response.headers.get('ETag'):
+            etags[path] = response.headers['ETag']
+
+
+@scenario('dashboard_polling')
+def dashboard_polling(driver, recorder, options):
+    sessions = player_sessions(driver, options)
+    paths = ['/dashboard/bootstrap', '/stats', '/faction/details', '/faction/members']
+
+    def worker(index):
+        etags = {}
+        for n in range(options.requests):
+            poll(recorder, sessions[index], paths, n, etags)
+    return run_workers(worker, options.concurrency)
+
+
+@scenario('async_polling')
+def async_polling(driver, recorder, options):
+    if driver.name != 'asgi':
+        return None
+    sessions = player_sessions(driver, options)
+    paths = ['/async/dashboard/bootstrap', '/async/stats', '/async/faction/details', '/async/faction/members']
+
+    def worker(index):
+        for n in range(options.requests):
+            poll(recorder, sessions[index], paths, n, {})
+    return run_workers(worker, options.concurrency)
+
+
+@scenario('stats_ingestion')
+def stats_ingestion(driver, recorder, options):
+    sessions = player_sessions(driver, options)
+
+    def worker(index):
+        for n in range(options.requests):
+            values = {field: 1_000_000 + n for field in COUNTER_COLUMNS}
+            recorder.timed('POST /stats', sessions[index], 'POST', '/stats', json=values)
+    return run_workers(worker, options.concurrency)
+
+
+@scenario('admin_search')
+def admin_search(driver, recorder, options):
+    # user0 is the generated admin.
+    sessions = [login(driver.session(), 0) for _ in range(options.concurrency)]
+
+    def worker(index):
+        for n in range(options.requests):
+            search = username((index * options.requests + n) % options.users)[:6]
+            recorder.timed('GET /admin/users', sessions[index], 'GET', f'/admin/users?search={search}&page={n % 5 + 1}')
+            if options.postgres:
+                recorder.timed('GET /admin/dashboard', sessions[index], 'GET', '/admin/dashboard')
+    return run_workers(worker, options.concurrency)
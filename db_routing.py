@@ -0,0 +1,137 @@
+from flask import g, has_request_context, current_app, session as flask_session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, text
+from sqlalchemy.sql.dml import UpdateBase
+from functools import wraps
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+REPLICA_BIND_KEY = 'replica'
+PRIMARY_PIN_SESSION_KEY = '_db_primary_until'
+
+POSTGRES_LAG_QUERY = text(
+    "SELECT CASE "
+    "WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) "
+    "END"
+)
+
+
+class ReplicaLagMonitor:
+    """Caches the replication lag of the replica so it is measured at most once
+    per check interval instead of on every query."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._checked_at = 0.0
+        self._lag = None
+
+    def reset(self):
+        with self._lock:
+            self._checked_at = 0.0
+            self._lag = None
+
+    def lag(self, engine, interval):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._checked_at < interval:
+                return self._lag
+            self._checked_at = now
+        lag = self._measure(engine)
+        with self._lock:
+            self._lag = lag
+        return lag
+
+    def _measure(self, engine):
+        # Returns the lag in seconds, or None when the replica cannot be reached.
+        if engine.dialect.name != 'postgresql':
+            return 0.0
+        try:
+            with engine.connect() as connection:
+                return float(connection.execute(POSTGRES_LAG_QUERY).scalar() or 0)
+        except Exception as e:
+            logger.warning(f"Could not measure replica lag, using primary: {str(e)}")
+            return None
+
+
+lag_monitor = ReplicaLagMonitor()
+
+
+def replica_engine(db):
+    """Return the replica engine if one is configured and it is fresh enough."""
+    engine = db.engines.get(REPLICA_BIND_KEY)
+    if engine is None:
+        return None
+
+    config = current_app.config
+    lag = lag_monitor.lag(engine, config['REPLICA_LAG_CHECK_INTERVAL'])
+    if lag is None or lag > config['REPLICA_MAX_LAG_SECONDS']:
+        if lag is not None:
+            logger.warning(f"Replica lag {lag:.1f}s exceeds limit, using primary")
+        return None
+    return engine
+
+
+class RoutingSession(Session):
+    """Session that sends reads from views marked with ``read_replica`` to the
+    replica bind. Writes, pending changes, anything after a flush in the same
+    request, and requests pinned to the primary always use the default bind."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self._can_use_replica(clause):
+            engine = replica_engine(self._db)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _can_use_replica(self, clause):
+        if not has_request_context() or not g.get('db_read_only'):
+            return False
+        # Once the request has written, its reads must see those writes.
+        if g.get('db_pin_primary') or g.get('db_wrote'):
+            return False
+        if isinstance(clause, UpdateBase):
+            return False
+        return not (self.new or self.dirty or self.deleted)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _record_write(session, flush_context):
+    if has_request_context():
+        g.db_wrote = True
+
+
+def read_replica(f):
+    """Allow the queries of a read-only view to be served by the replica."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        g.db_read_only = True
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def use_primary():
+    """Pin the rest of the current request to the primary database."""
+    g.db_pin_primary = True
+
+
+def init_db_routing(app):
+    app.config.setdefault('REPLICA_MAX_LAG_SECONDS', 5.0)
+    app.config.setdefault('REPLICA_LAG_CHECK_INTERVAL', 2.0)
+    app.config.setdefault('READ_YOUR_WRITES_SECONDS', 10.0)
+
+    @app.before_request
+    def pin_recent_writers():
+        # Users who wrote recently read from the primary until the replica caught up.
+        pinned_until = flask_session.get(PRIMARY_PIN_SESSION_KEY)
+        if pinned_until and pinned_until > time.time():
+            g.db_pin_primary = True
+
+    @app.after_request
+    def remember_writes(response):
+        if g.get('db_wrote') and REPLICA_BIND_KEY in app.config.get('SQLALCHEMY_BINDS', {}):
+            flask_session[PRIMARY_PIN_SESSION_KEY] = time.time() + app.config['READ_YOUR_WRITES_SECONDS']
+        return response
@@ -0,0 +1,170 @@
+from collections import Counter
+from sqlalchemy import delete, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+from extensions import db
+from scheduler import schedule_periodic
+from snapshots import latest_snapshot, snapshots_as_of
+from utils import utcnow
+import base64
+import binascii
+import click
+
+SORT_COLUMNS = {'members': 'member_count', 'kills': 'total_kills'}
+# pg_trgm cannot index patterns shorter than a trigram, so shorter queries
+# match name prefixes through the btree index instead.
+TRIGRAM_MIN_LENGTH = 3
+REFRESH_LOCK = 0x66616374
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def summary_rows(faction_id=None):
+    """Directory rows for every faction, or just ``faction_id``: the member
+    count and the kills summed over each member's latest snapshot."""
+    from models import User, Faction
+
+    factions = db.session.query(Faction.id, Faction.name, Faction.member_count)
+    members = User.faction_id.isnot(None)
+    if faction_id is not None:
+        factions = factions.filter(Faction.id == faction_id)
+        members = User.faction_id == faction_id
+    member_factions = dict(db.session.query(User.id, User.faction_id).filter(members))
+    kills = Counter()
+    for user_id, (snapshot,) in snapshots_as_of(members, utcnow()).items():
+        if snapshot and user_id in member_factions:
+            kills[member_factions[user_id]] += snapshot.kills or 0
+    rows = [(faction_id, name, member_count, kills[faction_id]) for faction_id, name, member_count in factions]
+
+    refreshed_at = utcnow()
+    return [{
+        'faction_id': faction_id,
+        'name': name,
+        'name_lower': name.lower(),
+        'member_count': member_count,
+        'total_kills': total_kills,
+        'refreshed_at': refreshed_at,
+    } for faction_id, name, member_count, total_kills in rows]
+
+
+def insert_summary():
+    from models import FactionSummary
+
+    dialect = postgresql if db.session.get_bind().dialect.name == 'postgresql' else sqlite
+    return dialect.insert(FactionSummary)
+
+
+def upsert_summaries(summaries):
+    statement = insert_summary()
+    statement = statement.on_conflict_do_update(
+        index_elements=['faction_id'],
+        set_={column: statement.excluded[column]
+              for column in ('name', 'name_lower', 'member_count', 'total_kills', 'refreshed_at')},
+    )
+    db.session.execute(statement, summaries)
+
+
+def refresh_faction_summaries():
+    """Rebuild the directory table from one aggregate query. Rows are upserted
+    and stale ones deleted in one transaction, so readers see either the old or
+    new rows and concurrent refreshes do not conflict."""
+    from models import FactionSummary
+
+    summaries = summary_rows()
+    stale = delete(FactionSummary)
+    if summaries:
+        upsert_summaries(summaries)
+        stale = stale.where(FactionSummary.refreshed_at < summaries[0]['refreshed_at'])
+    db.session.execute(stale)
+    db.session.commit()
+    return len(summaries)
+
+
+def member_kills(user_ids):
+    return sum((snapshot.kills or 0) for snapshot in map(latest_snapshot, user_ids) if snapshot)
+
+
+def update_faction_summary(faction_id, joined=(), left=()):
+    """Apply a membership change to one faction's directory row without
+    recomputing it: the member count comes from the faction, and the latest
+    kills of the ``joined`` and ``left`` users are added to or taken off the
+    total. Runs in the caller's transaction; the periodic refresh recomputes
+    the totals."""
+    from models import Faction, FactionSummary
+
+    faction = db.session.query(Faction.name, Faction.member_count).filter(Faction.id == faction_id).first()
+    if faction is None:
+        db.session.execute(delete(FactionSummary).where(FactionSummary.faction_id == faction_id))
+        return
+    kills = member_kills(joined) - member_kills(left)
+    statement = insert_summary().values(
+        faction_id=faction_id, name=faction.name, name_lower=faction.name.lower(),
+        member_count=faction.member_count, total_kills=max(kills, 0), refreshed_at=utcnow())
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=['faction_id'],
+        set_={'name': statement.excluded.name, 'name_lower': statement.excluded.name_lower,
+              'member_count': statement.excluded.member_count,
+              'total_kills': FactionSummary.total_kills + kills},
+    ))
+
+
+def encode_cursor(value, faction_id):
+    return base64.urlsafe_b64encode(f'{value}:{faction_id}'.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        value, faction_id = base64.urlsafe_b64decode(padded).decode().split(':')
+        return int(value), int(faction_id)
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        raise InvalidCursor('Invalid cursor')
+
+
+def escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def search_factions(q, sort, after, limit):
+    """One keyset page of the directory, ordered by the sort key then id, both
+    descending, so the next page starts strictly after the cursor row."""
+    from models import FactionSummary
+
+    sort_column = getattr(FactionSummary, SORT_COLUMNS[sort])
+    query = FactionSummary.query
+    if q:
+        pattern = escape_like(q.lower())
+        if len(q) >= TRIGRAM_MIN_LENGTH:
+            pattern = '%' + pattern
+        query = query.filter(FactionSummary.name_lower.like(pattern + '%', escape='\\'))
+    if after:
+        query = query.filter(tuple_(sort_column, FactionSummary.faction_id) < decode_cursor(after))
+
+    rows = query.order_by(sort_column.desc(), FactionSummary.faction_id.desc()).limit(limit + 1).all()
+    page, has_more = rows[:limit], len(rows) > limit
+    next_cursor = None
+    if has_more:
+        last = page[-1]
+        next_cursor = encode_cursor(getattr(last, SORT_COLUMNS[sort]), last.faction_id)
+    return page, next_cursor
+
+
+def init_faction_directory(app):
+    # Membership changes adjust their faction's row; the periodic refresh picks
+    # up everything else, such as members' new kills. It also runs at startup,
+    # in one server process at a time.
+    app.config.setdefault('FACTION_SUMMARY_REFRESH_SECONDS', 300)
+    interval = app.config['FACTION_SUMMARY_REFRESH_SECONDS']
+    if interval:
+        schedule_periodic(app, 'faction-summary-refresh', interval, refresh_faction_summaries,
+                          lock=REFRESH_LOCK)
+
+    @app.cli.group()
+    def factions():
+        """Faction directory commands."""
+
+    @factions.command('refresh')
+    def refresh():
+        """Rebuild the faction directory summary table."""
+        click.echo(f'Refreshed {refresh_faction_summaries()} faction summaries')
@@ -0,0 +1,140 @@
+from flask import current_app
+from collections import defaultdict
+import json
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_PREFIX = 'faction:'
+
+
+class ConnectionLimitExceeded(Exception):
+    pass
+
+
+class InProcessBroker:
+    """Fans faction events out to the event streams connected to this process."""
+
+    def __init__(self, max_connections, max_connections_per_user, queue_size=100):
+        self.max_connections = max_connections
+        self.max_connections_per_user = max_connections_per_user
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+        self._connections_per_user = defaultdict(int)
+        self._connection_count = 0
+
+    def subscribe(self, faction_id, user_id):
+        with self._lock:
+            if self._connection_count >= self.max_connections:
+                raise ConnectionLimitExceeded('Too many open event streams')
+            if self._connections_per_user[user_id] >= self.max_connections_per_user:
+                raise ConnectionLimitExceeded('Too many open event streams for this user')
+            subscriber = queue.Queue(maxsize=self.queue_size)
+            self._subscribers[faction_id].add(subscriber)
+            self._connections_per_user[user_id] += 1
+            self._connection_count += 1
+        return subscriber
+
+    def unsubscribe(self, faction_id, user_id, subscriber):
+        with self._lock:
+            self._subscribers[faction_id].discard(subscriber)
+            if not self._subscribers[faction_id]:
+                del self._subscribers[faction_id]
+            self._connections_per_user[user_id] -= 1
+            if self._connections_per_user[user_id] <= 0:
+                del self._connections_per_user[user_id]
+            self._connection_count -= 1
+
+    def publish(self, faction_id, event):
+        self._deliver(faction_id, event)
+
+    def _deliver(self, faction_id, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(faction_id, ()))
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(event)
+            except queue.Full:
+                # A client that stopped reading should not block everyone else.
+                logger.warning(f"Dropping faction event for a slow subscriber of faction {faction_id}")
+
+
+class RedisBroker(InProcessBroker):
+    """Publishes through Redis so every worker process delivers each event to
+    its own connected streams."""
+
+    def __init__(self, url, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        import redis
+        self._redis = redis.Redis.from_url(url)
+        self._listener = threading.Thread(target=self._listen, name='faction-events', daemon=True)
+        self._listener.start()
+
+    def publish(self, faction_id, event):
+        self._redis.publish(f'{CHANNEL_PREFIX}{faction_id}', json.dumps(event))
+
+    def _listen(self):
+        pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.psubscribe(f'{CHANNEL_PREFIX}*')
+        for message in pubsub.listen():
+            try:
+                channel = message['channel'].decode()
+                faction_id = int(channel[len(CHANNEL_PREFIX):])
+                self._deliver(faction_id, json.loads(message['data']))
+            except (ValueError, KeyError) as e:
+                logger.error(f"Invalid faction event from Redis: {str(e)}")
+
+
+def init_faction_events(app):
+    app.config.setdefault('SSE_MAX_CONNECTIONS', 1000)
+    app.config.setdefault('SSE_MAX_CONNECTIONS_PER_USER', 3)
+    app.config.setdefault('SSE_HEARTBEAT_SECONDS', 15)
+
+    limits = (app.config['SSE_MAX_CONNECTIONS'], app.config['SSE_MAX_CONNECTIONS_PER_USER'])
+    broker_url = app.config.get('FACTION_EVENTS_BROKER_URL')
+    if broker_url:
+        app.logger.info("Faction events are shared through Redis")
+        app.extensions['faction_events'] = RedisBroker(broker_url, *limits)
+    else:
+        app.extensions['faction_events'] = InProcessBroker(*limits)
+
+
+def get_broker():
+    return current_app.extensions['faction_events']
+
+
+def publish_faction_event(faction_id, event_type, **data):
+    """Send an event to the connected members of a faction. Failures are logged
+    rather than raised so they never undo the write that triggered them."""
+    if faction_id is None:
+        return
+    try:
+        get_broker().publish(faction_id, {'type': event_type, **data})
+    except Exception as e:
+        current_app.logger.error(f"Error publishing faction event {event_type}: {str(e)}")
+
+
+def format_sse(event):
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+def event_stream(subscriber, user_id, faction_id, heartbeat, is_member=None):
+    """Yield the faction's events until the user leaves it. ``is_member`` is
+    checked on each heartbeat to catch removals that publish no event."""
+    yield 'retry: 5000\n\n'
+    yield format_sse({'type': 'ready', 'user_id': user_id, 'faction_id': faction_id})
+    while True:
+        try:
+            event = subscriber.get(timeout=heartbeat)
+        except queue.Empty:
+            if is_member and not is_member():
+                return
+            # Keeps proxies from timing out and surfaces dead clients on write.
+            yield ': heartbeat\n\n'
+            continue
+        yield format_sse(event)
+        if event['type'] == 'member_left' and event.get('member', {}).get('id') == user_id:
+            return
@@ -0,0 +1,236 @@
+"""CSV and Parquet exports of faction members' stats history.
+
+Rows are read with ``yield_per`` (a server-side cursor on PostgreSQL) and
+encoded chunk by chunk, so memory stays flat however long the history is. The
+same generators back both the streamed response and background jobs, which
+write to ``EXPORT_DIR`` for a later download. Jobs whose process went away
+before they finished are failed once they are older than
+``EXPORT_JOB_TIMEOUT_SECONDS``, and their partial files removed.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from heapq import merge
+from itertools import islice
+from extensions import db
+from metrics import COUNTER_COLUMNS
+from models import User, Stats, ExportJob
+from scheduler import schedule_periodic
+from stats_partitions import archived_snapshots, archives_between
+from utils import utcnow
+from werkzeug.utils import secure_filename
+import csv
+import io
+import os
+import secrets
+import time
+
+EXPORT_FORMATS = {'csv': ('text/csv', 'csv'), 'parquet': ('application/vnd.apache.parquet', 'parquet')}
+EXPORT_COLUMNS = ['user_id', 'username', 'timestamp'] + COUNTER_COLUMNS
+YIELD_PER = 2000
+PARQUET_ROW_GROUP_SIZE = 50000
+
+executor = None
+
+
+class ExportUnavailable(RuntimeError):
+    pass
+
+
+def export_rows(faction_id, start=None, end=None):
+    """Members' snapshots ordered by user and time, archived months included."""
+    query = db.session.query(
+        Stats.user_id, User.username, Stats.timestamp, *[getattr(Stats, column) for column in COUNTER_COLUMNS]
+    ).join(User, User.id == Stats.user_id).filter(User.faction_id == faction_id)
+    if start:
+        query = query.filter(Stats.timestamp >= start)
+    if end:
+        query = query.filter(Stats.timestamp <= end)
+    rows = query.order_by(Stats.user_id, Stats.timestamp, Stats.id).yield_per(YIELD_PER)
+    if not archives_between(start, end):
+        return rows
+    usernames = dict(db.session.query(User.id, User.username).filter(User.faction_id == faction_id))
+    archived = ((s.user_id, usernames[s.user_id], s.timestamp, *[getattr(s, column) for column in COUNTER_COLUMNS])
+                for s in archived_snapshots(list(usernames), start, end))
+    return merge(archived, rows, key=lambda row: (row[0], row[2]))
+
+
+def iter_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for batch in iter(lambda: list(islice(rows, YIELD_PER)), []):
+        for row in batch:
+            writer.writerow([row[0], row[1], row[2].isoformat() if row[2] else None, *row[3:]])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+class ChunkSink(io.RawIOBase):
+    """Write-only file that hands out what was written since the last drain.
+    Tracks its own position, which the Parquet footer offsets depend on."""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def parquet_schema():
+    import pyarrow as pa
+
+    return pa.schema(
+        [('user_id', pa.int64()), ('username', pa.string()), ('timestamp', pa.timestamp('us'))]
+        + [(column, pa.int64()) for column in COUNTER_COLUMNS]
+    )
+
+
+def iter_parquet(rows):
+    """One Parquet row group per ``PARQUET_ROW_GROUP_SIZE`` rows, each yielded
+    as soon as it is encoded."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = parquet_schema()
+    sink = ChunkSink()
+    writer = pq.ParquetWriter(pa.PythonFile(sink, mode='w'), schema, compression='zstd')
+    for batch in iter(lambda: list(islice(rows, PARQUET_ROW_GROUP_SIZE)), []):
+        columns = list(zip(*batch))
+        writer.write_table(pa.Table.from_arrays([pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                                                schema=schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def check_export_format(export_format):
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"format must be one of: {', '.join(EXPORT_FORMATS)}")
+    if export_format == 'parquet':
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ExportUnavailable('Parquet export requires pyarrow')
+
+
+def export_chunks(export_format, faction_id, start=None, end=None):
+    # A generator, so a streamed response queries inside its own context rather
+    # than on the view's session, which is closed before streaming starts.
+    rows = iter(export_rows(faction_id, start, end))
+    yield from iter_parquet(rows) if export_format == 'parquet' else iter_csv(rows)
+
+
+def export_filename(faction, export_format):
+    return secure_filename(f"{faction.name}-stats.{EXPORT_FORMATS[export_format][1]}")
+
+
+def export_path(app, job):
+    return os.path.join(app.config['EXPORT_DIR'], f'{job.id}.{EXPORT_FORMATS[job.format][1]}')
+
+
+def run_export_job(app, job_id):
+    with app.app_context():
+        job = db.session.get(ExportJob, job_id)
+        path = export_path(app, job)
+        try:
+            job.status = 'running'
+            db.session.commit()
+            # Written under a temporary name so a download never sees a partial file.
+            with open(path + '.part', 'wb') as f:
+                for chunk in export_chunks(job.format, job.faction_id, job.range_start, job.range_end):
+                    f.write(chunk.encode() if isinstance(chunk, str) else chunk)
+            os.replace(path + '.part', path)
+            job.status = 'done'
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(f"Export job {job_id} failed: {str(e)}")
+            job.status = 'failed'
+            job.error = str(e)
+        finally:
+            job.finished_at = utcnow()
+            db.session.commit()
+            db.session.remove()
+
+
+def start_export_job(app, faction_id, user_id, export_format, start=None, end=None):
+    prune_exports(app)
+    job = ExportJob(id=secrets.token_hex(16), faction_id=faction_id, user_id=user_id, format=export_format,
+                    range_start=start, range_end=end, status='pending',
+                    created_at=utcnow())
+    db.session.add(job)
+    db.session.commit()
+    executor.submit(run_export_job, app, job.id)
+    return job
+
+
+def remove_file(path):
+    # Another process may be pruning the same directory.
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def fail_interrupted_jobs(app):
+    """Fail jobs still pending or running after ``EXPORT_JOB_TIMEOUT_SECONDS``:
+    the process running them was restarted or died. Younger ones are left
+    alone, as they may belong to another worker process that is still at it."""
+    cutoff = utcnow() - timedelta(seconds=app.config['EXPORT_JOB_TIMEOUT_SECONDS'])
+    interrupted = ExportJob.query.filter(ExportJob.created_at < cutoff, ExportJob.status.in_(['pending', 'running'])).all()
+    for job in interrupted:
+        app.logger.warning(f"Export job {job.id} was interrupted before it finished")
+        remove_file(export_path(app, job) + '.part')
+        job.status = 'failed'
+        job.error = 'Interrupted before it finished'
+        job.finished_at = utcnow()
+    db.session.commit()
+
+
+def prune_exports(app):
+    """Delete finished exports older than ``EXPORT_RETENTION_SECONDS``, and
+    partial files no job will finish. Runs whenever a new job starts, and at
+    startup and every ``EXPORT_CLEANUP_SECONDS``."""
+    fail_interrupted_jobs(app)
+    cutoff = utcnow() - timedelta(seconds=app.config['EXPORT_RETENTION_SECONDS'])
+    expired = ExportJob.query.filter(ExportJob.created_at < cutoff, ExportJob.status.in_(['done', 'failed'])).all()
+    for job in expired:
+        remove_file(export_path(app, job))
+        db.session.delete(job)
+    db.session.commit()
+
+    # Also catches files of jobs deleted with their faction while running.
+    stale = time.time() - app.config['EXPORT_JOB_TIMEOUT_SECONDS']
+    for entry in os.scandir(app.config['EXPORT_DIR']):
+        if entry.name.endswith('.part') and entry.stat().st_mtime < stale:
+            remove_file(entry.path)
+
+
+def init_faction_export(app):
+    global executor
+
+    app.config.setdefault('EXPORT_DIR', os.path.join(app.instance_path, 'exports'))
+    app.config.setdefault('EXPORT_WORKERS', 2)
+    app.config.setdefault('EXPORT_RETENTION_SECONDS', 86400)
+    app.config.setdefault('EXPORT_JOB_TIMEOUT_SECONDS', 3600)
+    app.config.setdefault('EXPORT_CLEANUP_SECONDS', 3600)
+    os.makedirs(app.config['EXPORT_DIR'], exist_ok=True)
+    executor = ThreadPoolExecutor(max_workers=app.config['EXPORT_WORKERS'], thread_name_prefix='faction-export')
+    interval = app.config['EXPORT_CLEANUP_SECONDS']
+    if interval:
+        schedule_periodic(app, 'export-cleanup', interval, lambda: prune_exports(app))
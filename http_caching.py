@@ -0,0 +1,39 @@
+from flask import request, make_response, current_app
+from functools import wraps
+import hashlib
+
+
+def make_etag(version):
+    return hashlib.sha1(repr(version).encode()).hexdigest()[:20]
+
+
+def conditional(version_func):
+    """Answer conditional GETs for a JSON read view from a cheap version marker.
+
+    ``version_func`` returns something that changes whenever the response body
+    would (for example the newest row id), or None to skip caching. When the
+    client's If-None-Match matches, the view itself is never run.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            version = version_func()
+            if version is None:
+                return f(*args, **kwargs)
+
+            etag = make_etag(version)
+            if request.if_none_match.contains_weak(etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag, weak=True)
+            # Per-user data: browsers may keep it, but must revalidate every time.
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            response.vary.add('Cookie')
+            return response
+        return decorated_function
+    return decorator
@@ -0,0 +1,145 @@
+"""Derived metrics computed from ``Stats`` counters.
+
+Metrics are declared as arithmetic expressions over ``Stats`` column names and
+compiled once into NumPy operations, so any number of snapshots is evaluated
+with a handful of array operations instead of a Python loop per row. Division
+by zero yields 0, matching how the win rate has always been reported.
+"""
+from collections import OrderedDict
+import ast
+import operator
+import threading
+import numpy as np
+
+COUNTER_COLUMNS = [
+    'total_wins', 'total_losses', 'assaults_won', 'assaults_lost',
+    'defending_battles_won', 'defending_battles_lost', 'kills', 'destroyed_traps',
+    'lost_associates', 'lost_traps', 'healed_associates', 'wounded_enemy_associates',
+    'enemy_turfs_destroyed', 'turf_destroyed_times', 'eliminated_enemy_influence',
+]
+
+
+def _divide(numerator, denominator):
+    numerator, denominator = np.broadcast_arrays(numerator, denominator)
+    out = np.zeros(numerator.shape, dtype=np.float64)
+    return np.divide(numerator, denominator, out=out, where=denominator != 0)
+
+
+OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: _divide,
+}
+
+
+class Metric:
+    def __init__(self, name, expression, decimals=2):
+        self.name = name
+        self.expression = expression
+        self.decimals = decimals
+        self.columns = set()
+        self._evaluate = self._compile(ast.parse(expression, mode='eval').body)
+
+    def _compile(self, node):
+        # Only column names, numbers and + - * / are allowed.
+        if isinstance(node, ast.Name):
+            if node.id not in COUNTER_COLUMNS:
+                raise ValueError(f"Unknown column '{node.id}' in metric {self.name}")
+            self.columns.add(node.id)
+            return lambda columns: columns[node.id]
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+            return lambda columns: node.value
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+            operand = self._compile(node.operand)
+            return lambda columns: -operand(columns)
+        if isinstance(node, ast.BinOp) and type(node.op) in OPERATORS:
+            op = OPERATORS[type(node.op)]
+            left, right = self._compile(node.left), self._compile(node.right)
+            return lambda columns: op(left(columns), right(columns))
+        raise ValueError(f"Unsupported expression in metric {self.name}: {ast.dump(node)}")
+
+    def evaluate(self, columns):
+        values = np.asarray(self._evaluate(columns), dtype=np.float64)
+        return np.round(np.broadcast_to(values, len(next(iter(columns.values())))), self.decimals)
+
+
+class MetricRegistry:
+    def __init__(self):
+        self.metrics = OrderedDict()
+
+    def register(self, name, expression, decimals=2):
+        self.metrics[name] = Metric(name, expression, decimals)
+
+    @property
+    def columns(self):
+        return sorted(set().union(*(metric.columns for metric in self.metrics.values())))
+
+    def evaluate(self, columns):
+        """Evaluate every metric over column arrays of equal length."""
+        columns = {name: np.asarray(values, dtype=np.float64) for name, values in columns.items()}
+        return {name: metric.evaluate(columns) for name, metric in self.metrics.items()}
+
+
+registry = MetricRegistry()
+registry.register('win_rate', 'total_wins / (total_wins + total_losses) * 100')
+registry.register('kd_ratio', 'kills / lost_associates')
+registry.register('assault_win_rate', 'assaults_won / (assaults_won + assaults_lost) * 100')
+registry.register('defence_win_rate', 'defending_battles_won / (defending_battles_won + defending_battles_lost) * 100')
+registry.register('trap_efficiency', 'destroyed_traps / (destroyed_traps + lost_traps) * 100')
+registry.register('heal_ratio', 'healed_associates / lost_associates * 100')
+
+
+class SnapshotMetricCache:
+    """LRU memo of derived metrics by snapshot key (see ``snapshot_key``).
+    Snapshots are never updated, so an entry stays valid for as long as the
+    registry is unchanged."""
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get_many(self, keys):
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    found[key] = self._entries[key]
+        return found
+
+    def put_many(self, items):
+        with self._lock:
+            for key, values in items:
+                self._entries[key] = values
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+snapshot_cache = SnapshotMetricCache()
+
+
+def snapshot_key(snapshot):
+    # Ids alone can come back after a delete (SQLite reuses them), so the
+    # counters the metrics are computed from are part of the key.
+    return (snapshot.id,) + tuple(getattr(snapshot, column) for column in registry.columns)
+
+
+def snapshot_metrics(snapshots):
+    """Derived metrics for a sequence of ``Stats`` rows (or objects with the same
+    attributes), returned as one dict per snapshot in the same order."""
+    keys = [snapshot_key(s) if s.id is not None else None for s in snapshots]
+    cached = snapshot_cache.get_many(key for key in keys if key is not None)
+    pending = [s for s, key in zip(snapshots, keys) if key not in cached]
+    if pending:
+        columns = {
+            column: np.fromiter((getattr(s, column) or 0 for s in pending), dtype=np.float64, count=len(pending))
+            for column in registry.columns
+        }
+        values = registry.evaluate(columns)
+        computed = [{name: float(values[name][i]) for name in values} for i in range(len(pending))]
+        snapshot_cache.put_many((snapshot_key(s), metrics) for s, metrics in zip(pending, computed) if s.id is not None)
+        computed_by_snapshot = dict(zip(map(id, pending), computed))
+    return [cached[key] if key in cached else computed_by_snapshot[id(s)] for s, key in zip(snapshots, keys)]
@@ -7,6 +7,7 @@ Create Date: 2024-10-04 20:24:52.830106
 """
 from alembic import op
 import sqlalchemy as sa
+from online_migrations import batched_backfill, change_column_types, set_not_null_online
 
 
 # revision identifiers, used by Alembic.
@@ -15,6 +16,11 @@ down_revision = None
 branch_labels = None
 depends_on = None
 
+BIGINT_COLUMNS = [
+    'kills', 'destroyed_traps', 'lost_associates', 'lost_traps',
+    'healed_associates', 'wounded_enemy_associates', 'eliminated_enemy_influence',
+]
+
 
 def upgrade():
     # ### commands auto generated by Alembic - please adjust! ###
@@ -24,41 +30,13 @@ def upgrade():
         batch_op.drop_column('leader_id')
 
     # Update existing rows with a default value for leader_username
-    op.execute("UPDATE faction SET leader_username = 'Unknown Leader' WHERE leader_username IS NULL")
+    batched_backfill('faction', "leader_username = 'Unknown Leader'", where='leader_username IS NULL')
 
     # Make leader_username non-nullable
-    with op.batch_alter_table('faction', schema=None) as batch_op:
-        batch_op.alter_column('leader_username', nullable=False)
-
-    with op.batch_alter_table('stats', schema=None) as batch_op:
-        batch_op.alter_column('kills',
-               existing_type=sa.INTEGER(),
-               type_=sa.BigInteger(),
-               existing_nullable=True)
-        batch_op.alter_column('destroyed_traps',
-               existing_type=sa.INTEGER(),
-               type_=sa.BigInteger(),
-               existing_nullable=True)
-        batch_op.alter_column('lost_associates',
-               existing_type=sa.INTEGER(),
-               type_=sa.BigInteger(),
-               existing_nullable=True)
-        batch_op.alter_column('lost_traps',
-               existing_type=sa.INTEGER(),
-               type_=sa.BigInteger(),
-               existing_nullable=True)
-        batch_op.alter_column('healed_associates',
-               existing_type=sa.INTEGER(),
-               type_=sa.BigInteger(),
-               existing_nullable=True)
-        batch_op.alter_column('wounded_enemy_associates',
-               existing_type=sa.INTEGER(),
-               type_=sa.BigInteger(),
-               existing_nullable=True)
-        batch_op.alter_column('eliminated_enemy_influence',
-               existing_type=sa.INTEGER(),
-               type_=sa.BigInteger(),
-               existing_nullable=True)
+    set_not_null_online('faction', 'leader_username')
+
+    # Widened through shadow columns so stats stays writable during the copy.
+    change_column_types('stats', {column: sa.BigInteger() for column in BIGINT_COLUMNS})
 
     with op.batch_alter_table('user', schema=None) as batch_op:
         batch_op.add_column(sa.Column('is_admin', sa.Boolean(), nullable=True))
@@ -71,35 +49,7 @@ def downgrade():
     with op.batch_alter_table('user', schema=None) as batch_op:
         batch_op.drop_column('is_admin')
 
-    with op.batch_alter_table('stats', schema=None) as batch_op:
-        batch_op.alter_column('eliminated_enemy_influence',
-               existing_type=sa.BigInteger(),
-               type_=sa.INTEGER(),
-               existing_nullable=True)
-        batch_op.alter_column('wounded_enemy_associates',
-               existing_type=sa.BigInteger(),
-               type_=sa.INTEGER(),
-               existing_nullable=True)
-        batch_op.alter_column('healed_associates',
-               existing_type=sa.BigInteger(),
-               type_=sa.INTEGER(),
-               existing_nullable=True)
-        batch_op.alter_column('lost_traps',
-               existing_type=sa.BigInteger(),
-               type_=sa.INTEGER(),
-               existing_nullable=True)
-        batch_op.alter_column('lost_associates',
-               existing_type=sa.BigInteger(),
-               type_=sa.INTEGER(),
-               existing_nullable=True)
-        batch_op.alter_column('destroyed_traps',
-               existing_type=sa.BigInteger(),
-               type_=sa.INTEGER(),
-               existing_nullable=True)
-        batch_op.alter_column('kills',
-               existing_type=sa.BigInteger(),
-               type_=sa.INTEGER(),
-               existing_nullable=True)
+    change_column_types('stats', {column: sa.INTEGER() for column in BIGINT_COLUMNS})
 
     with op.batch_alter_table('faction', schema=None) as batch_op:
         batch_op.add_column(sa.Column('leader_id', sa.INTEGER(), autoincrement=False, nullable=False))
@@ -0,0 +1,37 @@
+"""Add denormalized faction member_count and leader_id foreign key
+
+Revision ID: 28ec951ecf3e
+Revises: 5a43a9a146f0
+Create Date: 2026-10-19 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from online_migrations import add_foreign_key_online, batched_backfill, create_index_concurrently, drop_index_concurrently
+
+
+# revision identifiers, used by Alembic.
+revision = '28ec951ecf3e'
+down_revision = '5a43a9a146f0'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    with op.batch_alter_table('faction', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('member_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('leader_id', sa.Integer(), nullable=True))
+
+    batched_backfill('faction',
+                     'member_count = (SELECT COUNT(*) FROM "user" WHERE "user".faction_id = faction.id), '
+                     'leader_id = (SELECT "user".id FROM "user" WHERE "user".username = faction.leader_username)')
+
+    create_index_concurrently('ix_faction_leader_id', 'faction', ['leader_id'], unique=False)
+    add_foreign_key_online('fk_faction_leader', 'faction', 'user', ['leader_id'], ['id'], ondelete='SET NULL')
+
+
+def downgrade():
+    drop_index_concurrently('ix_faction_leader_id', 'faction')
+    with op.batch_alter_table('faction', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_faction_leader', type_='foreignkey')
+        batch_op.drop_column('leader_id')
+        batch_op.drop_column('member_count')
@@ -0,0 +1,31 @@
+"""Add faction membership_version and stats (user_id, id) index
+
+Revision ID: 5a43a9a146f0
+Revises: 5174f55f7158, d7de2a8aef39
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from online_migrations import create_index_concurrently, drop_index_concurrently
+
+
+# revision identifiers, used by Alembic.
+revision = '5a43a9a146f0'
+down_revision = ('5174f55f7158', 'd7de2a8aef39')
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('faction', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('membership_version', sa.Integer(), server_default='0', nullable=False))
+
+    create_index_concurrently('ix_stats_user_id_id', 'stats', ['user_id', 'id'], unique=False)
+
+
+def downgrade():
+    drop_index_concurrently('ix_stats_user_id_id', 'stats')
+
+    with op.batch_alter_table('faction', schema=None) as batch_op:
+        batch_op.drop_column('membership_version')
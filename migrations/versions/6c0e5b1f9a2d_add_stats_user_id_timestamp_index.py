@@ -0,0 +1,23 @@
+"""Add stats (user_id, timestamp, id) index for as-of lookups
+
+Revision ID: 6c0e5b1f9a2d
+Revises: d095ace7e65d
+Create Date: 2026-10-19 15:00:00.000000
+
+"""
+from online_migrations import create_index_concurrently, drop_index_concurrently
+
+
+# revision identifiers, used by Alembic.
+revision = '6c0e5b1f9a2d'
+down_revision = 'd095ace7e65d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    create_index_concurrently('ix_stats_user_id_timestamp', 'stats', ['user_id', 'timestamp', 'id'], unique=False)
+
+
+def downgrade():
+    drop_index_concurrently('ix_stats_user_id_timestamp', 'stats')
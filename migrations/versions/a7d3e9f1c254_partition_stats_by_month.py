@@ -0,0 +1,116 @@
+"""Partition stats by month and add stats_archive
+
+Revision ID: a7d3e9f1c254
+Revises: f2c86e4b1a93
+Create Date: 2026-10-19 19:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from datetime import date, datetime, timezone
+import logging
+from online_migrations import batched_backfill, copy_table_online, drop_mirror_trigger, is_postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7d3e9f1c254'
+down_revision = 'f2c86e4b1a93'
+branch_labels = None
+depends_on = None
+
+logger = logging.getLogger('alembic.online')
+
+MONTHS_AHEAD = 3
+INDEXES = {
+    'ix_stats_user_id_id': 'user_id, id',
+    'ix_stats_user_id_timestamp': 'user_id, timestamp, id',
+}
+
+
+def fill_missing_timestamps():
+    # A snapshot's id follows insertion order, so the previous snapshot's time is the best guess.
+    batched_backfill(
+        'stats',
+        'timestamp = COALESCE((SELECT s.timestamp FROM stats s WHERE s.id < stats.id AND s.timestamp IS NOT NULL '
+        'ORDER BY s.id DESC LIMIT 1), CURRENT_TIMESTAMP)',
+        where='timestamp IS NULL'
+    )
+
+
+def add_months(month, count):
+    months = month.year * 12 + month.month - 1 + count
+    return date(months // 12, months % 12 + 1, 1)
+
+
+def create_partitions(table, since):
+    """The default partition and one per month from ``since`` to
+    ``MONTHS_AHEAD`` months from now, named as stats_partitions names them."""
+    op.execute(f'CREATE TABLE stats_default PARTITION OF {table} DEFAULT')
+    now = datetime.now(timezone.utc)
+    month, last = since, add_months(date(now.year, now.month, 1), MONTHS_AHEAD)
+    while month <= last:
+        end = add_months(month, 1)
+        op.execute(f"CREATE TABLE stats_y{month.year}m{month.month:02d} PARTITION OF {table} "
+                   f"FOR VALUES FROM ('{month.isoformat()}') TO ('{end.isoformat()}')")
+        month = end
+
+
+def rebuild_stats(replacement, partitioned):
+    """Copy stats into a new table shaped by ``partitioned`` and swap it in.
+    Writes keep flowing into stats until the final rename."""
+    columns = [column['name'] for column in sa.inspect(op.get_bind()).get_columns('stats')]
+    if partitioned:
+        op.execute(f'CREATE TABLE {replacement} (LIKE stats INCLUDING DEFAULTS) PARTITION BY RANGE (timestamp)')
+        op.execute(f'ALTER TABLE {replacement} ALTER COLUMN timestamp SET NOT NULL')
+        op.execute(f'ALTER TABLE {replacement} ADD CONSTRAINT {replacement}_pkey PRIMARY KEY (id, timestamp)')
+        oldest = op.get_bind().execute(sa.text('SELECT MIN(timestamp) FROM stats')).scalar() or datetime.now(timezone.utc)
+        create_partitions(replacement, date(oldest.year, oldest.month, 1))
+    else:
+        op.execute(f'CREATE TABLE {replacement} (LIKE stats INCLUDING DEFAULTS)')
+        op.execute(f'ALTER TABLE {replacement} ADD CONSTRAINT {replacement}_pkey PRIMARY KEY (id)')
+    op.execute(f'ALTER TABLE {replacement} ADD CONSTRAINT {replacement}_user_id_fkey FOREIGN KEY (user_id) REFERENCES "user" (id)')
+    # Built while the table is still empty; indexes on a partitioned table cannot be built concurrently.
+    for name, index_columns in INDEXES.items():
+        op.execute(f'CREATE INDEX {name}_new ON {replacement} ({index_columns})')
+
+    copy_table_online('stats', replacement, columns)
+
+    op.execute('LOCK TABLE stats IN ACCESS EXCLUSIVE MODE')
+    drop_mirror_trigger('stats', replacement)
+    op.execute('ALTER TABLE stats RENAME TO stats_old')
+    op.execute(f'ALTER TABLE {replacement} RENAME TO stats')
+    op.execute('ALTER SEQUENCE stats_id_seq OWNED BY stats.id')
+    op.execute('DROP TABLE stats_old')
+    op.execute(f'ALTER TABLE stats RENAME CONSTRAINT {replacement}_pkey TO stats_pkey')
+    op.execute(f'ALTER TABLE stats RENAME CONSTRAINT {replacement}_user_id_fkey TO stats_user_id_fkey')
+    for name in INDEXES:
+        op.execute(f'ALTER INDEX {name}_new RENAME TO {name}')
+
+
+def upgrade():
+    op.create_table('stats_archive',
+    sa.Column('month', sa.Date(), nullable=False),
+    sa.Column('path', sa.String(length=512), nullable=False),
+    sa.Column('row_count', sa.Integer(), nullable=False),
+    sa.Column('archived_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('month')
+    )
+
+    fill_missing_timestamps()
+    if not is_postgresql():
+        with op.batch_alter_table('stats', schema=None) as batch_op:
+            batch_op.alter_column('timestamp', existing_type=sa.DateTime(), nullable=False)
+        return
+    rebuild_stats('stats_partitioned', partitioned=True)
+
+
+def downgrade():
+    if is_postgresql():
+        archived = op.get_bind().execute(sa.text('SELECT COUNT(*) FROM stats_archive')).scalar()
+        if archived:
+            logger.warning(f'{archived} archived months stay in their Parquet files and are not restored')
+        rebuild_stats('stats_unpartitioned', partitioned=False)
+    with op.batch_alter_table('stats', schema=None) as batch_op:
+        batch_op.alter_column('timestamp', existing_type=sa.DateTime(), nullable=True)
+
+    op.drop_table('stats_archive')
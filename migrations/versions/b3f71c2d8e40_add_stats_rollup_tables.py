@@ -0,0 +1,64 @@
+"""Add stats_daily, stats_weekly and rollup_watermark tables
+
+Revision ID: b3f71c2d8e40
+Revises: 6c0e5b1f9a2d
+Create Date: 2026-10-19 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3f71c2d8e40'
+down_revision = '6c0e5b1f9a2d'
+branch_labels = None
+depends_on = None
+
+# The Stats counters when this revision was written; later ones need their own migration.
+COUNTER_COLUMNS = [
+    'total_wins', 'total_losses', 'assaults_won', 'assaults_lost', 'defending_battles_won',
+    'defending_battles_lost', 'kills', 'destroyed_traps', 'lost_associates', 'lost_traps',
+    'healed_associates', 'wounded_enemy_associates', 'enemy_turfs_destroyed', 'turf_destroyed_times',
+    'eliminated_enemy_influence',
+]
+
+def create_rollup_table(name):
+    counter_columns = []
+    for counter in COUNTER_COLUMNS:
+        counter_columns.append(sa.Column(counter, sa.BigInteger(), nullable=False))
+        counter_columns.append(sa.Column(f'{counter}_delta', sa.BigInteger(), nullable=False))
+
+    op.create_table(name,
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('period_start', sa.Date(), nullable=False),
+    sa.Column('faction_id', sa.Integer(), nullable=True),
+    sa.Column('last_stats_id', sa.Integer(), nullable=False),
+    sa.Column('last_timestamp', sa.DateTime(), nullable=False),
+    sa.Column('snapshot_count', sa.Integer(), nullable=False),
+    *counter_columns,
+    sa.ForeignKeyConstraint(['faction_id'], ['faction.id'], ondelete='SET NULL'),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'period_start')
+    )
+    with op.batch_alter_table(name, schema=None) as batch_op:
+        batch_op.create_index(f'ix_{name}_faction_id_period_start', ['faction_id', 'period_start'], unique=False)
+
+
+def upgrade():
+    create_rollup_table('stats_daily')
+    create_rollup_table('stats_weekly')
+    op.create_table('rollup_watermark',
+    sa.Column('name', sa.String(length=64), nullable=False),
+    sa.Column('last_stats_id', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('rollup_watermark')
+    for name in ('stats_weekly', 'stats_daily'):
+        with op.batch_alter_table(name, schema=None) as batch_op:
+            batch_op.drop_index(f'ix_{name}_faction_id_period_start')
+        op.drop_table(name)
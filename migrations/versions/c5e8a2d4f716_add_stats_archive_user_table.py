@@ -0,0 +1,44 @@
+"""Add stats_archive_user, the users in each archived month
+
+Revision ID: c5e8a2d4f716
+Revises: a7d3e9f1c254
+Create Date: 2026-10-19 21:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5e8a2d4f716'
+down_revision = 'a7d3e9f1c254'
+branch_labels = None
+depends_on = None
+
+
+def index_existing_archives():
+    stats_archive = sa.table('stats_archive', sa.column('month', sa.Date), sa.column('path', sa.String))
+    archives = op.get_bind().execute(sa.select(stats_archive.c.month, stats_archive.c.path)).all()
+    if not archives:
+        return
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    stats_archive_user = sa.table('stats_archive_user', sa.column('user_id', sa.Integer), sa.column('month', sa.Date))
+    for month, path in archives:
+        user_ids = pc.unique(pq.read_table(path, columns=['user_id'])['user_id']).to_pylist()
+        op.bulk_insert(stats_archive_user, [{'user_id': user_id, 'month': month} for user_id in user_ids])
+
+
+def upgrade():
+    op.create_table('stats_archive_user',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('month', sa.Date(), nullable=False),
+    sa.ForeignKeyConstraint(['month'], ['stats_archive.month'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'month')
+    )
+    index_existing_archives()
+
+
+def downgrade():
+    op.drop_table('stats_archive_user')
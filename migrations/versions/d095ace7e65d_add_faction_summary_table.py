@@ -0,0 +1,56 @@
+"""Add faction_summary table for the faction directory
+
+Revision ID: d095ace7e65d
+Revises: 28ec951ecf3e
+Create Date: 2026-10-19 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd095ace7e65d'
+down_revision = '28ec951ecf3e'
+branch_labels = None
+depends_on = None
+
+
+def trigram_available():
+    return op.get_bind().execute(sa.text("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")).scalar() is not None
+
+
+def upgrade():
+    op.create_table('faction_summary',
+    sa.Column('faction_id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=64), nullable=False),
+    sa.Column('name_lower', sa.String(length=64), nullable=False),
+    sa.Column('member_count', sa.Integer(), nullable=False),
+    sa.Column('total_kills', sa.BigInteger(), nullable=False),
+    sa.Column('refreshed_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['faction_id'], ['faction.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('faction_id')
+    )
+    with op.batch_alter_table('faction_summary', schema=None) as batch_op:
+        batch_op.create_index('ix_faction_summary_members', ['member_count', 'faction_id'], unique=False)
+        batch_op.create_index('ix_faction_summary_kills', ['total_kills', 'faction_id'], unique=False)
+        batch_op.create_index('ix_faction_summary_name_lower', ['name_lower'], unique=False,
+                              postgresql_ops={'name_lower': 'text_pattern_ops'})
+
+    if op.get_bind().dialect.name == 'postgresql' and trigram_available():
+        # Substring name search; not declared on the model because it needs pg_trgm.
+        # Without the extension, such searches scan the (small) table instead.
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        op.create_index('ix_faction_summary_name_trgm', 'faction_summary', ['name_lower'], unique=False,
+                        postgresql_using='gin', postgresql_ops={'name_lower': 'gin_trgm_ops'})
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.drop_index('ix_faction_summary_name_trgm', table_name='faction_summary', if_exists=True)
+    with op.batch_alter_table('faction_summary', schema=None) as batch_op:
+        batch_op.drop_index('ix_faction_summary_name_lower')
+        batch_op.drop_index('ix_faction_summary_kills')
+        batch_op.drop_index('ix_faction_summary_members')
+
+    op.drop_table('faction_summary')
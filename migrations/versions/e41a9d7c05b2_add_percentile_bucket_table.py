@@ -0,0 +1,38 @@
+"""Add percentile_bucket table for quantile sketches
+
+Revision ID: e41a9d7c05b2
+Revises: b3f71c2d8e40
+Create Date: 2026-10-19 17:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import logging
+
+
+# revision identifiers, used by Alembic.
+revision = 'e41a9d7c05b2'
+down_revision = 'b3f71c2d8e40'
+branch_labels = None
+depends_on = None
+
+logger = logging.getLogger('alembic.runtime.migration')
+
+
+def upgrade():
+    op.create_table('percentile_bucket',
+    sa.Column('scope', sa.String(length=32), nullable=False),
+    sa.Column('metric', sa.String(length=64), nullable=False),
+    sa.Column('bucket', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('count', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('scope', 'metric', 'bucket')
+    )
+    # Stats updates only move values between buckets, so they have to start
+    # from the existing players' latest snapshots. The bucket math lives in the
+    # app, which migrations do not import; `flask percentiles rebuild` seeds them.
+    if op.get_bind().execute(sa.text('SELECT 1 FROM stats LIMIT 1')).first():
+        logger.warning('Run `flask percentiles rebuild` to seed the percentile sketches from existing stats')
+
+
+def downgrade():
+    op.drop_table('percentile_bucket')
@@ -1,7 +1,11 @@
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import DDL, event
+from sqlalchemy.orm import declared_attr
 from sqlalchemy.sql import func
 from extensions import db
+from metrics import COUNTER_COLUMNS
+from stats_partitions import create_initial_partitions
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -12,7 +16,7 @@ class User(UserMixin, db.Model):
     created_at = db.Column(db.DateTime(timezone=True), server_default=func.now())
     stats = db.relationship('Stats', backref='user', lazy=True)
     faction_id = db.Column(db.Integer, db.ForeignKey('faction.id', name='fk_user_faction'), nullable=True)
-    faction = db.relationship('Faction', back_populates='members')
+    faction = db.relationship('Faction', back_populates='members', foreign_keys=[faction_id])
     feature_access = db.relationship('FeatureAccess', backref='user', lazy=True)
 
     def set_password(self, password):
@@ -45,14 +49,126 @@ class Stats(db.Model):
     enemy_turfs_destroyed = db.Column(db.Integer, default=0)
     turf_destroyed_times = db.Column(db.Integer, default=0)
     eliminated_enemy_influence = db.Column(db.BigInteger, default=0)
-    timestamp = db.Column(db.DateTime, server_default=db.func.now())
+    timestamp = db.Column(db.DateTime, nullable=False, server_default=db.func.now())
+
+    __table_args__ = (
+        # On PostgreSQL the table is partitioned by month (see stats_partitions), and
+        # a partitioned table's primary key has to include the partition key.
+        db.PrimaryKeyConstraint('id').ddl_if(callable_=lambda ddl, target, bind, **kw: kw['dialect'].name != 'postgresql'),
+        db.Index('ix_stats_user_id_id', 'user_id', 'id'),
+        # Covers as-of seeks: the latest snapshot for a user at or before a time.
+        db.Index('ix_stats_user_id_timestamp', 'user_id', 'timestamp', 'id'),
+        {'postgresql_partition_by': 'RANGE (timestamp)'},
+    )
+
+event.listen(Stats.__table__, 'after_create',
+             DDL('ALTER TABLE stats ADD CONSTRAINT stats_pkey PRIMARY KEY (id, timestamp)').execute_if(dialect='postgresql'))
+event.listen(Stats.__table__, 'after_create', create_initial_partitions)
 
 class Faction(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(64), unique=True, nullable=False)
     invitation_code = db.Column(db.String(16), unique=True, nullable=False)
     leader_username = db.Column(db.String(64), nullable=False)
-    members = db.relationship('User', back_populates='faction', lazy=True)
+    # use_alter breaks the user <-> faction foreign key cycle for create_all/drop_all.
+    leader_id = db.Column(db.Integer, db.ForeignKey('user.id', name='fk_faction_leader', use_alter=True, ondelete='SET NULL'),
+                          nullable=True, index=True)
+    leader = db.relationship('User', foreign_keys=[leader_id], post_update=True)
+    members = db.relationship('User', back_populates='faction', lazy=True, foreign_keys='User.faction_id')
+    member_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    membership_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    def update_membership(self, delta):
+        # Evaluated in SQL so concurrent joins and leaves never lose an update.
+        self.member_count = Faction.member_count + delta
+        self.membership_version = Faction.membership_version + 1
+
+class FactionSummary(db.Model):
+    """Periodically refreshed per-faction aggregates backing the public directory."""
+    faction_id = db.Column(db.Integer, db.ForeignKey('faction.id', ondelete='CASCADE'), primary_key=True)
+    name = db.Column(db.String(64), nullable=False)
+    name_lower = db.Column(db.String(64), nullable=False)
+    member_count = db.Column(db.Integer, nullable=False, default=0)
+    total_kills = db.Column(db.BigInteger, nullable=False, default=0)
+    refreshed_at = db.Column(db.DateTime, nullable=False)
+
+    # Keyset pagination walks these backwards; the trigram index on name_lower
+    # needs pg_trgm and is created by the migration only.
+    __table_args__ = (
+        db.Index('ix_faction_summary_members', 'member_count', 'faction_id'),
+        db.Index('ix_faction_summary_kills', 'total_kills', 'faction_id'),
+        db.Index('ix_faction_summary_name_lower', 'name_lower', postgresql_ops={'name_lower': 'text_pattern_ops'}),
+    )
+
+class StatsRollupMixin:
+    """Per user and period: the last value of every counter and how much it
+    changed since the previous period (or the first snapshot, for a user's
+    first period). Maintained by stats_rollup."""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    period_start = db.Column(db.Date, nullable=False)
+    faction_id = db.Column(db.Integer, db.ForeignKey('faction.id', ondelete='SET NULL'), nullable=True)
+    last_stats_id = db.Column(db.Integer, nullable=False)
+    last_timestamp = db.Column(db.DateTime, nullable=False)
+    snapshot_count = db.Column(db.Integer, nullable=False)
+
+    @declared_attr
+    def __table_args__(cls):
+        return (
+            db.PrimaryKeyConstraint('user_id', 'period_start'),
+            db.Index(f'ix_{cls.__tablename__}_faction_id_period_start', 'faction_id', 'period_start'),
+        )
+
+for column in COUNTER_COLUMNS:
+    setattr(StatsRollupMixin, column, db.Column(db.BigInteger, nullable=False))
+    setattr(StatsRollupMixin, f'{column}_delta', db.Column(db.BigInteger, nullable=False))
+
+class StatsDaily(StatsRollupMixin, db.Model):
+    __tablename__ = 'stats_daily'
+
+class StatsWeekly(StatsRollupMixin, db.Model):
+    """Weeks start on Monday."""
+    __tablename__ = 'stats_weekly'
+
+class RollupWatermark(db.Model):
+    """The highest Stats id a rollup job has processed."""
+    name = db.Column(db.String(64), primary_key=True)
+    last_stats_id = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=True)
+
+class PercentileBucket(db.Model):
+    """One bucket of a quantile sketch; see percentiles."""
+    scope = db.Column(db.String(32), primary_key=True)
+    metric = db.Column(db.String(64), primary_key=True)
+    bucket = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    count = db.Column(db.BigInteger, nullable=False, default=0)
+
+class ExportJob(db.Model):
+    """A background faction stats export; see faction_export."""
+    id = db.Column(db.String(32), primary_key=True)
+    faction_id = db.Column(db.Integer, db.ForeignKey('faction.id', ondelete='CASCADE'), nullable=False)
+    faction = db.relationship('Faction')
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    format = db.Column(db.String(16), nullable=False)
+    range_start = db.Column(db.DateTime, nullable=True)
+    range_end = db.Column(db.DateTime, nullable=True)
+    status = db.Column(db.String(16), nullable=False, default='pending')
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+class StatsArchive(db.Model):
+    """A month of Stats moved out of the database into a Parquet file; see
+    stats_partitions."""
+    month = db.Column(db.Date, primary_key=True)
+    path = db.Column(db.String(512), nullable=False)
+    row_count = db.Column(db.Integer, nullable=False)
+    archived_at = db.Column(db.DateTime, nullable=False)
+
+class StatsArchiveUser(db.Model):
+    """A user with snapshots in an archived month, so lookups only open the
+    archives that hold the user."""
+    user_id = db.Column(db.Integer, primary_key=True)
+    month = db.Column(db.Date, db.ForeignKey('stats_archive.month', ondelete='CASCADE'), primary_key=True)
 
 class FeatureAccess(db.Model):
     id = db.Column(db.Integer, primary_key=True)
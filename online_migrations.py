@@ -0,0 +1,244 @@
+"""Online schema change helpers for Alembic revisions.
+
+Alembic runs an upgrade in a single transaction, so a whole-table UPDATE or an
+index build keeps its locks until the migration commits. On PostgreSQL these
+helpers step out of that transaction where it is safe to:
+
+- ``create_index_concurrently`` / ``drop_index_concurrently`` build and drop
+  indexes without blocking writes, cleaning up after an interrupted build.
+- ``batched_backfill`` updates a table in primary key ranges, committing each
+  batch, logging progress and pausing between batches. ``batched_copy`` does
+  the same for ``INSERT ... SELECT``.
+- ``add_foreign_key_online`` and ``set_not_null_online`` add the constraint
+  unvalidated and validate it without an exclusive lock.
+- ``expand_column_types`` / ``contract_column_types`` change column types
+  through shadow columns kept in sync by triggers, so only the final renames
+  take an exclusive lock. ``change_column_types`` runs both phases.
+- ``copy_table_online`` fills a replacement table (say, a partitioned one)
+  the same way, so only the final renames lock the original.
+
+Batch size and pause default to ``MIGRATION_BATCH_SIZE`` and
+``MIGRATION_BATCH_PAUSE_SECONDS`` so they can be tuned per run. On other
+databases (SQLite in development) the helpers fall back to the plain operations.
+"""
+from alembic import op
+import sqlalchemy as sa
+import logging
+import os
+import time
+
+logger = logging.getLogger('alembic.online')
+
+BATCH_SIZE = int(os.environ.get('MIGRATION_BATCH_SIZE', 1000))
+BATCH_PAUSE_SECONDS = float(os.environ.get('MIGRATION_BATCH_PAUSE_SECONDS', 0))
+PROGRESS_STEPS = 20
+
+
+def is_postgresql():
+    return op.get_bind().dialect.name == 'postgresql'
+
+
+def quote(name):
+    return op.get_bind().dialect.identifier_preparer.quote(name)
+
+
+def autocommit():
+    """Commit the migration so far and run the block with every statement in
+    its own transaction."""
+    return op.get_context().autocommit_block()
+
+
+def index_is_valid(name):
+    """True or False for an existing index, None if there is none."""
+    return op.get_bind().execute(sa.text(
+        'SELECT i.indisvalid FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid '
+        'WHERE c.relname = :name AND pg_catalog.pg_table_is_visible(c.oid)'
+    ), {'name': name}).scalar()
+
+
+def create_index_concurrently(name, table, columns, **kw):
+    if not is_postgresql():
+        op.create_index(name, table, columns, **kw)
+        return
+    with autocommit():
+        valid = index_is_valid(name)
+        if valid is False:
+            # Left behind by an interrupted concurrent build.
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
+        if not valid:
+            op.create_index(name, table, columns, postgresql_concurrently=True, **kw)
+
+
+def drop_index_concurrently(name, table):
+    if not is_postgresql():
+        op.drop_index(name, table_name=table)
+        return
+    with autocommit():
+        op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
+
+
+def run_in_batches(table, statement, action, key='id', params=None, batch_size=None, pause=None):
+    """Execute ``statement`` once per range of ``key`` in ``table``, bound to
+    ``:batch_start`` and ``:batch_end``, committing after each range."""
+    batch_size = batch_size or BATCH_SIZE
+    pause = BATCH_PAUSE_SECONDS if pause is None else pause
+    low, high = op.get_bind().execute(sa.text(f'SELECT MIN({key}), MAX({key}) FROM {quote(table)}')).one()
+    if low is None:
+        logger.info(f'{table}: nothing to do')
+        return 0
+
+    batches = range(low, high + 1, batch_size)
+    report_every = max(len(batches) // PROGRESS_STEPS, 1)
+    affected = 0
+    with autocommit():
+        for n, batch_start in enumerate(batches, 1):
+            result = op.get_bind().execute(statement, {**(params or {}), 'batch_start': batch_start, 'batch_end': batch_start + batch_size})
+            affected += result.rowcount
+            if n % report_every == 0 or n == len(batches):
+                logger.info(f'{table}: {action} {key} up to {min(batch_start + batch_size - 1, high)} of {high} '
+                            f'({n * 100 // len(batches)}%), {affected} rows')
+            if pause:
+                time.sleep(pause)
+    return affected
+
+
+def batched_backfill(table, assignments, where=None, key='id', **batch_options):
+    """``UPDATE table SET assignments [WHERE where]`` in ranges of ``key``, one
+    transaction per range. Safe to rerun when ``where`` excludes done rows."""
+    statement = sa.text(
+        f'UPDATE {quote(table)} SET {assignments} WHERE {key} >= :batch_start AND {key} < :batch_end'
+        + (f' AND ({where})' if where else '')
+    )
+    return run_in_batches(table, statement, 'backfilled', key=key, **batch_options)
+
+
+def batched_copy(source, target, columns, key='id', **batch_options):
+    """``INSERT INTO target SELECT columns FROM source`` in ranges of ``key``.
+    Rows already in ``target`` are skipped, so an interrupted copy can be rerun."""
+    column_list = ', '.join(quote(column) for column in columns)
+    statement = sa.text(
+        f'INSERT INTO {quote(target)} ({column_list}) SELECT {column_list} FROM {quote(source)} '
+        f'WHERE {key} >= :batch_start AND {key} < :batch_end ON CONFLICT DO NOTHING'
+    )
+    return run_in_batches(source, statement, f'copied into {target}', key=key, **batch_options)
+
+
+def mirror_trigger(source, target):
+    return f'{source}_mirror_{target}'
+
+
+def copy_table_online(source, target, columns, key='id', **batch_options):
+    """Fill ``target`` with the rows of ``source`` while it stays writable: a
+    trigger applies new writes to ``target`` and a batched copy brings over the
+    rest. Meant for insert-mostly tables; finish with ``drop_mirror_trigger``
+    in the transaction that swaps the tables. PostgreSQL only."""
+    trigger = mirror_trigger(source, target)
+    column_list = ', '.join(quote(column) for column in columns)
+    new_values = ', '.join(f'NEW.{quote(column)}' for column in columns)
+    op.execute(
+        f'CREATE OR REPLACE FUNCTION {quote(trigger)}() RETURNS trigger AS $$ BEGIN '
+        f"IF TG_OP IN ('UPDATE', 'DELETE') THEN DELETE FROM {quote(target)} WHERE {key} = OLD.{key}; END IF; "
+        f"IF TG_OP IN ('INSERT', 'UPDATE') THEN INSERT INTO {quote(target)} ({column_list}) VALUES ({new_values}) "
+        f'ON CONFLICT DO NOTHING; END IF; '
+        f'RETURN NULL; END $$ LANGUAGE plpgsql'
+    )
+    op.execute(f'DROP TRIGGER IF EXISTS {quote(trigger)} ON {quote(source)}')
+    op.execute(
+        f'CREATE TRIGGER {quote(trigger)} AFTER INSERT OR UPDATE OR DELETE ON {quote(source)} '
+        f'FOR EACH ROW EXECUTE FUNCTION {quote(trigger)}()'
+    )
+    return batched_copy(source, target, columns, key=key, **batch_options)
+
+
+def drop_mirror_trigger(source, target):
+    trigger = mirror_trigger(source, target)
+    op.execute(f'DROP TRIGGER IF EXISTS {quote(trigger)} ON {quote(source)}')
+    op.execute(f'DROP FUNCTION IF EXISTS {quote(trigger)}()')
+
+
+def add_foreign_key_online(name, source, referent, local_cols, remote_cols, **kw):
+    if not is_postgresql():
+        with op.batch_alter_table(source, schema=None) as batch_op:
+            batch_op.create_foreign_key(name, referent, local_cols, remote_cols, **kw)
+        return
+    op.create_foreign_key(name, source, referent, local_cols, remote_cols, postgresql_not_valid=True, **kw)
+    with autocommit():
+        op.execute(f'ALTER TABLE {quote(source)} VALIDATE CONSTRAINT {quote(name)}')
+
+
+def set_not_null_online(table, column):
+    """SET NOT NULL without a locked table scan: PostgreSQL 12+ skips the scan
+    when a validated CHECK constraint already proves it."""
+    if not is_postgresql():
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.alter_column(column, nullable=False)
+        return
+    check = f'ck_{table}_{column}_not_null'
+    op.execute(f'ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(check)} CHECK ({quote(column)} IS NOT NULL) NOT VALID')
+    with autocommit():
+        op.execute(f'ALTER TABLE {quote(table)} VALIDATE CONSTRAINT {quote(check)}')
+    op.alter_column(table, column, nullable=False)
+    op.drop_constraint(check, table, type_='check')
+
+
+def shadow_column(column):
+    return f'{column}_new'
+
+
+def swap_trigger(table, column):
+    return f'{table}_{column}_swap'
+
+
+def expand_column_types(table, types, **backfill_options):
+    """Add a ``<column>_new`` shadow for each column in ``types`` (a mapping of
+    column name to new type), mirror writes into it with a trigger, and backfill
+    existing rows in a single pass. The application keeps using the original
+    columns throughout. Only for types PostgreSQL converts on assignment, such
+    as widening integers."""
+    if not is_postgresql():
+        return
+    dialect = op.get_bind().dialect
+    # Written to be rerun after an interrupted backfill.
+    for column, type_ in types.items():
+        shadow, trigger = shadow_column(column), swap_trigger(table, column)
+        op.execute(f'ALTER TABLE {quote(table)} ADD COLUMN IF NOT EXISTS {quote(shadow)} {type_.compile(dialect=dialect)}')
+        op.execute(
+            f'CREATE OR REPLACE FUNCTION {quote(trigger)}() RETURNS trigger AS $$ '
+            f'BEGIN NEW.{quote(shadow)} := NEW.{quote(column)}; RETURN NEW; END $$ LANGUAGE plpgsql'
+        )
+        op.execute(f'DROP TRIGGER IF EXISTS {quote(trigger)} ON {quote(table)}')
+        op.execute(
+            f'CREATE TRIGGER {quote(trigger)} BEFORE INSERT OR UPDATE ON {quote(table)} '
+            f'FOR EACH ROW EXECUTE FUNCTION {quote(trigger)}()'
+        )
+    batched_backfill(
+        table,
+        ', '.join(f'{quote(shadow_column(column))} = {quote(column)}' for column in types),
+        where=' OR '.join(f'{quote(shadow_column(column))} IS DISTINCT FROM {quote(column)}' for column in types),
+        **backfill_options
+    )
+
+
+def contract_column_types(table, types, server_defaults=None):
+    """Swap the backfilled shadow columns in for the originals in one short
+    transaction. Indexes and constraints on an old column go with it, so
+    recreate them on ``<column>_new`` beforehand."""
+    if not is_postgresql():
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            for column, type_ in types.items():
+                batch_op.alter_column(column, type_=type_)
+        return
+    for column in types:
+        shadow, trigger = shadow_column(column), swap_trigger(table, column)
+        op.execute(f'DROP TRIGGER IF EXISTS {quote(trigger)} ON {quote(table)}')
+        op.execute(f'DROP FUNCTION IF EXISTS {quote(trigger)}()')
+        op.alter_column(table, column, new_column_name=f'{column}_old')
+        op.alter_column(table, shadow, new_column_name=column)
+        if server_defaults and column in server_defaults:
+            op.alter_column(table, column, server_default=server_defaults[column])
+        op.drop_column(table, f'{column}_old')
+
+
+def change_column_types(table, types, server_defaults=None, **backfill_options):
+    expand_column_types(table, types, **backfill_options)
+    contract_column_types(table, types, server_defaults=server_defaults)
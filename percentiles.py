@@ -0,0 +1,233 @@
+"""Quantile sketches of players' latest stats, globally and per faction.
+
+Each sketch is a DDSketch-style histogram: a value lands in bucket
+``ceil(log(value) / log(gamma))``, so every bucket spans a relative width of
+``RELATIVE_ACCURACY`` and ranks and quantiles read from it are off by at most
+that relative error. Sketches merge by adding bucket counts, and unlike t-digest
+or KLL a value can be removed again, which is what lets ``update_stats`` swap a
+player's previous snapshot for the new one instead of accumulating history.
+
+Buckets are stored one row each and updated with SQL increments, so concurrent
+stats submissions never contend on a whole sketch. ``flask percentiles rebuild``
+recomputes everything from the latest snapshots.
+"""
+from collections import Counter, defaultdict
+from sqlalchemy import delete, insert, true, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+from extensions import db
+from metrics import COUNTER_COLUMNS, registry, snapshot_metrics
+from scheduler import schedule_periodic
+from snapshots import latest_snapshot, snapshots_as_of
+from utils import utcnow
+import click
+import logging
+import math
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+LOG_GAMMA = math.log(GAMMA)
+# Sorts below every real bucket, so ranks can be read in bucket order.
+ZERO_BUCKET = -2 ** 30
+SKETCH_METRICS = ['kills', 'total_wins', 'eliminated_enemy_influence', 'enemy_turfs_destroyed', 'win_rate', 'kd_ratio']
+GLOBAL_SCOPE = 'global'
+
+
+def faction_scope(faction_id):
+    return f'faction:{faction_id}'
+
+
+def bucket_indexes(values):
+    values = np.asarray(values, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        indexes = np.ceil(np.log(values) / LOG_GAMMA)
+    return np.where(values > 0, indexes, ZERO_BUCKET).astype(np.int64)
+
+
+def bucket_index(value):
+    # Shares the NumPy path with rebuilds so a value always maps to the same bucket.
+    return int(bucket_indexes([value or 0])[0])
+
+
+def bucket_value(index):
+    if index == ZERO_BUCKET:
+        return 0.0
+    return 2 * GAMMA ** index / (GAMMA + 1)
+
+
+class QuantileSketch:
+    def __init__(self, counts=None):
+        self.counts = Counter(counts or {})
+
+    def add(self, value, count=1):
+        self.counts[bucket_index(value)] += count
+
+    def merge(self, other):
+        self.counts.update(other.counts)
+        return self
+
+    @property
+    def total(self):
+        return sum(count for count in self.counts.values() if count > 0)
+
+    def rank(self, value):
+        """The share of values below ``value``, counting its own bucket as half."""
+        total = self.total
+        if not total:
+            return None
+        index = bucket_index(value)
+        below = sum(count for bucket, count in self.counts.items() if bucket < index and count > 0)
+        return (below + max(self.counts.get(index, 0), 0) / 2) / total
+
+    def quantile(self, q):
+        total = self.total
+        if not total:
+            return None
+        seen = 0
+        for bucket in sorted(self.counts):
+            if self.counts[bucket] > 0:
+                seen += self.counts[bucket]
+                if seen > q * (total - 1):
+                    return bucket_value(bucket)
+        return bucket_value(max(self.counts))
+
+
+def sketch_values(snapshot):
+    metrics = snapshot_metrics([snapshot])[0]
+    return {metric: metrics[metric] if metric in metrics else getattr(snapshot, metric) for metric in SKETCH_METRICS}
+
+
+def upsert_buckets(deltas):
+    from models import PercentileBucket
+
+    rows = [{'scope': scope, 'metric': metric, 'bucket': bucket, 'count': count}
+            for (scope, metric, bucket), count in deltas.items() if count]
+    if not rows:
+        return
+    dialect = postgresql if db.session.get_bind().dialect.name == 'postgresql' else sqlite
+    statement = dialect.insert(PercentileBucket)
+    statement = statement.on_conflict_do_update(
+        index_elements=['scope', 'metric', 'bucket'],
+        set_={'count': PercentileBucket.__table__.c.count + statement.excluded['count']},
+    )
+    db.session.execute(statement, rows)
+
+    # Emptied buckets are dropped. A negative count means a value was removed
+    # that was never added, so the stored sketches no longer match the stats.
+    decremented = [(row['scope'], row['metric'], row['bucket']) for row in rows if row['count'] < 0]
+    if not decremented:
+        return
+    emptied = db.session.execute(delete(PercentileBucket).where(
+        tuple_(PercentileBucket.scope, PercentileBucket.metric, PercentileBucket.bucket).in_(decremented),
+        PercentileBucket.count <= 0,
+    ).returning(PercentileBucket.count)).scalars().all()
+    if any(count < 0 for count in emptied):
+        logger.warning("Percentile buckets went negative; run 'flask percentiles rebuild'")
+
+
+def add_snapshot_deltas(deltas, scopes, snapshot, sign):
+    if snapshot is None:
+        return
+    for metric, value in sketch_values(snapshot).items():
+        for scope in scopes:
+            deltas[(scope, metric, bucket_index(value))] += sign
+
+
+def record_stats_change(faction_id, previous_stats, new_stats):
+    """Replace a player's previous snapshot with the new one in the global and
+    faction sketches. Runs in the caller's transaction."""
+    scopes = [GLOBAL_SCOPE] + ([faction_scope(faction_id)] if faction_id else [])
+    deltas = Counter()
+    add_snapshot_deltas(deltas, scopes, previous_stats, -1)
+    add_snapshot_deltas(deltas, scopes, new_stats, 1)
+    upsert_buckets(deltas)
+
+
+def record_membership_change(user_id, old_faction_id, new_faction_id):
+    """Move a player's latest snapshot between faction sketches."""
+    latest = latest_snapshot(user_id)
+    deltas = Counter()
+    if old_faction_id:
+        add_snapshot_deltas(deltas, [faction_scope(old_faction_id)], latest, -1)
+    if new_faction_id:
+        add_snapshot_deltas(deltas, [faction_scope(new_faction_id)], latest, 1)
+    upsert_buckets(deltas)
+
+
+def record_user_removal(user_ids):
+    """Take deleted players' latest snapshots out of the global and faction
+    sketches. Runs in the caller's transaction, before the users are deleted."""
+    from models import User
+
+    for user_id, faction_id in db.session.query(User.id, User.faction_id).filter(User.id.in_(user_ids)).all():
+        record_stats_change(faction_id, latest_snapshot(user_id), None)
+
+
+def load_sketches(scopes, metrics):
+    """Sketches keyed by (scope, metric). Reads at most one row per bucket, so
+    the cost depends on the value range, not on the number of players."""
+    from models import PercentileBucket
+
+    sketches = defaultdict(QuantileSketch)
+    rows = db.session.query(PercentileBucket.scope, PercentileBucket.metric, PercentileBucket.bucket, PercentileBucket.count
+                            ).filter(PercentileBucket.scope.in_(scopes), PercentileBucket.metric.in_(metrics))
+    for scope, metric, bucket, count in rows:
+        sketches[(scope, metric)].counts[bucket] = count
+    return sketches
+
+
+def sketch_buckets(rows):
+    """Bucket rows for every sketch, from rows of a player's faction id followed
+    by the counters of their latest snapshot."""
+    faction_ids = np.array([row[0] or 0 for row in rows], dtype=np.int64)
+    columns = {column: np.array([row[i + 1] or 0 for row in rows], dtype=np.float64)
+               for i, column in enumerate(COUNTER_COLUMNS)}
+    values = registry.evaluate(columns)
+    values.update(columns)
+
+    buckets = []
+    for metric in SKETCH_METRICS:
+        indexes = bucket_indexes(values[metric])
+        for bucket, count in zip(*np.unique(indexes, return_counts=True)):
+            buckets.append({'scope': GLOBAL_SCOPE, 'metric': metric, 'bucket': int(bucket), 'count': int(count)})
+        in_faction = faction_ids > 0
+        if not in_faction.any():
+            continue
+        pairs, counts = np.unique(np.stack([faction_ids[in_faction], indexes[in_faction]]), axis=1, return_counts=True)
+        for (faction_id, bucket), count in zip(pairs.T, counts):
+            buckets.append({'scope': faction_scope(int(faction_id)), 'metric': metric, 'bucket': int(bucket), 'count': int(count)})
+    return len(rows), buckets
+
+
+def rebuild_sketches():
+    """Recompute every sketch from each player's latest snapshot, replacing the
+    stored buckets in one transaction."""
+    from models import User, PercentileBucket
+
+    factions = dict(db.session.query(User.id, User.faction_id))
+    latest = snapshots_as_of(true(), utcnow())
+    players, buckets = sketch_buckets([(factions.get(user_id), *[getattr(snapshot, column) for column in COUNTER_COLUMNS])
+                                       for user_id, (snapshot,) in latest.items() if snapshot])
+    PercentileBucket.query.delete(synchronize_session=False)
+    if buckets:
+        db.session.execute(insert(PercentileBucket), buckets)
+    db.session.commit()
+    return players
+
+
+def init_percentiles(app):
+    app.config.setdefault('PERCENTILE_REBUILD_SECONDS', 0)
+    interval = app.config['PERCENTILE_REBUILD_SECONDS']
+    if interval:
+        schedule_periodic(app, 'percentile-rebuild', interval, rebuild_sketches)
+
+    @app.cli.group()
+    def percentiles():
+        """Percentile sketch commands."""
+
+    @percentiles.command('rebuild')
+    def rebuild():
+        """Recompute the percentile sketches from the latest snapshots."""
+        click.echo(f'Rebuilt percentile sketches from {rebuild_sketches()} players')
@@ -1,6 +1,9 @@
 from flask import Blueprint, render_template, request, jsonify, abort, current_app, redirect, url_for
 from flask_login import login_required, current_user
-from models import User, FeatureAccess, db
+from models import User, Faction, FeatureAccess, db
+from db_routing import read_replica
+from faction_directory import update_faction_summary
+from percentiles import record_user_removal
 from functools import wraps
 import logging
 
@@ -16,6 +19,7 @@ def admin_required(f):
     return decorated_function
 
 @bp.route('/admin/dashboard')
+@read_replica
 @login_required
 @admin_required
 def admin_dashboard():
@@ -37,6 +41,7 @@ def admin_dashboard():
                            users_with_faction_creation=users_with_faction_creation)
 
 @bp.route('/admin/users')
+@read_replica
 @login_required
 @admin_required
 def list_users():
@@ -127,6 +132,13 @@ def delete_user(user_id):
     if user == current_user:
         return jsonify({'error': 'You cannot delete your own account'}), 400
     
+    faction_id = user.faction_id
+    record_user_removal([user.id])
+    if user.faction:
+        user.faction.update_membership(-1)
+    if faction_id:
+        update_faction_summary(faction_id, left=[user.id])
+    Faction.query.filter_by(leader_id=user.id).update({Faction.leader_id: None}, synchronize_session=False)
     db.session.delete(user)
     db.session.commit()
     return jsonify({'success': True})
@@ -142,6 +154,20 @@ def bulk_action():
         return jsonify({'error': 'Invalid request'}), 400
     
     if action == 'delete':
+        record_user_removal([user_id for user_id in map(int, user_ids) if user_id != current_user.id])
+        departed = db.session.query(User.faction_id, db.func.count(User.id)).filter(
+            User.id.in_(user_ids), User.id != current_user.id, User.faction_id.isnot(None)).group_by(User.faction_id)
+        departed = departed.all()
+        for faction_id, count in departed:
+            Faction.query.filter_by(id=faction_id).update({
+                Faction.member_count: Faction.member_count - count,
+                Faction.membership_version: Faction.membership_version + 1,
+            }, synchronize_session=False)
+            members = db.session.query(User.id).filter(User.id.in_(user_ids), User.id != current_user.id,
+                                                       User.faction_id == faction_id)
+            update_faction_summary(faction_id, left=[user_id for (user_id,) in members])
+        Faction.query.filter(Faction.leader_id.in_(user_ids), Faction.leader_id != current_user.id).update(
+            {Faction.leader_id: None}, synchronize_session=False)
         User.query.filter(User.id.in_(user_ids), User.id != current_user.id).delete(synchronize_session=False)
     elif action == 'toggle_admin':
         users = User.query.filter(User.id.in_(user_ids), User.id != current_user.id)
@@ -0,0 +1,39 @@
+from flask import Blueprint, jsonify, current_app
+from flask_login import login_required, current_user
+from models import FeatureAccess
+from db_routing import read_replica
+from routes.stats import build_stats_data
+from routes.factions import build_member_list, build_faction_details
+from snapshots import latest_snapshots
+
+bp = Blueprint('dashboard', __name__)
+
+def build_dashboard_bootstrap(user):
+    """Everything the dashboard needs on first paint, in as few queries as possible:
+    the last two stats snapshots, the faction with its members, and feature flags."""
+    latest_stats = latest_snapshots(user.id, 2)
+    features = FeatureAccess.query.filter_by(user_id=user.id).all()
+
+    bootstrap = {
+        'stats': build_stats_data(latest_stats[0], latest_stats[1] if len(latest_stats) > 1 else None) if latest_stats else None,
+        'faction': None,
+        'members': [],
+        'features': {access.feature: access.enabled for access in features},
+    }
+
+    faction = user.faction
+    if faction:
+        bootstrap['faction'] = build_faction_details(faction, user)
+        bootstrap['members'] = build_member_list(faction.members)
+
+    return bootstrap
+
+@bp.route('/dashboard/bootstrap', methods=['GET'])
+@read_replica
+@login_required
+def dashboard_bootstrap():
+    try:
+        return jsonify(build_dashboard_bootstrap(current_user)), 200
+    except Exception as e:
+        current_app.logger.error(f"Error building dashboard bootstrap: {str(e)}")
+        return jsonify({'error': 'An unexpected error occurred', 'details': str(e)}), 500
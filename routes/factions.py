@@ -1,10 +1,72 @@
-from flask import Blueprint, request, jsonify, current_app
-from flask_login import login_required, current_user
-from models import User, Faction, FeatureAccess, db
+from types import SimpleNamespace
+import os
 import secrets
 
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context, send_file, url_for
+from flask_login import login_required, current_user
+
+from models import User, Faction, FeatureAccess, ExportJob, db
+from db_routing import read_replica
+from http_caching import conditional
+from metrics import COUNTER_COLUMNS, snapshot_metrics
+from snapshots import parse_as_of, parse_comparison_window, snapshots_as_of, sum_snapshots, InvalidTimestamp
+from routes.stats import build_stats_data, snapshot_time, parse_history_range
+from stats_rollup import pending_rollups, period_start, rollup_models, stored_rollups_filter
+from faction_directory import search_factions, update_faction_summary, SORT_COLUMNS, InvalidCursor
+from faction_events import get_broker, publish_faction_event, event_stream, ConnectionLimitExceeded
+from percentiles import record_membership_change
+from utils import parse_limit, utcnow
+from faction_export import (EXPORT_FORMATS, ExportUnavailable, check_export_format, export_chunks, export_filename,
+                            export_path, start_export_job)
+
 bp = Blueprint('factions', __name__)
 
+def build_member_list(members):
+    return [{'id': member.id, 'username': member.username} for member in members]
+
+def build_faction_details(faction, viewer):
+    return {
+        'id': faction.id,
+        'name': faction.name,
+        'leader': {'id': faction.leader_id, 'username': faction.leader_username},
+        'member_count': faction.member_count,
+        'invitation_code': faction.invitation_code if faction.leader_id == viewer.id else None
+    }
+
+def faction_version():
+    faction = current_user.faction
+    if not faction:
+        return None
+    return ('faction', faction.id, faction.membership_version, current_user.id)
+
+@bp.route('/factions', methods=['GET'])
+@read_replica
+def list_factions():
+    q = request.args.get('q', '').strip()
+    sort = request.args.get('sort', 'members')
+    if sort not in SORT_COLUMNS:
+        return jsonify({'error': f"sort must be one of: {', '.join(SORT_COLUMNS)}"}), 400
+    limit = parse_limit(request.args, 20, 100)
+
+    try:
+        page, next_cursor = search_factions(q, sort, request.args.get('after'), limit)
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
+
+    response = jsonify({
+        'factions': [{
+            'id': summary.faction_id,
+            'name': summary.name,
+            'member_count': summary.member_count,
+            'total_kills': summary.total_kills,
+        } for summary in page],
+        'next': next_cursor,
+    })
+    # The directory is public and only changes when the summary is refreshed.
+    response.cache_control.public = True
+    response.cache_control.max_age = 60
+    return response, 200
+
 @bp.route('/faction/create', methods=['POST'])
 @login_required
 def create_faction():
@@ -28,10 +90,14 @@ def create_faction():
             return jsonify({'error': 'You are already in a faction'}), 400
 
         invitation_code = secrets.token_urlsafe(8)
-        new_faction = Faction(name=faction_name, invitation_code=invitation_code, leader_username=current_user.username)
+        new_faction = Faction(name=faction_name, invitation_code=invitation_code, leader_username=current_user.username,
+                              leader=current_user, member_count=1)
         current_user.faction = new_faction
 
         db.session.add(new_faction)
+        db.session.flush()
+        record_membership_change(current_user.id, None, new_faction.id)
+        update_faction_summary(new_faction.id, joined=[current_user.id])
         db.session.commit()
 
         current_app.logger.info(f"User {current_user.id} created faction {new_faction.id}")
@@ -63,20 +129,25 @@ def join_faction():
         return jsonify({'error': 'You are already in a faction'}), 400
 
     current_user.faction = faction
+    faction.update_membership(1)
+    record_membership_change(current_user.id, None, faction.id)
+    update_faction_summary(faction.id, joined=[current_user.id])
     db.session.commit()
 
+    publish_faction_event(faction.id, 'member_joined', member={'id': current_user.id, 'username': current_user.username})
     return jsonify({'message': 'Successfully joined the faction'}), 200
 
 @bp.route('/faction/members', methods=['GET'])
+@read_replica
 @login_required
+@conditional(faction_version)
 def get_faction_members():
     if not current_user.faction:
         return jsonify({'error': 'You are not in a faction'}), 400
 
     members = User.query.filter_by(faction_id=current_user.faction.id).all()
-    member_list = [{'id': member.id, 'username': member.username} for member in members]
 
-    return jsonify({'members': member_list}), 200
+    return jsonify({'members': build_member_list(members)}), 200
 
 @bp.route('/faction/leave', methods=['POST'])
 @login_required
@@ -84,27 +155,245 @@ def leave_faction():
     if not current_user.faction:
         return jsonify({'error': 'You are not in a faction'}), 400
 
-    if current_user.faction.leader_username == current_user.username:
+    if current_user.faction.leader_id == current_user.id:
         return jsonify({'error': 'Faction leader cannot leave the faction'}), 400
 
+    faction_id = current_user.faction.id
+    current_user.faction.update_membership(-1)
     current_user.faction = None
+    record_membership_change(current_user.id, faction_id, None)
+    update_faction_summary(faction_id, left=[current_user.id])
     db.session.commit()
 
+    publish_faction_event(faction_id, 'member_left', member={'id': current_user.id, 'username': current_user.username})
     return jsonify({'message': 'Successfully left the faction'}), 200
 
+@bp.route('/faction/metrics', methods=['GET'])
+@read_replica
+@login_required
+def get_faction_metrics():
+    if not current_user.faction_id:
+        return jsonify({'error': 'You are not in a faction'}), 400
+
+    members = User.query.filter_by(faction_id=current_user.faction_id).all()
+    as_of = snapshots_as_of(User.faction_id == current_user.faction_id, utcnow())
+    snapshots = [snapshot for snapshot, in as_of.values() if snapshot]
+    # One vectorized evaluation covers every member's latest snapshot.
+    metrics_by_user = {snapshot.user_id: metrics for snapshot, metrics in zip(snapshots, snapshot_metrics(snapshots))}
+
+    return jsonify({'members': [
+        {'id': member.id, 'username': member.username, 'metrics': metrics_by_user.get(member.id)}
+        for member in members
+    ]}), 200
+
+@bp.route('/faction/stats/compare', methods=['GET'])
+@read_replica
+@login_required
+def compare_faction_stats():
+    if not current_user.faction_id:
+        return jsonify({'error': 'You are not in a faction'}), 400
+    try:
+        at, against = parse_comparison_window(request.args)
+    except InvalidTimestamp as e:
+        return jsonify({'error': str(e)}), 400
+
+    members = User.query.filter_by(faction_id=current_user.faction_id).all()
+    as_of = snapshots_as_of(User.faction_id == current_user.faction_id, at, against)
+    compared, current_snapshots, previous_snapshots = [], [], []
+    for member in members:
+        current_stats, previous_stats = as_of.get(member.id, (None, None))
+        if not current_stats:
+            compared.append({'id': member.id, 'username': member.username, 'at': None, 'against': None, 'stats': None})
+            continue
+        # Members without an earlier snapshot count as unchanged, as they do individually.
+        current_snapshots.append(current_stats)
+        previous_snapshots.append(previous_stats or current_stats)
+        compared.append({
+            'id': member.id,
+            'username': member.username,
+            'at': snapshot_time(current_stats),
+            'against': snapshot_time(previous_stats),
+            'stats': build_stats_data(current_stats, previous_stats)
+        })
+
+    return jsonify({
+        'at': at.isoformat(),
+        'against': against.isoformat(),
+        'members': compared,
+        'totals': build_stats_data(sum_snapshots(current_snapshots), sum_snapshots(previous_snapshots))
+    }), 200
+
+@bp.route('/faction/stats/history', methods=['GET'])
+@read_replica
+@login_required
+def get_faction_stats_history():
+    """Faction totals per day or week, summed from the members' rollups. Derived
+    metrics are evaluated on the period's deltas, e.g. the win rate that week."""
+    if not current_user.faction_id:
+        return jsonify({'error': 'You are not in a faction'}), 400
+    limit = parse_limit(request.args, 50, 500)
+    try:
+        start, end, granularity = parse_history_range(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if granularity == 'raw':
+        granularity = 'day'
+
+    model = rollup_models()[granularity]
+    member_ids = [user_id for user_id, in db.session.query(User.id).filter_by(faction_id=current_user.faction_id)]
+    earliest_periods, pending = pending_rollups(granularity, member_ids, start, end)
+    query = db.session.query(
+        model.period_start,
+        db.func.count(model.user_id),
+        *[db.func.sum(getattr(model, f'{column}_delta')) for column in COUNTER_COLUMNS]
+    ).filter(model.faction_id == current_user.faction_id, stored_rollups_filter(model, earliest_periods))
+    if start:
+        query = query.filter(model.period_start >= period_start(granularity, start),
+                             model.period_start <= period_start(granularity, end))
+    totals = {row[0]: [row[1]] + [int(value) for value in row[2:]]
+              for row in query.group_by(model.period_start).order_by(model.period_start.desc()).limit(limit)}
+    for row in pending:
+        period_totals = totals.setdefault(row['period_start'], [0] * (len(COUNTER_COLUMNS) + 1))
+        period_totals[0] += 1
+        for i, column in enumerate(COUNTER_COLUMNS, 1):
+            period_totals[i] += row[f'{column}_delta']
+    rows = sorted(totals.items(), reverse=True)[:limit]
+
+    deltas = [SimpleNamespace(id=None, **dict(zip(COUNTER_COLUMNS, values[1:]))) for _, values in rows]
+    history = []
+    for (period, values), period_deltas, metrics in zip(rows, deltas, snapshot_metrics(deltas)):
+        entry = {'period_start': period.isoformat(), 'members_reporting': values[0]}
+        entry.update({column: getattr(period_deltas, column) for column in COUNTER_COLUMNS})
+        entry.update(metrics)
+        history.append(entry)
+    return jsonify({'granularity': granularity, 'history': history}), 200
+
 @bp.route('/faction/details', methods=['GET'])
+@read_replica
 @login_required
+@conditional(faction_version)
 def get_faction_details():
     if not current_user.faction:
         return jsonify({'error': 'You are not in a faction'}), 400
 
+    return jsonify(build_faction_details(current_user.faction, current_user)), 200
+
+@bp.route('/faction/events', methods=['GET'])
+@login_required
+def faction_events():
+    if not current_user.faction_id:
+        return jsonify({'error': 'You are not in a faction'}), 400
+
+    faction_id = current_user.faction_id
+    user_id = current_user.id
+    broker = get_broker()
+    try:
+        subscriber = broker.subscribe(faction_id, user_id)
+    except ConnectionLimitExceeded as e:
+        return jsonify({'error': str(e)}), 429
+
+    app = current_app._get_current_object()
+
+    def is_member():
+        with app.app_context():
+            return db.session.query(User.faction_id).filter_by(id=user_id).scalar() == faction_id
+
+    # Release the database connection before the long-lived stream starts.
+    db.session.remove()
+    stream = event_stream(subscriber, user_id, faction_id, current_app.config['SSE_HEARTBEAT_SECONDS'], is_member)
+    response = Response(stream, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+    response.call_on_close(lambda: broker.unsubscribe(faction_id, user_id, subscriber))
+    return response
+
+def parse_export_request(params):
+    export_format = params.get('format', 'csv')
+    check_export_format(export_format)
+    now = utcnow()
+    start = parse_as_of(params['from'], now) if params.get('from') else None
+    end = parse_as_of(params['to'], now) if params.get('to') else None
+    return export_format, start, end
+
+def export_job_status(job):
+    return {
+        'id': job.id,
+        'status': job.status,
+        'format': job.format,
+        'created_at': job.created_at.isoformat(),
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        'error': job.error,
+        'download_url': url_for('factions.download_faction_export', job_id=job.id) if job.status == 'done' else None
+    }
+
+def leader_faction():
     faction = current_user.faction
-    leader = User.query.filter_by(username=faction.leader_username).first()
+    if not faction:
+        return None, (jsonify({'error': 'You are not in a faction'}), 400)
+    if faction.leader_id != current_user.id:
+        return None, (jsonify({'error': 'Only the faction leader can export stats'}), 403)
+    return faction, None
 
-    return jsonify({
-        'id': faction.id,
-        'name': faction.name,
-        'leader': {'id': leader.id, 'username': leader.username},
-        'member_count': len(faction.members),
-        'invitation_code': faction.invitation_code if faction.leader_username == current_user.username else None
-    }), 200
\ No newline at end of file
+@bp.route('/faction/export', methods=['GET'])
+@read_replica
+@login_required
+def export_faction_stats():
+    faction, error = leader_faction()
+    if error:
+        return error
+    try:
+        export_format, start, end = parse_export_request(request.args)
+    except ExportUnavailable as e:
+        return jsonify({'error': str(e)}), 501
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return Response(
+        stream_with_context(export_chunks(export_format, faction.id, start, end)),
+        mimetype=EXPORT_FORMATS[export_format][0],
+        headers={'Content-Disposition': f'attachment; filename="{export_filename(faction, export_format)}"'}
+    )
+
+@bp.route('/faction/export', methods=['POST'])
+@login_required
+def start_faction_export():
+    faction, error = leader_faction()
+    if error:
+        return error
+    try:
+        export_format, start, end = parse_export_request(request.get_json(silent=True) or request.args)
+    except ExportUnavailable as e:
+        return jsonify({'error': str(e)}), 501
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    job = start_export_job(current_app._get_current_object(), faction.id, current_user.id, export_format, start, end)
+    current_app.logger.info(f"User {current_user.id} started export job {job.id} for faction {faction.id}")
+    response = jsonify(export_job_status(job))
+    response.headers['Location'] = url_for('factions.get_faction_export', job_id=job.id)
+    return response, 202
+
+def get_own_export_job(job_id):
+    job = db.session.get(ExportJob, job_id)
+    return job if job and job.user_id == current_user.id else None
+
+@bp.route('/faction/export/<job_id>', methods=['GET'])
+@login_required
+def get_faction_export(job_id):
+    job = get_own_export_job(job_id)
+    if not job:
+        return jsonify({'error': 'Export not found'}), 404
+    return jsonify(export_job_status(job)), 200
+
+@bp.route('/faction/export/<job_id>/download', methods=['GET'])
+@login_required
+def download_faction_export(job_id):
+    job = get_own_export_job(job_id)
+    if not job or job.status != 'done':
+        return jsonify({'error': 'Export not found'}), 404
+    path = export_path(current_app, job)
+    if not os.path.exists(path):
+        return jsonify({'error': 'Export has expired'}), 410
+    return send_file(path, mimetype=EXPORT_FORMATS[job.format][0], as_attachment=True,
+                     download_name=export_filename(job.faction, job.format))
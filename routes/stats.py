@@ -1,6 +1,17 @@
 from flask import Blueprint, request, jsonify
 from flask_login import login_required, current_user
-from models import Stats, db
+from models import User, Stats, db
+from db_routing import read_replica
+from http_caching import conditional
+from faction_events import publish_faction_event
+from metrics import COUNTER_COLUMNS, registry, snapshot_metrics
+from snapshots import is_relative, parse_as_of, parse_comparison_window, latest_snapshot, latest_snapshots, snapshots_as_of, InvalidTimestamp
+from percentiles import SKETCH_METRICS, RELATIVE_ACCURACY, GLOBAL_SCOPE, faction_scope, load_sketches, record_stats_change, sketch_values
+from stats_partitions import recent_archived_snapshots
+from stats_rollup import (GRANULARITIES, choose_granularity, pending_rollups, period_start, rollup_models, rollup_watermark,
+                          stored_rollups_filter)
+from utils import parse_limit, utcnow
+from types import SimpleNamespace
 from sqlalchemy.exc import SQLAlchemyError, DataError
 from marshmallow import Schema, fields, ValidationError
 
@@ -25,6 +36,21 @@ class StatsSchema(Schema):
 
 stats_schema = StatsSchema()
 
+def stats_changes(previous_stats, new_stats):
+    """Counters and derived metrics that differ from the previous snapshot."""
+    current = {column: getattr(new_stats, column) for column in COUNTER_COLUMNS}
+    previous = {column: getattr(previous_stats, column) for column in COUNTER_COLUMNS} if previous_stats else {}
+    snapshots = [new_stats, previous_stats] if previous_stats else [new_stats]
+    metrics = snapshot_metrics(snapshots)
+    current.update(metrics[0])
+    if previous_stats:
+        previous.update(metrics[1])
+
+    return {
+        name: {'current': value, 'previous': previous.get(name)}
+        for name, value in current.items() if previous.get(name) != value
+    }
+
 @bp.route('/stats', methods=['POST'])
 @login_required
 def update_stats():
@@ -39,9 +65,18 @@ def update_stats():
         except ValidationError as err:
             return jsonify({'error': 'Invalid input data', 'details': err.messages}), 400
 
+        # Locking the user's row makes concurrent updates from the same user take
+        # turns, so each one moves the sketches from the snapshot before it.
+        faction_id = db.session.query(User.faction_id).filter_by(id=current_user.id).with_for_update().scalar()
+        previous_stats = latest_snapshot(current_user.id)
         new_stats = Stats(user_id=current_user.id, **validated_data)
+        changes = stats_changes(previous_stats, new_stats)
         db.session.add(new_stats)
+        record_stats_change(faction_id, previous_stats, new_stats)
         db.session.commit()
+
+        publish_faction_event(current_user.faction_id, 'stats', user_id=current_user.id,
+                              username=current_user.username, changes=changes)
         return jsonify({'message': 'Stats updated successfully'}), 200
     except DataError as e:
         db.session.rollback()
@@ -52,38 +87,176 @@ def update_stats():
     except Exception as e:
         return jsonify({'error': 'An unexpected error occurred', 'details': str(e)}), 500
 
+def build_stats_data(current_stats, previous_stats):
+    # Without an earlier snapshot every value is compared against itself.
+    previous_stats = previous_stats or current_stats
+    current_metrics, previous_metrics = snapshot_metrics([current_stats, previous_stats])
+
+    stats_data = {
+        column: {'current': getattr(current_stats, column), 'previous': getattr(previous_stats, column)}
+        for column in COUNTER_COLUMNS
+    }
+    for name in registry.metrics:
+        stats_data[name] = {'current': current_metrics[name], 'previous': previous_metrics[name]}
+    return stats_data
+
+def stats_version():
+    # Snapshots are append-only, so the newest one identifies the response.
+    latest = latest_snapshot(current_user.id)
+    return ('stats', current_user.id, latest.id if latest else None)
+
 @bp.route('/stats', methods=['GET'])
+@read_replica
 @login_required
+@conditional(stats_version)
 def get_stats():
     try:
-        current_stats = Stats.query.filter_by(user_id=current_user.id).order_by(Stats.timestamp.desc()).first()
-        previous_stats = Stats.query.filter_by(user_id=current_user.id).order_by(Stats.timestamp.desc()).offset(1).first()
-
-        if current_stats:
-            total_battles = current_stats.total_wins + current_stats.total_losses
-            win_rate = (current_stats.total_wins / total_battles * 100) if total_battles > 0 else 0
-            previous_total_battles = previous_stats.total_wins + previous_stats.total_losses if previous_stats else total_battles
-            previous_win_rate = (previous_stats.total_wins / previous_total_battles * 100) if previous_total_battles > 0 else win_rate
-
-            stats_data = {
-                'total_wins': {'current': current_stats.total_wins, 'previous': previous_stats.total_wins if previous_stats else current_stats.total_wins},
-                'total_losses': {'current': current_stats.total_losses, 'previous': previous_stats.total_losses if previous_stats else current_stats.total_losses},
-                'assaults_won': {'current': current_stats.assaults_won, 'previous': previous_stats.assaults_won if previous_stats else current_stats.assaults_won},
-                'assaults_lost': {'current': current_stats.assaults_lost, 'previous': previous_stats.assaults_lost if previous_stats else current_stats.assaults_lost},
-                'defending_battles_won': {'current': current_stats.defending_battles_won, 'previous': previous_stats.defending_battles_won if previous_stats else current_stats.defending_battles_won},
-                'defending_battles_lost': {'current': current_stats.defending_battles_lost, 'previous': previous_stats.defending_battles_lost if previous_stats else current_stats.defending_battles_lost},
-                'win_rate': {'current': round(win_rate, 2), 'previous': round(previous_win_rate, 2)},
-                'kills': {'current': current_stats.kills, 'previous': previous_stats.kills if previous_stats else current_stats.kills},
-                'destroyed_traps': {'current': current_stats.destroyed_traps, 'previous': previous_stats.destroyed_traps if previous_stats else current_stats.destroyed_traps},
-                'lost_associates': {'current': current_stats.lost_associates, 'previous': previous_stats.lost_associates if previous_stats else current_stats.lost_associates},
-                'lost_traps': {'current': current_stats.lost_traps, 'previous': previous_stats.lost_traps if previous_stats else current_stats.lost_traps},
-                'healed_associates': {'current': current_stats.healed_associates, 'previous': previous_stats.healed_associates if previous_stats else current_stats.healed_associates},
-                'wounded_enemy_associates': {'current': current_stats.wounded_enemy_associates, 'previous': previous_stats.wounded_enemy_associates if previous_stats else current_stats.wounded_enemy_associates},
-                'enemy_turfs_destroyed': {'current': current_stats.enemy_turfs_destroyed, 'previous': previous_stats.enemy_turfs_destroyed if previous_stats else current_stats.enemy_turfs_destroyed},
-                'turf_destroyed_times': {'current': current_stats.turf_destroyed_times, 'previous': previous_stats.turf_destroyed_times if previous_stats else current_stats.turf_destroyed_times},
-                'eliminated_enemy_influence': {'current': current_stats.eliminated_enemy_influence, 'previous': previous_stats.eliminated_enemy_influence if previous_stats else current_stats.eliminated_enemy_influence},
-            }
+        latest = latest_snapshots(current_user.id, 2)
+
+        if latest:
+            stats_data = build_stats_data(latest[0], latest[1] if len(latest) > 1 else None)
             return jsonify(stats_data), 200
         return jsonify({'error': 'No stats found'}), 404
     except Exception as e:
         return jsonify({'error': 'An unexpected error occurred', 'details': str(e)}), 500
+
+def build_history_entry(snapshot, metrics):
+    entry = {'id': snapshot.id, 'timestamp': snapshot.timestamp.isoformat() if snapshot.timestamp else None}
+    entry.update({column: getattr(snapshot, column) for column in COUNTER_COLUMNS})
+    entry.update(metrics)
+    return entry
+
+def build_rollup_entry(rollup, metrics):
+    entry = {'period_start': rollup.period_start.isoformat(), 'timestamp': rollup.last_timestamp.isoformat()}
+    entry.update({column: getattr(rollup, column) for column in COUNTER_COLUMNS})
+    entry.update(metrics)
+    entry['deltas'] = {column: getattr(rollup, f'{column}_delta') for column in COUNTER_COLUMNS}
+    return entry
+
+def parse_history_range(args):
+    """The ``from``/``to`` range and granularity of a history request. Without
+    a range the latest snapshots are returned raw, as before rollups existed."""
+    granularity = args.get('granularity', 'auto')
+    if granularity != 'auto' and granularity not in GRANULARITIES:
+        raise ValueError(f"granularity must be one of: auto, {', '.join(GRANULARITIES)}")
+    if not args.get('from'):
+        return None, None, 'raw' if granularity == 'auto' else granularity
+    now = utcnow()
+    start, end = parse_as_of(args['from'], now), parse_as_of(args.get('to'), now)
+    if start > end:
+        raise InvalidTimestamp('from must not be later than to')
+    return start, end, choose_granularity(start, end) if granularity == 'auto' else granularity
+
+def history_version():
+    # Rolled-up ranges also change when the rollup job catches up, and a
+    # relative range (from=7d) when its window moves on with the clock.
+    try:
+        start, end, granularity = parse_history_range(request.args)
+    except ValueError:
+        return None
+    version = stats_version() + (rollup_watermark(),)
+    if start is None:
+        return version
+    if granularity != 'raw':
+        # Rollups are selected by the periods the bounds fall in.
+        return version + (period_start(granularity, start), period_start(granularity, end))
+    # A raw window moves on continuously, so only absolute ones are cacheable.
+    if is_relative(request.args.get('from')) or is_relative(request.args.get('to')):
+        return None
+    return version
+
+@bp.route('/stats/history', methods=['GET'])
+@read_replica
+@login_required
+@conditional(history_version)
+def get_stats_history():
+    limit = parse_limit(request.args, 50, 500)
+    try:
+        start, end, granularity = parse_history_range(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        if granularity == 'raw':
+            query = Stats.query.filter_by(user_id=current_user.id)
+            if start:
+                query = query.filter(Stats.timestamp >= start, Stats.timestamp <= end)
+            snapshots = query.order_by(Stats.timestamp.desc(), Stats.id.desc()).limit(limit).all()
+            if len(snapshots) < limit:
+                snapshots += recent_archived_snapshots(current_user.id, start, end, limit - len(snapshots))
+            history = [build_history_entry(snapshot, metrics) for snapshot, metrics in zip(snapshots, snapshot_metrics(snapshots))]
+        else:
+            model = rollup_models()[granularity]
+            earliest_periods, pending = pending_rollups(granularity, [current_user.id], start, end)
+            query = model.query.filter_by(user_id=current_user.id).filter(stored_rollups_filter(model, earliest_periods))
+            if start:
+                query = query.filter(model.period_start >= period_start(granularity, start),
+                                     model.period_start <= period_start(granularity, end))
+            rollups = query.order_by(model.period_start.desc()).limit(limit).all()
+            rollups = sorted(rollups + [SimpleNamespace(**row) for row in pending],
+                             key=lambda rollup: rollup.period_start, reverse=True)[:limit]
+            # A period's metrics are those of its last snapshot, so they share its cache entry.
+            metrics = snapshot_metrics([SimpleNamespace(id=rollup.last_stats_id, **{column: getattr(rollup, column) for column in COUNTER_COLUMNS})
+                                        for rollup in rollups])
+            history = [build_rollup_entry(rollup, values) for rollup, values in zip(rollups, metrics)]
+        return jsonify({'granularity': granularity, 'history': history}), 200
+    except Exception as e:
+        return jsonify({'error': 'An unexpected error occurred', 'details': str(e)}), 500
+
+def snapshot_time(snapshot):
+    return snapshot.timestamp.isoformat() if snapshot and snapshot.timestamp else None
+
+@bp.route('/stats/compare', methods=['GET'])
+@read_replica
+@login_required
+def compare_stats():
+    try:
+        at, against = parse_comparison_window(request.args)
+    except InvalidTimestamp as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        current_stats, previous_stats = snapshots_as_of(User.id == current_user.id, at, against)[current_user.id]
+        if not current_stats:
+            return jsonify({'error': f'No stats recorded at or before {at.isoformat()}'}), 404
+        return jsonify({
+            'at': snapshot_time(current_stats),
+            'against': snapshot_time(previous_stats),
+            'stats': build_stats_data(current_stats, previous_stats)
+        }), 200
+    except Exception as e:
+        return jsonify({'error': 'An unexpected error occurred', 'details': str(e)}), 500
+
+def build_standing(sketch, value):
+    rank = sketch.rank(value) if sketch else None
+    if rank is None:
+        return None
+    return {'percentile': round(rank * 100, 1), 'top_percent': round((1 - rank) * 100, 1), 'players': sketch.total}
+
+@bp.route('/stats/percentiles', methods=['GET'])
+@read_replica
+@login_required
+def get_percentiles():
+    metrics = request.args.get('metrics')
+    metrics = metrics.split(',') if metrics else SKETCH_METRICS
+    unknown = [metric for metric in metrics if metric not in SKETCH_METRICS]
+    if unknown:
+        return jsonify({'error': f"Unknown metrics: {', '.join(unknown)}", 'available': SKETCH_METRICS}), 400
+
+    latest = latest_snapshot(current_user.id)
+    if not latest:
+        return jsonify({'error': 'No stats found'}), 404
+
+    values = sketch_values(latest)
+    scopes = [GLOBAL_SCOPE] + ([faction_scope(current_user.faction_id)] if current_user.faction_id else [])
+    sketches = load_sketches(scopes, metrics)
+    standings = {
+        metric: {
+            'value': values[metric],
+            'global': build_standing(sketches.get((GLOBAL_SCOPE, metric)), values[metric]),
+            'faction': build_standing(sketches.get((faction_scope(current_user.faction_id), metric)), values[metric])
+            if current_user.faction_id else None
+        }
+        for metric in metrics
+    }
+    return jsonify({'relative_accuracy': RELATIVE_ACCURACY, 'percentiles': standings}), 200
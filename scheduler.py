@@ -0,0 +1,66 @@
+from contextlib import contextmanager
+from sqlalchemy import text
+import click
+import threading
+import time
+
+
+def is_cli_command():
+    """Whether the app is being loaded by a ``flask`` command other than
+    ``flask run``, such as ``flask db upgrade``. Click has a current context
+    then, naming the group while it resolves an app command."""
+    context = click.get_current_context(silent=True)
+    return context is not None and context.info_name != 'run'
+
+
+@contextmanager
+def advisory_lock(key):
+    """Whether this process holds ``key``. On PostgreSQL a session advisory
+    lock, held on its own connection so commits in between do not release it,
+    elects one holder among all processes; elsewhere there is only one."""
+    from extensions import db
+
+    if db.engine.dialect.name != 'postgresql':
+        yield True
+        return
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        acquired = connection.execute(text('SELECT pg_try_advisory_lock(:key)'), {'key': key}).scalar()
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                connection.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': key})
+
+
+def schedule_periodic(app, name, interval, func, lock=None):
+    """Run ``func`` inside an app context now and then every ``interval``
+    seconds on a daemon thread. Each worker process runs its own copy, so
+    scheduled jobs must be idempotent; with ``lock``, only the process that
+    wins that advisory lock runs each round. Errors are logged and the job
+    keeps its schedule. Short-lived CLI processes, including migrations,
+    schedule nothing."""
+    from extensions import db
+
+    if is_cli_command():
+        return
+
+    def run_once():
+        if lock is None:
+            return func()
+        with advisory_lock(lock) as elected:
+            if elected:
+                return func()
+
+    def run():
+        while True:
+            with app.app_context():
+                try:
+                    run_once()
+                except Exception as e:
+                    app.logger.error(f"Scheduled job {name} failed: {str(e)}")
+                finally:
+                    db.session.remove()
+            time.sleep(interval)
+
+    threading.Thread(target=run, name=name, daemon=True).start()
+    app.logger.info(f"Scheduled job {name} every {interval}s")
@@ -0,0 +1,141 @@
+"""Point-in-time ("as of") and latest lookups of ``Stats`` snapshots.
+
+A snapshot as of a timestamp is the latest one recorded at or before it. Each
+lookup is a correlated ``ORDER BY timestamp DESC, id DESC LIMIT 1`` subquery,
+which the database runs as one backwards seek on ``ix_stats_user_id_timestamp``
+per user (a lateral join in all but name), so a whole faction is resolved in a
+single query regardless of how long the members' histories are.
+
+Lookups first search the ``LOOKBACK`` before the timestamp, which on
+PostgreSQL lets the planner skip all but the newest monthly partitions (see
+stats_partitions). Players idle for longer are looked up again in the older
+live months and finally in the archived ones.
+"""
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from sqlalchemy import select
+from extensions import db
+from metrics import COUNTER_COLUMNS
+from utils import utcnow
+import re
+
+RELATIVE_TIMESTAMP = re.compile(r'^(\d+)([hdw])$')
+RELATIVE_UNITS = {'h': 'hours', 'd': 'days', 'w': 'weeks'}
+LOOKBACK = timedelta(days=31)
+# Keeps IN lists under SQLite's bound parameter limit.
+IN_BATCH = 10000
+
+
+class InvalidTimestamp(ValueError):
+    pass
+
+
+def parse_as_of(value, now):
+    """Parse ``now``, a relative age such as ``24h``, ``7d`` or ``2w``, or an
+    ISO 8601 timestamp into a naive UTC datetime, as stored in ``Stats``."""
+    if not value or value == 'now':
+        return now
+    match = RELATIVE_TIMESTAMP.match(value)
+    if match:
+        return now - timedelta(**{RELATIVE_UNITS[match.group(2)]: int(match.group(1))})
+    try:
+        timestamp = datetime.fromisoformat(value)
+    except ValueError:
+        raise InvalidTimestamp(f"Invalid timestamp '{value}'")
+    if timestamp.tzinfo:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+
+def is_relative(value):
+    """Whether ``value`` is an age, which ``parse_as_of`` resolves against the
+    current time."""
+    return bool(value) and RELATIVE_TIMESTAMP.match(value) is not None
+
+
+def parse_comparison_window(args):
+    """The ``at`` and ``against`` query arguments. ``at`` defaults to now and
+    ``against`` to a week before ``at``."""
+    now = utcnow()
+    at = parse_as_of(args.get('at'), now)
+    against = parse_as_of(args['against'], now) if args.get('against') else at - timedelta(weeks=1)
+    if against > at:
+        raise InvalidTimestamp('against must not be later than at')
+    return at, against
+
+
+def batches(values, size=IN_BATCH):
+    values = list(values)
+    return [values[i:i + size] for i in range(0, len(values), size)]
+
+
+def as_of_ids(user_filter, timestamps, strictly_before, recent):
+    """Rows of a user id and their snapshot id as of each timestamp, searching
+    only the ``LOOKBACK`` before it when ``recent`` and only earlier otherwise."""
+    from models import User, Stats
+
+    as_of_columns = []
+    for timestamp in timestamps:
+        conditions = [Stats.user_id == User.id, Stats.timestamp < timestamp if strictly_before else Stats.timestamp <= timestamp]
+        conditions.append(Stats.timestamp >= timestamp - LOOKBACK if recent else Stats.timestamp < timestamp - LOOKBACK)
+        as_of_columns.append(select(Stats.id).where(*conditions).order_by(Stats.timestamp.desc(), Stats.id.desc()).limit(1)
+                             .correlate(User).scalar_subquery())
+    return db.session.query(User.id, *as_of_columns).filter(user_filter).all()
+
+
+def snapshots_as_of(user_filter, *timestamps, strictly_before=False):
+    """Map each user matching ``user_filter`` to a tuple with their snapshot as
+    of each timestamp, or None where nothing was recorded yet. Two queries when
+    every snapshot is within ``LOOKBACK``: one for the ids, one for the rows."""
+    from models import User, Stats
+    from stats_partitions import archived_as_of
+
+    snapshot_ids = {row[0]: list(row[1:]) for row in as_of_ids(user_filter, timestamps, strictly_before, recent=True)}
+    missing = [user_id for user_id, ids in snapshot_ids.items() if None in ids]
+    for user_ids in batches(missing):
+        for user_id, *older_ids in as_of_ids(User.id.in_(user_ids), timestamps, strictly_before, recent=False):
+            snapshot_ids[user_id] = [snapshot_id or older_id for snapshot_id, older_id in zip(snapshot_ids[user_id], older_ids)]
+
+    ids = {snapshot_id for row in snapshot_ids.values() for snapshot_id in row if snapshot_id is not None}
+    # Bounding the rows by time as well spares PostgreSQL the other partitions.
+    in_range = [Stats.timestamp <= max(timestamps)] if missing else [Stats.timestamp.between(min(timestamps) - LOOKBACK, max(timestamps))]
+    snapshots = {}
+    for batch in batches(ids):
+        snapshots.update((s.id, s) for s in Stats.query.filter(Stats.id.in_(batch), *in_range))
+    result = {user_id: [snapshots.get(snapshot_id) for snapshot_id in row] for user_id, row in snapshot_ids.items()}
+
+    for i, timestamp in enumerate(timestamps):
+        unresolved = [user_id for user_id, row in result.items() if row[i] is None]
+        if unresolved:
+            for user_id, snapshot in archived_as_of(unresolved, timestamp, strictly_before).items():
+                result[user_id][i] = snapshot
+    return {user_id: tuple(row) for user_id, row in result.items()}
+
+
+def latest_snapshots(user_id, count=1):
+    """A user's ``count`` newest snapshots, newest first: from the last
+    ``LOOKBACK`` if it has that many, else also from older and archived months."""
+    from models import Stats
+    from stats_partitions import recent_archived_snapshots
+
+    cutoff = utcnow() - LOOKBACK
+    query = Stats.query.filter_by(user_id=user_id).order_by(Stats.timestamp.desc(), Stats.id.desc())
+    snapshots = query.filter(Stats.timestamp >= cutoff).limit(count).all()
+    if len(snapshots) < count:
+        snapshots += query.filter(Stats.timestamp < cutoff).limit(count - len(snapshots)).all()
+    if len(snapshots) < count:
+        snapshots += recent_archived_snapshots(user_id, limit=count - len(snapshots))
+    return snapshots
+
+
+def latest_snapshot(user_id):
+    snapshots = latest_snapshots(user_id)
+    return snapshots[0] if snapshots else None
+
+
+def sum_snapshots(snapshots):
+    """Add up the counters of several snapshots into one snapshot-like object
+    that the derived metrics can be evaluated on."""
+    return SimpleNamespace(id=None, **{
+        column: sum(getattr(snapshot, column) or 0 for snapshot in snapshots) for column in COUNTER_COLUMNS
+    })
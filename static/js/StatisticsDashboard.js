@@ -18,15 +18,30 @@ function ArrowDownIcon() {
   );
 }
 
+function statKey(name) {
+  return name.toLowerCase().replace(/ /g, '_');
+}
+
+function applyStatsChanges(statistics, changes) {
+  // Every value moves on to a new snapshot; unchanged ones get a zero delta.
+  // Changes include derived metrics such as win_rate, computed by the server.
+  return statistics.map(stat => {
+    const change = changes[statKey(stat.name)];
+    return change
+      ? { ...stat, currentValue: change.current, previousValue: stat.currentValue }
+      : { ...stat, previousValue: stat.currentValue };
+  });
+}
+
 function StatisticsDashboard() {
   console.log('StatisticsDashboard component mounted'); // Debug log
   const [statistics, setStatistics] = useState([]);
 
   useEffect(() => {
-    console.log('Fetching stats data'); // Debug log
-    fetch('/stats')
-      .then(response => response.json())
-      .then(data => {
+    console.log('Loading stats data'); // Debug log
+    loadDashboardBootstrap()
+      .then(bootstrap => {
+        const data = bootstrap.stats || {};
         console.log('Received stats data:', data); // Debug log
         const orderedStats = [
           'total_wins',
@@ -36,6 +51,11 @@ function StatisticsDashboard() {
           'defending_battles_won',
           'defending_battles_lost',
           'win_rate',
+          'kd_ratio',
+          'assault_win_rate',
+          'defence_win_rate',
+          'trap_efficiency',
+          'heal_ratio',
           'kills',
           'destroyed_traps',
           'lost_associates',
@@ -58,6 +78,25 @@ function StatisticsDashboard() {
       .catch(error => console.error('Error fetching stats:', error));
   }, []);
 
+  useEffect(() => {
+    // Apply our own stat updates pushed over the faction event stream.
+    let currentUserId = null;
+    const onReady = event => { currentUserId = event.detail.user_id; };
+    const onStats = event => {
+      const { user_id, changes } = event.detail;
+      if (user_id !== currentUserId) {
+        return;
+      }
+      setStatistics(previousStatistics => applyStatsChanges(previousStatistics, changes));
+    };
+    document.addEventListener('faction:ready', onReady);
+    document.addEventListener('faction:stats', onStats);
+    return () => {
+      document.removeEventListener('faction:ready', onReady);
+      document.removeEventListener('faction:stats', onStats);
+    };
+  }, []);
+
   return (
     <div className="w-full max-w-4xl mx-auto">
       <h2 className="text-2xl font-bold mb-4">Battle Statistics Dashboard</h2>
@@ -0,0 +1,13 @@
+let dashboardBootstrap = null;
+
+// Stats, faction details, members and feature flags for the first paint.
+// Uses the payload inlined by the server when present, otherwise fetches it once.
+function loadDashboardBootstrap() {
+    if (!dashboardBootstrap) {
+        const inline = document.getElementById('dashboard-bootstrap');
+        dashboardBootstrap = inline
+            ? Promise.resolve(JSON.parse(inline.textContent))
+            : fetch('/dashboard/bootstrap').then(response => response.json());
+    }
+    return dashboardBootstrap;
+}
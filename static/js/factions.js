@@ -14,6 +14,7 @@ function createFaction() {
             alert(data.error);
         } else {
             alert(`Faction created successfully. Invitation code: ${data.invitation_code}`);
+            closeFactionEvents();
             getFactionMembers();
         }
     })
@@ -36,6 +37,7 @@ function joinFaction() {
             alert(data.error);
         } else {
             alert(data.message);
+            closeFactionEvents();
             getFactionMembers();
         }
     })
@@ -55,7 +57,12 @@ function getFactionMembers() {
     .catch(error => console.error('Error:', error));
 }
 
+let factionMembers = [];
+let factionEvents = null;
+let factionEventsUserId = null;
+
 function updateFactionMembersDisplay(members) {
+    factionMembers = members;
     const membersList = document.getElementById('faction-members');
     membersList.innerHTML = '';
     members.forEach(member => {
@@ -63,7 +70,68 @@ function updateFactionMembersDisplay(members) {
         li.textContent = member.username; // Update this line to display the username
         membersList.appendChild(li);
     });
+    subscribeToFactionEvents();
+}
+
+function subscribeToFactionEvents() {
+    if (factionEvents || !window.EventSource) {
+        return;
+    }
+    factionEvents = new EventSource('/faction/events');
+
+    factionEvents.addEventListener('member_joined', event => {
+        const data = JSON.parse(event.data);
+        if (!factionMembers.some(member => member.id === data.member.id)) {
+            updateFactionMembersDisplay(factionMembers.concat([data.member]));
+        }
+    });
+
+    factionEvents.addEventListener('member_left', event => {
+        const data = JSON.parse(event.data);
+        if (data.member.id === factionEventsUserId) {
+            // The stream ends once we leave; don't let the browser reconnect it.
+            closeFactionEvents();
+            factionMembers = [];
+            document.getElementById('faction-members').innerHTML = '';
+            return;
+        }
+        updateFactionMembersDisplay(factionMembers.filter(member => member.id !== data.member.id));
+    });
+
+    factionEvents.addEventListener('ready', event => {
+        factionEventsUserId = JSON.parse(event.data).user_id;
+    });
+
+    // Other scripts (e.g. StatisticsDashboard.js) listen for these on the document.
+    ['ready', 'stats'].forEach(type => {
+        factionEvents.addEventListener(type, event => {
+            document.dispatchEvent(new CustomEvent(`faction:${type}`, { detail: JSON.parse(event.data) }));
+        });
+    });
+
+    factionEvents.onerror = () => {
+        // The browser reconnects on its own unless the server refused the stream.
+        if (factionEvents.readyState === EventSource.CLOSED) {
+            factionEvents = null;
+        }
+    };
+}
+
+// Membership changed: the next subscribe opens a stream for the new faction.
+function closeFactionEvents() {
+    if (factionEvents) {
+        factionEvents.close();
+        factionEvents = null;
+    }
 }
 
-// Call getFactionMembers when the page loads
-document.addEventListener('DOMContentLoaded', getFactionMembers);
+// Show the faction members from the dashboard bootstrap when the page loads
+document.addEventListener('DOMContentLoaded', () => {
+    loadDashboardBootstrap()
+    .then(data => {
+        if (data.faction) {
+            updateFactionMembersDisplay(data.members);
+        }
+    })
+    .catch(error => console.error('Error:', error));
+});
@@ -65,5 +65,13 @@ function updateStatsDisplay(stats) {
     }
 }
 
-// Call getStats when the page loads
-document.addEventListener('DOMContentLoaded', getStats);
+// Show the stats from the dashboard bootstrap when the page loads
+document.addEventListener('DOMContentLoaded', () => {
+    loadDashboardBootstrap()
+    .then(data => {
+        if (data.stats) {
+            updateStatsDisplay(data.stats);
+        }
+    })
+    .catch(error => console.error('Error:', error));
+});
@@ -0,0 +1,392 @@
+"""Monthly partitions of ``Stats`` and archival of old months.
+
+On PostgreSQL ``stats`` is range partitioned by ``timestamp``: one partition
+per calendar month (``stats_y2024m10``) plus ``stats_default`` for anything
+outside them. Queries bounded in time only touch the months they cover, and
+the latest snapshots are read from the newest partitions first.
+``ensure_partitions`` keeps ``STATS_PARTITION_MONTHS_AHEAD`` months created in
+advance; rows that still land in the default partition are moved out when
+their month is created. On SQLite ``stats`` stays a single table and only
+archival applies.
+
+``maintain_partitions`` does both jobs. It runs from ``flask partitions
+maintain``, and at startup and every ``STATS_PARTITION_MAINTENANCE_SECONDS``
+in whichever server process wins an advisory lock.
+
+Archiving a month writes its rows to a zstd-compressed Parquet file in
+``STATS_ARCHIVE_DIR`` (storage every web host can read, so it has no
+default), sorted by user and time, then detaches and drops the
+partition (on SQLite, deletes the rows). History and exports read archived
+months back through ``archived_snapshots``, and latest and as-of lookups fall
+back to ``recent_archived_snapshots`` and ``archived_as_of`` for players with
+nothing live (see snapshots); ``stats_archive_user`` records which users each
+month holds, so those only open the files of months the player appears in. Archival is opt-in through
+``STATS_ARCHIVE_AFTER_MONTHS``, goes oldest month first and a month is only
+archived once the rollups have covered it.
+"""
+from datetime import date, datetime, time
+from heapq import merge
+from itertools import islice
+from types import SimpleNamespace
+from sqlalchemy import insert, literal, select, text
+from extensions import db
+from metrics import COUNTER_COLUMNS
+from scheduler import advisory_lock, schedule_periodic
+from snapshots import batches
+from stats_rollup import rollup_watermark
+from utils import utcnow
+import click
+import os
+import re
+
+DEFAULT_PARTITION = 'stats_default'
+PARTITION_NAME = re.compile(r'^stats_y(\d{4})m(\d{2})$')
+ARCHIVE_COLUMNS = ['id', 'user_id', 'timestamp'] + COUNTER_COLUMNS
+ARCHIVE_ROW_GROUP_SIZE = 100000
+ARCHIVE_READ_BATCH = 10000
+# Months created along with the table; maintenance keeps the configured number.
+INITIAL_MONTHS_AHEAD = 3
+MAINTENANCE_LOCK = 0x73746174
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def add_months(month, count):
+    months = month.year * 12 + month.month - 1 + count
+    return date(months // 12, months % 12 + 1, 1)
+
+
+def current_month():
+    return month_start(utcnow())
+
+
+def month_range(month):
+    return datetime.combine(month, time.min), datetime.combine(add_months(month, 1), time.min)
+
+
+def partition_name(month):
+    return f'stats_y{month.year}m{month.month:02d}'
+
+
+def is_partitioned(connection, table='stats'):
+    if connection.dialect.name != 'postgresql':
+        return False
+    return connection.execute(text(
+        "SELECT relkind = 'p' FROM pg_class WHERE relname = :table AND pg_catalog.pg_table_is_visible(oid)"
+    ), {'table': table}).scalar() or False
+
+
+def existing_partitions(connection, table='stats'):
+    """Map each month with an attached partition to the partition's name."""
+    names = connection.execute(text(
+        'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+        'JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = :table'
+    ), {'table': table}).scalars()
+    partitions = {}
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if match:
+            partitions[date(int(match.group(1)), int(match.group(2)), 1)] = name
+    return partitions
+
+
+def create_partition(connection, month, table='stats'):
+    name = partition_name(month)
+    start, end = month_range(month)
+    bounds = f"FOR VALUES FROM ('{start.isoformat(' ')}') TO ('{end.isoformat(' ')}')"
+    stranded = connection.execute(text(
+        f'SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} WHERE timestamp >= :start AND timestamp < :end)'
+    ), {'start': start, 'end': end}).scalar()
+    if not stranded:
+        connection.execute(text(f'CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table} {bounds}'))
+        return
+    # The range cannot be attached while the default partition holds rows in it.
+    connection.execute(text(f'CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS)'))
+    connection.execute(text(
+        f'WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE timestamp >= :start AND timestamp < :end RETURNING *) '
+        f'INSERT INTO {name} SELECT * FROM moved'
+    ), {'start': start, 'end': end})
+    connection.execute(text(f'ALTER TABLE {table} ATTACH PARTITION {name} {bounds}'))
+
+
+def ensure_partitions(connection, months_ahead, table='stats', since=None):
+    """Create the default partition and every monthly partition from ``since``
+    (default: this month) to ``months_ahead`` months from now. Returns the
+    months created; does nothing unless ``table`` is partitioned."""
+    if not is_partitioned(connection, table):
+        return []
+    connection.execute(text(f'CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF {table} DEFAULT'))
+    existing = existing_partitions(connection, table)
+    month, last = since or current_month(), add_months(current_month(), months_ahead)
+    created = []
+    while month <= last:
+        if month not in existing:
+            create_partition(connection, month, table)
+            created.append(month)
+        month = add_months(month, 1)
+    return created
+
+
+def archive_schema():
+    import pyarrow as pa
+
+    return pa.schema(
+        [('id', pa.int64()), ('user_id', pa.int64()), ('timestamp', pa.timestamp('us'))]
+        + [(column, pa.int64()) for column in COUNTER_COLUMNS]
+    )
+
+
+def write_archive(rows, path):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = archive_schema()
+    written = 0
+    with pq.ParquetWriter(path, schema, compression='zstd') as writer:
+        for batch in iter(lambda: list(islice(rows, ARCHIVE_ROW_GROUP_SIZE)), []):
+            columns = list(zip(*batch))
+            writer.write_table(pa.Table.from_arrays([pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                                                    schema=schema))
+            written += len(batch)
+    return written
+
+
+def archive_month(month, archive_dir):
+    """Move one month of stats into a Parquet file. Only past months that the
+    rollups have fully processed can be archived."""
+    from models import Stats, StatsArchive, StatsArchiveUser
+
+    month = month_start(month)
+    if month >= current_month():
+        raise ValueError(f'{month:%Y-%m} has not ended yet')
+    if db.session.get(StatsArchive, month):
+        raise ValueError(f'{month:%Y-%m} is already archived')
+    partitioned = is_partitioned(db.session.connection())
+    if partitioned and month not in existing_partitions(db.session.connection()):
+        raise ValueError(f'There is no partition for {month:%Y-%m}')
+
+    start, end = month_range(month)
+    in_month = (Stats.timestamp >= start, Stats.timestamp < end)
+    newest = db.session.query(db.func.max(Stats.id)).filter(*in_month).scalar()
+    if newest and newest > rollup_watermark():
+        raise ValueError(f'{month:%Y-%m} has not been rolled up yet')
+
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(os.path.abspath(archive_dir), f'{partition_name(month)}.parquet')
+    rows = db.session.query(*[getattr(Stats, column) for column in ARCHIVE_COLUMNS]).filter(*in_month
+                            ).order_by(Stats.user_id, Stats.timestamp, Stats.id).yield_per(ARCHIVE_READ_BATCH)
+    written = write_archive(iter(rows), path + '.part')
+    os.replace(path + '.part', path)
+    db.session.add(StatsArchive(month=month, path=path, row_count=written,
+                                archived_at=utcnow()))
+    db.session.flush()
+    db.session.execute(insert(StatsArchiveUser).from_select(
+        ['user_id', 'month'], select(Stats.user_id, literal(month)).filter(*in_month).distinct()))
+
+    # Rows written after the file was would otherwise be dropped with the month.
+    if partitioned:
+        name = partition_name(month)
+        db.session.execute(text(f'LOCK TABLE {name} IN SHARE MODE'))
+        removed = db.session.execute(text(f'SELECT count(*) FROM {name}')).scalar()
+        if removed == written:
+            db.session.execute(text(f'ALTER TABLE stats DETACH PARTITION {name}'))
+            db.session.execute(text(f'DROP TABLE {name}'))
+    else:
+        removed = Stats.query.filter(*in_month).delete(synchronize_session=False)
+    if removed != written:
+        db.session.rollback()
+        raise RuntimeError(f'{month:%Y-%m} changed while it was archived ({written} rows written, {removed} found)')
+    db.session.commit()
+    return written
+
+
+def archives_between(start=None, end=None):
+    from models import StatsArchive
+
+    query = StatsArchive.query
+    if start:
+        query = query.filter(StatsArchive.month >= month_start(start))
+    if end:
+        query = query.filter(StatsArchive.month <= end.date() if isinstance(end, datetime) else end)
+    return query.order_by(StatsArchive.month).all()
+
+
+def archives_of(user_ids, start=None, end=None):
+    """Map each archived month between ``start`` and ``end`` that holds any of
+    ``user_ids`` to the archive and those users, newest month first. Only the
+    ``stats_archive_user`` index is queried, never the files."""
+    from models import StatsArchiveUser
+
+    archives = {archive.month: archive for archive in archives_between(start, end)}
+    users = {}
+    for batch in batches(user_ids):
+        query = db.session.query(StatsArchiveUser.month, StatsArchiveUser.user_id).filter(
+            StatsArchiveUser.user_id.in_(batch), StatsArchiveUser.month.in_(list(archives)))
+        for month, user_id in query:
+            users.setdefault(month, set()).add(user_id)
+    return [(archives[month], users[month]) for month in sorted(users, reverse=True)]
+
+
+def row_groups_for(parquet, user_ids):
+    """Row groups whose ``user_id`` statistics overlap the requested users;
+    archives are sorted by user, so this skips most of a file."""
+    column = parquet.schema_arrow.get_field_index('user_id')
+    low, high = min(user_ids), max(user_ids)
+    groups = []
+    for i in range(parquet.num_row_groups):
+        statistics = parquet.metadata.row_group(i).column(column).statistics
+        if statistics is None or not statistics.has_min_max or (statistics.min <= high and statistics.max >= low):
+            groups.append(i)
+    return groups
+
+
+def read_archive(archive, user_ids, start=None, end=None):
+    """Snapshot-like rows of ``user_ids`` from one archived month, ordered by
+    user, time and id."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    parquet = pq.ParquetFile(archive.path)
+    wanted = pa.array(sorted(user_ids), type=pa.int64())
+    for batch in parquet.iter_batches(batch_size=ARCHIVE_READ_BATCH, row_groups=row_groups_for(parquet, user_ids)):
+        mask = pc.is_in(batch['user_id'], value_set=wanted)
+        if start:
+            mask = pc.and_(mask, pc.greater_equal(batch['timestamp'], pa.scalar(start, type=pa.timestamp('us'))))
+        if end:
+            mask = pc.and_(mask, pc.less_equal(batch['timestamp'], pa.scalar(end, type=pa.timestamp('us'))))
+        for row in batch.filter(mask).to_pylist():
+            yield SimpleNamespace(**row)
+
+
+def archived_snapshots(user_ids, start=None, end=None):
+    """Archived snapshots of ``user_ids``, ordered by user, time and id and
+    read one batch per month at a time."""
+    archives = archives_between(start, end) if user_ids else []
+    return merge(*[read_archive(archive, user_ids, start, end) for archive in archives],
+                 key=lambda snapshot: (snapshot.user_id, snapshot.timestamp, snapshot.id))
+
+
+def recent_archived_snapshots(user_id, start=None, end=None, limit=None):
+    """A user's archived snapshots newest first, reading only as many months as
+    it takes to reach ``limit``."""
+    snapshots = []
+    for archive, _ in archives_of([user_id], start, end):
+        snapshots.extend(reversed(list(read_archive(archive, [user_id], start, end))))
+        if limit and len(snapshots) >= limit:
+            return snapshots[:limit]
+    return snapshots
+
+
+def archived_as_of(user_ids, timestamp, strictly_before=False):
+    """Map those of ``user_ids`` with an archived snapshot at (or strictly
+    before) ``timestamp`` to the latest one, reading months newest first only
+    until every user is found."""
+    found, remaining = {}, set(user_ids)
+    for archive, archived_users in archives_of(user_ids, end=timestamp):
+        wanted = remaining & archived_users
+        if not wanted:
+            continue
+        # Rows come in time order, so each user's last one is kept.
+        for snapshot in read_archive(archive, wanted, end=timestamp):
+            if not strictly_before or snapshot.timestamp < timestamp:
+                found[snapshot.user_id] = snapshot
+        remaining -= found.keys()
+    return found
+
+
+def create_initial_partitions(target, connection, **kw):
+    """``after_create`` hook for ``stats``, so a table made by ``create_all``
+    accepts rows before maintenance first runs."""
+    ensure_partitions(connection, INITIAL_MONTHS_AHEAD)
+
+
+def maintain_partitions():
+    """Create upcoming partitions and archive months past
+    ``STATS_ARCHIVE_AFTER_MONTHS``, unless another process is already at it."""
+    from flask import current_app
+
+    with advisory_lock(MAINTENANCE_LOCK) as elected:
+        if not elected:
+            current_app.logger.info('Stats partition maintenance is running elsewhere')
+            return
+        run_maintenance(current_app)
+
+
+def archive_dir(app):
+    """``STATS_ARCHIVE_DIR``, which has to be set explicitly: every web host
+    reads the archives back, so they belong on storage all of them share, never
+    in a host's instance folder."""
+    directory = app.config.get('STATS_ARCHIVE_DIR')
+    if not directory:
+        raise ValueError('STATS_ARCHIVE_DIR must be set to a location shared by every host to archive stats')
+    instance_path = os.path.abspath(app.instance_path)
+    if os.path.commonpath([os.path.abspath(directory), instance_path]) == instance_path:
+        raise ValueError('STATS_ARCHIVE_DIR must not be inside the instance folder, which is local to one host')
+    return directory
+
+
+def run_maintenance(app):
+    config = app.config
+    created = ensure_partitions(db.session.connection(), config['STATS_PARTITION_MONTHS_AHEAD'])
+    db.session.commit()
+    if created:
+        app.logger.info(f"Created stats partitions for {', '.join(f'{month:%Y-%m}' for month in created)}")
+
+    if not config['STATS_ARCHIVE_AFTER_MONTHS'] or not is_partitioned(db.session.connection()):
+        return
+    cutoff = add_months(current_month(), -config['STATS_ARCHIVE_AFTER_MONTHS'])
+    for month in sorted(existing_partitions(db.session.connection())):
+        if month >= cutoff:
+            break
+        try:
+            rows = archive_month(month, archive_dir(app))
+        except ValueError as e:
+            # Usually a month the rollups have not reached; retried next run.
+            db.session.rollback()
+            app.logger.warning(f'Not archiving stats from {month:%Y-%m}: {str(e)}')
+            break
+        app.logger.info(f'Archived {rows} stats rows from {month:%Y-%m}')
+
+
+def init_stats_partitions(app):
+    app.config.setdefault('STATS_PARTITION_MONTHS_AHEAD', 3)
+    app.config.setdefault('STATS_ARCHIVE_AFTER_MONTHS', 0)
+    app.config.setdefault('STATS_ARCHIVE_DIR', None)
+    app.config.setdefault('STATS_PARTITION_MAINTENANCE_SECONDS', 86400)
+    if app.config['STATS_ARCHIVE_AFTER_MONTHS']:
+        # Fail at startup rather than at the first scheduled archive.
+        archive_dir(app)
+    # Runs at startup too, so processes restarted more often than the interval
+    # still keep the upcoming months created.
+    interval = app.config['STATS_PARTITION_MAINTENANCE_SECONDS']
+    if interval:
+        schedule_periodic(app, 'stats-partitions', interval, maintain_partitions)
+
+    @app.cli.group()
+    def partitions():
+        """Stats partition and archive commands."""
+
+    @partitions.command('maintain')
+    def maintain():
+        """Create upcoming partitions and archive old months, as the scheduled job does."""
+        maintain_partitions()
+
+    @partitions.command('ensure')
+    def ensure():
+        """Create the upcoming monthly stats partitions."""
+        created = ensure_partitions(db.session.connection(), app.config['STATS_PARTITION_MONTHS_AHEAD'])
+        db.session.commit()
+        click.echo(f"Created {len(created)} partitions")
+
+    @partitions.command('archive')
+    @click.argument('month')
+    def archive(month):
+        """Archive MONTH (YYYY-MM) of stats to a Parquet file."""
+        try:
+            rows = archive_month(datetime.strptime(month, '%Y-%m'), archive_dir(app))
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        click.echo(f'Archived {rows} rows from {month}')
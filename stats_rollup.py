@@ -0,0 +1,227 @@
+"""Incremental daily and weekly rollups of ``Stats`` snapshots.
+
+Each run picks up snapshots with ids past the stored watermark, batch by batch.
+For every user in a batch, the periods from the earliest one the batch touches
+onwards are recomputed from raw snapshots and replaced, and the watermark moves
+forward in the same transaction. Replaying a batch therefore rewrites the same
+rows, and an interrupted run resumes at the last committed batch.
+
+History reads combine the stored rows with ``pending_rollups``, which computes
+the periods touched by snapshots past the watermark from raw snapshots.
+Rollups run every ``STATS_ROLLUP_INTERVAL_SECONDS`` (a minute by default; 0
+leaves them to ``flask rollup``), and history reads fall back to raw snapshots
+for everything past the watermark, so the job has to keep up.
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from itertools import groupby
+from sqlalchemy import and_, false, func, insert, not_, or_
+from extensions import db
+from metrics import COUNTER_COLUMNS
+from scheduler import schedule_periodic
+from snapshots import snapshots_as_of
+from utils import utcnow
+import click
+
+WATERMARK = 'stats'
+GRANULARITIES = ('raw', 'day', 'week')
+# Ranges up to these spans are served at the finer granularity.
+RAW_MAX_SPAN = timedelta(days=2)
+DAILY_MAX_SPAN = timedelta(days=90)
+
+
+def rollup_models():
+    from models import StatsDaily, StatsWeekly
+    return {'day': StatsDaily, 'week': StatsWeekly}
+
+
+def period_start(granularity, timestamp):
+    day = timestamp.date()
+    return day - timedelta(days=day.weekday()) if granularity == 'week' else day
+
+
+def choose_granularity(start, end):
+    span = end - start
+    if span <= RAW_MAX_SPAN:
+        return 'raw'
+    return 'day' if span <= DAILY_MAX_SPAN else 'week'
+
+
+def rollup_watermark():
+    from models import RollupWatermark
+    return db.session.query(RollupWatermark.last_stats_id).filter_by(name=WATERMARK).scalar() or 0
+
+
+def period_rows(granularity, user_ids, start, max_stats_id=None):
+    """Rollup rows for ``user_ids`` from the period beginning ``start`` on,
+    computed from raw snapshots (up to ``max_stats_id``, when given)."""
+    from models import User, Stats
+
+    begin = datetime.combine(start, time.min)
+    baselines = snapshots_as_of(User.id.in_(user_ids), begin, strictly_before=True)
+    factions = dict(db.session.query(User.id, User.faction_id).filter(User.id.in_(user_ids)))
+    snapshots = db.session.query(
+        Stats.user_id, Stats.id, Stats.timestamp, *[getattr(Stats, column) for column in COUNTER_COLUMNS]
+    ).filter(Stats.user_id.in_(user_ids), Stats.timestamp >= begin)
+    if max_stats_id is not None:
+        snapshots = snapshots.filter(Stats.id <= max_stats_id)
+    snapshots = snapshots.order_by(Stats.user_id, Stats.timestamp, Stats.id)
+
+    rows = []
+    for user_id, user_snapshots in groupby(snapshots, key=lambda s: s.user_id):
+        previous = baselines.get(user_id, (None,))[0]
+        for period, period_snapshots in groupby(user_snapshots, key=lambda s: period_start(granularity, s.timestamp)):
+            period_snapshots = list(period_snapshots)
+            last = period_snapshots[-1]
+            # A user's first period is measured from its first snapshot.
+            baseline = previous or period_snapshots[0]
+            row = {
+                'user_id': user_id,
+                'period_start': period,
+                'faction_id': factions.get(user_id),
+                'last_stats_id': last.id,
+                'last_timestamp': last.timestamp,
+                'snapshot_count': len(period_snapshots),
+            }
+            for column in COUNTER_COLUMNS:
+                row[column] = getattr(last, column) or 0
+                row[f'{column}_delta'] = row[column] - (getattr(baseline, column) or 0)
+            rows.append(row)
+            previous = last
+    return rows
+
+
+def group_by_period(earliest_periods):
+    users_by_period = defaultdict(list)
+    for user_id, start in earliest_periods.items():
+        users_by_period[start].append(user_id)
+    return users_by_period.items()
+
+
+def rebuild_periods(granularity, earliest_periods, max_stats_id):
+    """Replace a user's rollup rows from their earliest affected period on,
+    using snapshots up to ``max_stats_id``. Later snapshots are left for the
+    batch that covers them."""
+    model = rollup_models()[granularity]
+    for start, user_ids in group_by_period(earliest_periods):
+        rows = period_rows(granularity, user_ids, start, max_stats_id)
+        model.query.filter(model.user_id.in_(user_ids), model.period_start >= start).delete(synchronize_session=False)
+        if rows:
+            db.session.execute(insert(model), rows)
+
+
+def pending_rollups(granularity, user_ids, start=None, end=None):
+    """Rollup rows for the periods touched by snapshots past the watermark,
+    computed from raw snapshots, so history stays current however far the
+    rollup job lags (or when it is off). Returns each user's first such period,
+    from which these rows replace the stored ones, and the rows themselves."""
+    from models import Stats
+
+    pending = db.session.query(Stats.user_id, func.min(Stats.timestamp)).filter(
+        Stats.user_id.in_(user_ids), Stats.id > rollup_watermark())
+    if start:
+        pending = pending.filter(Stats.timestamp >= datetime.combine(period_start(granularity, start), time.min),
+                                 Stats.timestamp <= end)
+    earliest_periods = {user_id: period_start(granularity, timestamp)
+                        for user_id, timestamp in pending.group_by(Stats.user_id)}
+
+    rows = []
+    for period, period_user_ids in group_by_period(earliest_periods):
+        rows.extend(period_rows(granularity, period_user_ids, period))
+    if end:
+        last_period = period_start(granularity, end)
+        rows = [row for row in rows if row['period_start'] <= last_period]
+    return earliest_periods, rows
+
+
+def stored_rollups_filter(model, earliest_periods):
+    """Excludes the stored rows that ``pending_rollups`` replaces."""
+    return not_(or_(false(), *[and_(model.user_id.in_(user_ids), model.period_start >= start)
+                               for start, user_ids in group_by_period(earliest_periods)]))
+
+
+def rollup_batch(batch_size, lag=0):
+    """Roll up the next batch of snapshots; returns how many were processed.
+
+    Ids are handed out before commit, so a snapshot can become visible after a
+    higher id has already been rolled up, and the watermark would skip it. The
+    batch therefore stops at the first snapshot younger than ``lag`` seconds,
+    leaving time for the writes around it to commit."""
+    from models import Stats, RollupWatermark
+
+    # The row lock keeps concurrent runners (one per worker process) in turn.
+    watermark = RollupWatermark.query.filter_by(name=WATERMARK).with_for_update().first()
+    if not watermark:
+        watermark = RollupWatermark(name=WATERMARK, last_stats_id=0)
+        db.session.add(watermark)
+
+    pending = db.session.query(Stats.id, Stats.user_id, Stats.timestamp).filter(
+        Stats.id > watermark.last_stats_id).order_by(Stats.id).limit(batch_size).all()
+    cutoff = utcnow() - timedelta(seconds=lag)
+    settled = next((i for i, snapshot in enumerate(pending) if snapshot.timestamp >= cutoff), len(pending))
+    pending = pending[:settled]
+    if not pending:
+        db.session.commit()
+        return 0
+
+    max_stats_id = pending[-1].id
+    for granularity in rollup_models():
+        earliest_periods = {}
+        for _, user_id, timestamp in pending:
+            start = period_start(granularity, timestamp)
+            earliest_periods[user_id] = min(earliest_periods.get(user_id, start), start)
+        rebuild_periods(granularity, earliest_periods, max_stats_id)
+
+    watermark.last_stats_id = max_stats_id
+    watermark.updated_at = utcnow()
+    db.session.commit()
+    return len(pending)
+
+
+def run_rollup(batch_size=None):
+    from flask import current_app
+
+    batch_size = batch_size or current_app.config['STATS_ROLLUP_BATCH_SIZE']
+    lag = current_app.config['STATS_ROLLUP_LAG_SECONDS']
+    processed = 0
+    while True:
+        count = rollup_batch(batch_size, lag)
+        processed += count
+        if count < batch_size:
+            return processed
+
+
+def reset_rollups():
+    """Discard the rollups of live months, which the next run rebuilds from
+    their snapshots. Rollups of archived months are kept: their snapshots are
+    no longer in the database to roll up again."""
+    from models import RollupWatermark, StatsArchive
+    from stats_partitions import add_months
+
+    newest_archive = db.session.query(func.max(StatsArchive.month)).scalar()
+    for model in rollup_models().values():
+        query = model.query
+        if newest_archive:
+            query = query.filter(model.period_start >= add_months(newest_archive, 1))
+        query.delete(synchronize_session=False)
+    RollupWatermark.query.filter_by(name=WATERMARK).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def init_stats_rollup(app):
+    app.config.setdefault('STATS_ROLLUP_INTERVAL_SECONDS', 60)
+    app.config.setdefault('STATS_ROLLUP_BATCH_SIZE', 5000)
+    app.config.setdefault('STATS_ROLLUP_LAG_SECONDS', 60)
+    interval = app.config['STATS_ROLLUP_INTERVAL_SECONDS']
+    if interval:
+        schedule_periodic(app, 'stats-rollup', interval, run_rollup)
+
+    @app.cli.command('rollup')
+    @click.option('--rebuild', is_flag=True, help='Discard the rollups of live months and roll them up again.')
+    @click.option('--batch-size', type=int, default=None, help='Snapshots per transaction.')
+    def rollup(rebuild, batch_size):
+        """Roll up new stats snapshots into the daily and weekly tables."""
+        if rebuild:
+            reset_rollups()
+        processed = run_rollup(batch_size)
+        click.echo(f'Rolled up {processed} snapshots (watermark {rollup_watermark()})')
@@ -0,0 +1,78 @@
+import os
+import tempfile
+
+# app.py builds the application on import, so the database has to be chosen first.
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'test.db')
+os.environ['FACTION_SUMMARY_REFRESH_SECONDS'] = '0'
+os.environ['STATS_PARTITION_MAINTENANCE_SECONDS'] = '0'
+os.environ['STATS_ROLLUP_INTERVAL_SECONDS'] = '0'
+os.environ['EXPORT_CLEANUP_SECONDS'] = '0'
+
+import pytest
+from flask import g
+import metrics
+from app import app as flask_app
+from extensions import db
+from models import User, Faction, Stats
+
+
+@pytest.fixture
+def app(monkeypatch, tmp_path):
+    # Each test starts from a cold cache, so cache hits are the test's own.
+    monkeypatch.setattr(metrics, 'snapshot_cache', metrics.SnapshotMetricCache())
+    flask_app.config.update(TESTING=True, STATS_ARCHIVE_DIR=str(tmp_path / 'archive'))
+    with flask_app.app_context():
+        db.create_all()
+        yield flask_app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def login(client):
+    def login(user):
+        # Requests reuse the fixture's app context, where Flask-Login caches the user.
+        g.pop('_login_user', None)
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user.id)
+            session['_fresh'] = True
+        return client
+    return login
+
+
+@pytest.fixture
+def make_user(app):
+    def make_user(username, faction=None):
+        user = User(username=username, email=f'{username}@example.com', faction=faction)
+        user.set_password('password')
+        db.session.add(user)
+        if faction:
+            faction.member_count += 1
+        db.session.commit()
+        return user
+    return make_user
+
+
+@pytest.fixture
+def make_faction(app):
+    def make_faction(name):
+        faction = Faction(name=name, invitation_code=name.lower()[:16], leader_username=name, member_count=0)
+        db.session.add(faction)
+        db.session.commit()
+        return faction
+    return make_faction
+
+
+@pytest.fixture
+def add_stats(app):
+    def add_stats(user, timestamp=None, **counters):
+        snapshot = Stats(user_id=user.id, timestamp=timestamp, **counters)
+        db.session.add(snapshot)
+        db.session.commit()
+        return snapshot
+    return add_stats
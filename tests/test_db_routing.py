@@ -0,0 +1,88 @@
+from flask import Flask, jsonify
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.orm import DeclarativeBase
+import pytest
+import db_routing
+from db_routing import RoutingSession, init_db_routing, lag_monitor, read_replica
+
+
+class Base(DeclarativeBase):
+    pass
+
+
+routed_db = SQLAlchemy(model_class=Base, session_options={'class_': RoutingSession})
+
+
+class Item(routed_db.Model):
+    id = routed_db.Column(routed_db.Integer, primary_key=True)
+    name = routed_db.Column(routed_db.String(32), nullable=False)
+
+
+def names():
+    return jsonify([item.name for item in Item.query.order_by(Item.id)])
+
+
+@pytest.fixture
+def routed(tmp_path):
+    """An app on two SQLite files, each holding one row that names it, so a
+    response shows which database served it."""
+    app = Flask(__name__)
+    app.config.update(
+        TESTING=True,
+        SECRET_KEY='test',
+        SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'primary.db'}",
+        SQLALCHEMY_BINDS={'replica': f"sqlite:///{tmp_path / 'replica.db'}"},
+    )
+    routed_db.init_app(app)
+    init_db_routing(app)
+
+    app.get('/plain')(names)
+    app.get('/read', endpoint='read')(read_replica(names))
+
+    @app.post('/write')
+    def write():
+        routed_db.session.add(Item(name='written'))
+        routed_db.session.commit()
+        return jsonify([])
+
+    @app.get('/read-after-flush')
+    @read_replica
+    def read_after_flush():
+        routed_db.session.add(Item(name='flushed'))
+        routed_db.session.flush()
+        return names()
+
+    with app.app_context():
+        for name, engine in routed_db.engines.items():
+            Item.__table__.create(engine)
+            with engine.begin() as connection:
+                connection.execute(Item.__table__.insert(), {'name': name or 'primary'})
+    lag_monitor.reset()
+    yield app
+    lag_monitor.reset()
+
+
+def test_reads_go_to_the_replica(routed):
+    client = routed.test_client()
+    assert client.get('/read').get_json() == ['replica']
+    assert client.get('/plain').get_json() == ['primary']
+
+
+def test_reads_after_a_flush_stay_on_the_primary(routed):
+    assert routed.test_client().get('/read-after-flush').get_json() == ['primary', 'flushed']
+
+
+def test_writers_are_pinned_to_the_primary(routed, monkeypatch):
+    client = routed.test_client()
+    assert client.post('/write').status_code == 200
+    assert client.get('/read').get_json() == ['primary', 'written']
+
+    later = db_routing.time.time() + routed.config['READ_YOUR_WRITES_SECONDS'] + 1
+    monkeypatch.setattr(db_routing.time, 'time', lambda: later)
+    assert client.get('/read').get_json() == ['replica']
+
+
+@pytest.mark.parametrize('lag', [60.0, None])
+def test_lagging_or_unreachable_replicas_fall_back_to_the_primary(routed, monkeypatch, lag):
+    monkeypatch.setattr(lag_monitor, '_measure', lambda engine: lag)
+    assert routed.test_client().get('/read').get_json() == ['primary']
@@ -0,0 +1,117 @@
+from datetime import timedelta
+import pytest
+from extensions import db
+from faction_directory import (InvalidCursor, decode_cursor, encode_cursor, refresh_faction_summaries,
+                               search_factions, update_faction_summary)
+from models import FactionSummary
+from utils import utcnow
+
+
+def names(page):
+    return [summary.name for summary in page]
+
+
+def test_summaries_sum_each_members_latest_kills(app, make_user, make_faction, add_stats):
+    mob, crew = make_faction('Mob'), make_faction('Crew')
+    alice, bob, carol = make_user('alice', mob), make_user('bob', mob), make_user('carol')
+    add_stats(alice, utcnow() - timedelta(days=2), kills=10)
+    add_stats(alice, utcnow() - timedelta(days=1), kills=25)
+    add_stats(bob, utcnow() - timedelta(days=90), kills=7)
+    add_stats(carol, kills=1000)
+
+    assert refresh_faction_summaries() == 2
+    summaries = {summary.name: (summary.member_count, summary.total_kills) for summary in FactionSummary.query}
+    assert summaries == {'Mob': (2, 32), 'Crew': (0, 0)}
+    assert db.session.get(FactionSummary, crew.id).name_lower == 'crew'
+
+
+def test_refresh_drops_deleted_factions(app, make_faction):
+    mob, crew = make_faction('Mob'), make_faction('Crew')
+    refresh_faction_summaries()
+    db.session.delete(crew)
+    db.session.commit()
+
+    refresh_faction_summaries()
+    assert [summary.faction_id for summary in FactionSummary.query] == [mob.id]
+
+
+def test_single_faction_update(app, make_user, make_faction, add_stats):
+    mob = make_faction('Mob')
+    refresh_faction_summaries()
+    alice = make_user('alice', mob)
+    add_stats(alice, kills=5)
+
+    update_faction_summary(mob.id, joined=[alice.id])
+    db.session.commit()
+    summary = db.session.get(FactionSummary, mob.id)
+    assert (summary.member_count, summary.total_kills) == (1, 5)
+
+    # Only the joining member is looked up; alice's new kills wait for the refresh.
+    add_stats(alice, kills=9)
+    carol = make_user('carol', mob)
+    add_stats(carol, kills=2)
+    update_faction_summary(mob.id, joined=[carol.id])
+    db.session.commit()
+    db.session.refresh(summary)
+    assert (summary.member_count, summary.total_kills) == (2, 7)
+    refresh_faction_summaries()
+    assert db.session.get(FactionSummary, mob.id).total_kills == 11
+
+
+def test_membership_changes_update_the_directory(app, login, make_user, make_faction):
+    mob = make_faction('Mob')
+    refresh_faction_summaries()
+    client = login(make_user('alice'))
+
+    assert client.post('/faction/join', json={'invitation_code': mob.invitation_code}).status_code == 200
+    assert client.get('/factions').get_json()['factions'][0]['member_count'] == 1
+    assert client.post('/faction/leave').status_code == 200
+    assert client.get('/factions').get_json()['factions'][0]['member_count'] == 0
+
+
+def test_search_matches_prefixes_and_substrings(app, make_faction):
+    for name in ['Night Owls', 'Nightshade', 'Owl Club', 'Knights_']:
+        make_faction(name)
+    refresh_faction_summaries()
+
+    assert sorted(names(search_factions('ni', 'members', None, 10)[0])) == ['Night Owls', 'Nightshade']
+    # From three characters on, the name may match anywhere.
+    assert sorted(names(search_factions('OWL', 'members', None, 10)[0])) == ['Night Owls', 'Owl Club']
+    # LIKE wildcards in the query are taken literally.
+    assert names(search_factions('ts_', 'members', None, 10)[0]) == ['Knights_']
+    assert names(search_factions('%', 'members', None, 10)[0]) == []
+
+
+def test_keyset_pages_cover_every_faction_once(app, make_faction):
+    for i in range(7):
+        faction = make_faction(f'Faction {i}')
+        faction.member_count = i % 3
+    db.session.commit()
+    refresh_faction_summaries()
+
+    seen, cursor = [], None
+    while True:
+        page, cursor = search_factions('', 'members', cursor, 3)
+        seen.extend((summary.member_count, summary.faction_id) for summary in page)
+        if cursor is None:
+            break
+    assert len(seen) == 7
+    assert seen == sorted(seen, reverse=True)
+
+
+def test_cursors_round_trip():
+    assert decode_cursor(encode_cursor(120, 7)) == (120, 7)
+    with pytest.raises(InvalidCursor):
+        decode_cursor('not a cursor')
+
+
+def test_directory_endpoint(client, make_faction):
+    make_faction('Mob')
+    refresh_faction_summaries()
+
+    response = client.get('/factions?sort=kills&limit=1')
+    assert response.status_code == 200
+    assert response.get_json()['factions'][0]['name'] == 'Mob'
+    assert response.headers['Cache-Control'] in ('public, max-age=60', 'max-age=60, public')
+    assert client.get('/factions?sort=name').status_code == 400
+    assert client.get('/factions?after=garbage').status_code == 400
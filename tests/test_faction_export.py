@@ -0,0 +1,31 @@
+from datetime import timedelta
+import os
+import time
+from extensions import db
+from faction_export import export_path, prune_exports
+from models import ExportJob
+from utils import utcnow
+
+
+def test_interrupted_jobs_fail_and_lose_their_partial_files(app, make_user, make_faction, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'EXPORT_DIR', str(tmp_path))
+    mob = make_faction('Mob')
+    alice = make_user('alice', mob)
+    jobs = {}
+    for name, age in [('orphaned', timedelta(hours=2)), ('running', timedelta(minutes=5))]:
+        jobs[name] = ExportJob(id=name, faction_id=mob.id, user_id=alice.id, format='csv', status='running',
+                               created_at=utcnow() - age)
+        db.session.add(jobs[name])
+    db.session.commit()
+    paths = {name: export_path(app, job) + '.part' for name, job in jobs.items()}
+    # A partial file whose job is gone, for example deleted with its faction.
+    paths['unowned'] = str(tmp_path / 'unowned.csv.part')
+    for name, path in paths.items():
+        open(path, 'w').close()
+        if name != 'running':
+            stale = time.time() - 2 * 3600
+            os.utime(path, (stale, stale))
+
+    prune_exports(app)
+    assert (jobs['orphaned'].status, jobs['running'].status) == ('failed', 'running')
+    assert sorted(os.listdir(tmp_path)) == ['running.csv.part']
@@ -0,0 +1,81 @@
+from types import SimpleNamespace
+import numpy as np
+import pytest
+from metrics import COUNTER_COLUMNS, Metric, MetricRegistry, registry, snapshot_metrics
+
+
+def snapshot(id=None, **counters):
+    return SimpleNamespace(id=id, **{column: counters.get(column, 0) for column in COUNTER_COLUMNS})
+
+
+def test_registered_metrics():
+    values = registry.evaluate({
+        'total_wins': [3, 0], 'total_losses': [1, 0],
+        'kills': [10, 5], 'lost_associates': [4, 0],
+        'assaults_won': [1, 0], 'assaults_lost': [1, 0],
+        'defending_battles_won': [0, 0], 'defending_battles_lost': [2, 0],
+        'destroyed_traps': [1, 0], 'lost_traps': [2, 0],
+        'healed_associates': [1, 0],
+    })
+    assert list(values['win_rate']) == [75.0, 0.0]
+    assert list(values['kd_ratio']) == [2.5, 0.0]
+    assert list(values['assault_win_rate']) == [50.0, 0.0]
+    assert list(values['defence_win_rate']) == [0.0, 0.0]
+    assert list(values['trap_efficiency']) == [33.33, 0.0]
+    assert list(values['heal_ratio']) == [25.0, 0.0]
+
+
+def test_division_by_zero_is_zero():
+    metric = Metric('ratio', 'kills / lost_associates')
+    assert list(metric.evaluate({'kills': np.array([1.0, 0.0]), 'lost_associates': np.array([0.0, 0.0])})) == [0.0, 0.0]
+
+
+def test_expression_operators_and_constants():
+    metric = Metric('score', '-kills + 2 * total_wins - 1', decimals=0)
+    assert list(metric.evaluate({'kills': np.array([1.0, 4.0]), 'total_wins': np.array([3.0, 0.0])})) == [4.0, -5.0]
+    assert metric.columns == {'kills', 'total_wins'}
+
+
+def test_constant_metric_is_broadcast():
+    metric = Metric('one', '1')
+    assert list(metric.evaluate({'kills': np.array([5.0, 6.0, 7.0])})) == [1.0, 1.0, 1.0]
+
+
+@pytest.mark.parametrize('expression', ['kills ** 2', 'kills % 3', 'abs(kills)', 'kills if kills else 0', "'kills'"])
+def test_unsupported_expressions_are_rejected(expression):
+    with pytest.raises(ValueError):
+        Metric('bad', expression)
+
+
+def test_unknown_columns_are_rejected():
+    with pytest.raises(ValueError, match="Unknown column 'deaths'"):
+        Metric('bad', 'kills / deaths')
+
+
+def test_registry_columns():
+    metrics = MetricRegistry()
+    metrics.register('kd', 'kills / lost_associates')
+    metrics.register('wins', 'total_wins')
+    assert metrics.columns == ['kills', 'lost_associates', 'total_wins']
+
+
+def test_snapshot_metrics_keep_order():
+    snapshots = [snapshot(1, kills=10, lost_associates=5), snapshot(None, total_wins=1, total_losses=3), snapshot(2)]
+    values = snapshot_metrics(snapshots)
+    assert [metrics['kd_ratio'] for metrics in values] == [2.0, 0.0, 0.0]
+    assert [metrics['win_rate'] for metrics in values] == [0.0, 25.0, 0.0]
+    assert set(values[0]) == set(registry.metrics)
+
+
+def test_snapshot_metrics_are_cached_by_id_and_counters(app, monkeypatch):
+    evaluated = []
+    evaluate = registry.evaluate
+    monkeypatch.setattr(registry, 'evaluate', lambda columns: evaluated.append(columns) or evaluate(columns))
+
+    assert snapshot_metrics([snapshot(7, kills=10, lost_associates=5)])[0]['kd_ratio'] == 2.0
+    assert snapshot_metrics([snapshot(7, kills=10, lost_associates=5)])[0]['kd_ratio'] == 2.0
+    assert len(evaluated) == 1
+    # A reused id (SQLite hands them out again after a delete) is a new snapshot.
+    assert snapshot_metrics([snapshot(7, kills=1, lost_associates=1)])[0]['kd_ratio'] == 1.0
+    assert snapshot_metrics([snapshot(None, kills=3, lost_associates=1)])[0]['kd_ratio'] == 3.0
+    assert len(evaluated) == 3
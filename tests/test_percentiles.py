@@ -0,0 +1,126 @@
+import logging
+import pytest
+from extensions import db
+from models import PercentileBucket
+from percentiles import (GLOBAL_SCOPE, RELATIVE_ACCURACY, ZERO_BUCKET, QuantileSketch, bucket_index, bucket_value,
+                         faction_scope, rebuild_sketches, record_user_removal, upsert_buckets)
+from metrics import COUNTER_COLUMNS
+
+
+def stored_buckets():
+    return {(b.scope, b.metric, b.bucket): b.count for b in PercentileBucket.query}
+
+
+def stats_payload(**counters):
+    return {column: counters.get(column, 0) for column in COUNTER_COLUMNS}
+
+
+@pytest.mark.parametrize('value', [0.5, 1, 7, 99.5, 12345, 10 ** 9])
+def test_bucket_value_is_within_relative_accuracy(value):
+    assert abs(bucket_value(bucket_index(value)) - value) <= RELATIVE_ACCURACY * value
+
+
+def test_zero_and_missing_values_share_the_zero_bucket():
+    assert bucket_index(0) == bucket_index(None) == ZERO_BUCKET
+    assert bucket_value(ZERO_BUCKET) == 0.0
+
+
+def test_sketch_rank_and_quantile():
+    sketch = QuantileSketch()
+    for value in range(1, 101):
+        sketch.add(value)
+    assert sketch.total == 100
+    assert sketch.rank(50) == pytest.approx(0.495, abs=0.01)
+    assert sketch.rank(1000) == 1.0
+    assert sketch.quantile(0.5) == pytest.approx(50, rel=0.03)
+    assert sketch.quantile(0.9) == pytest.approx(90, rel=0.03)
+    assert sketch.quantile(0) == pytest.approx(1, rel=RELATIVE_ACCURACY)
+
+
+def test_empty_sketch_has_no_rank():
+    assert QuantileSketch().rank(5) is None
+    assert QuantileSketch().quantile(0.5) is None
+
+
+def test_sketches_merge_by_adding_counts():
+    low, high = QuantileSketch(), QuantileSketch()
+    low.add(1, count=3)
+    high.add(100)
+    merged = low.merge(high)
+    assert merged.total == 4
+    assert merged.rank(100) == pytest.approx(0.875)
+
+
+def test_upsert_buckets_drops_emptied_buckets(app):
+    upsert_buckets({(GLOBAL_SCOPE, 'kills', 5): 2, (GLOBAL_SCOPE, 'kills', 6): 1})
+    upsert_buckets({(GLOBAL_SCOPE, 'kills', 5): -2, (GLOBAL_SCOPE, 'kills', 6): 1})
+    assert stored_buckets() == {(GLOBAL_SCOPE, 'kills', 6): 2}
+
+
+def test_upsert_buckets_warns_when_a_count_goes_negative(app, caplog):
+    with caplog.at_level(logging.WARNING, logger='percentiles'):
+        upsert_buckets({(GLOBAL_SCOPE, 'kills', 5): -1})
+    assert stored_buckets() == {}
+    assert 'flask percentiles rebuild' in caplog.text
+
+
+def test_incremental_updates_match_a_rebuild(app, login, make_user, make_faction):
+    faction = make_faction('Mob')
+    alice, bob = make_user('alice', faction), make_user('bob')
+    rebuild_sketches()
+
+    for user, kills in [(alice, 10), (bob, 30), (alice, 25), (bob, 0), (alice, 25)]:
+        response = login(user).post('/stats', json=stats_payload(kills=kills, total_wins=kills, total_losses=3))
+        assert response.status_code == 200
+    incremental = stored_buckets()
+    assert incremental[(faction_scope(faction.id), 'kills', bucket_index(25))] == 1
+    assert sum(count for (scope, metric, _), count in incremental.items() if scope == GLOBAL_SCOPE and metric == 'kills') == 2
+
+    assert rebuild_sketches() == 2
+    assert stored_buckets() == incremental
+
+
+def test_membership_changes_move_the_latest_snapshot(app, login, make_user, make_faction, add_stats):
+    faction = make_faction('Mob')
+    alice = make_user('alice')
+    add_stats(alice, kills=40)
+    rebuild_sketches()
+
+    client = login(alice)
+    assert client.post('/faction/join', json={'invitation_code': faction.invitation_code}).status_code == 200
+    joined = stored_buckets()
+    assert joined[(faction_scope(faction.id), 'kills', bucket_index(40))] == 1
+    rebuild_sketches()
+    assert stored_buckets() == joined
+
+    assert client.post('/faction/leave').status_code == 200
+    assert not any(scope == faction_scope(faction.id) for scope, _, _ in stored_buckets())
+
+
+def test_removed_players_leave_the_sketches(app, make_user, make_faction, add_stats):
+    faction = make_faction('Mob')
+    alice, bob = make_user('alice', faction), make_user('bob')
+    add_stats(alice, kills=5)
+    add_stats(bob, kills=9)
+    rebuild_sketches()
+
+    record_user_removal([alice.id])
+    db.session.commit()
+    assert stored_buckets()[(GLOBAL_SCOPE, 'kills', bucket_index(9))] == 1
+    assert (GLOBAL_SCOPE, 'kills', bucket_index(5)) not in stored_buckets()
+    assert not any(scope == faction_scope(faction.id) for scope, _, _ in stored_buckets())
+
+
+def test_percentiles_endpoint(app, login, make_user, add_stats):
+    players = [make_user(f'player{i}') for i in range(4)]
+    for i, player in enumerate(players):
+        add_stats(player, kills=(i + 1) * 100)
+    rebuild_sketches()
+
+    response = login(players[3]).get('/stats/percentiles?metrics=kills')
+    assert response.status_code == 200
+    standing = response.get_json()['percentiles']['kills']
+    assert standing['value'] == 400
+    assert standing['global'] == {'percentile': 87.5, 'top_percent': 12.5, 'players': 4}
+    assert standing['faction'] is None
+    assert login(players[0]).get('/stats/percentiles?metrics=deaths').status_code == 400
@@ -0,0 +1,109 @@
+from datetime import datetime, timedelta
+import pytest
+import stats_partitions
+from models import User, Stats, StatsDaily, PercentileBucket
+from metrics import COUNTER_COLUMNS
+from percentiles import rebuild_sketches
+from snapshots import LOOKBACK, latest_snapshots, parse_as_of, snapshots_as_of, InvalidTimestamp
+from stats_partitions import add_months, archive_month, current_month, month_range
+from stats_rollup import rollup_batch
+from utils import utcnow
+
+
+def kills(snapshots):
+    return [snapshot.kills if snapshot else None for snapshot in snapshots]
+
+
+def test_parse_as_of():
+    now = datetime(2024, 10, 17, 12)
+    assert parse_as_of('now', now) == now
+    assert parse_as_of('36h', now) == datetime(2024, 10, 16)
+    assert parse_as_of('2w', now) == datetime(2024, 10, 3, 12)
+    assert parse_as_of('2024-10-17T14:00:00+02:00', now) == now
+    with pytest.raises(InvalidTimestamp):
+        parse_as_of('yesterday', now)
+
+
+def test_lookups_reach_past_the_lookback(app, make_user, add_stats):
+    now = utcnow()
+    active, idle, new = make_user('active'), make_user('idle'), make_user('new')
+    add_stats(active, now - timedelta(days=1), kills=2)
+    add_stats(active, now - LOOKBACK * 3, kills=1)
+    add_stats(idle, now - LOOKBACK * 2, kills=5)
+    add_stats(idle, now - LOOKBACK * 3, kills=4)
+
+    assert kills(latest_snapshots(active.id, 3)) == [2, 1]
+    assert kills(latest_snapshots(idle.id, 2)) == [5, 4]
+    assert latest_snapshots(new.id) == []
+
+    as_of = snapshots_as_of(User.id.isnot(None), now, now - timedelta(days=2))
+    assert {user_id: kills(row) for user_id, row in as_of.items()} == {
+        active.id: [2, 1], idle.id: [5, 5], new.id: [None, None]}
+    before = snapshots_as_of(User.id == active.id, now - timedelta(days=1), strictly_before=True)
+    assert kills(before[active.id]) == [1]
+
+
+@pytest.fixture
+def archived(app, make_user, add_stats):
+    """Two players whose only snapshots are in a month that has been archived."""
+    pytest.importorskip('pyarrow')
+    month = add_months(current_month(), -3)
+    start, _ = month_range(month)
+    idle, other = make_user('idle'), make_user('other')
+    for day in range(1, 4):
+        add_stats(idle, start + timedelta(days=day), kills=100 + day, total_wins=day)
+    add_stats(other, start + timedelta(days=1), kills=7)
+    # A newer live row, so ids are not handed out again once the month is gone.
+    add_stats(make_user('active'), kills=1)
+    rebuild_sketches()
+    rollup_batch(100)
+    assert archive_month(month, app.config['STATS_ARCHIVE_DIR']) == 4
+    assert Stats.query.filter(Stats.user_id.in_([idle.id, other.id])).count() == 0
+    return idle, other, start
+
+
+def test_lookups_fall_back_to_archived_months(archived):
+    idle, other, start = archived
+
+    assert kills(latest_snapshots(idle.id, 2)) == [103, 102]
+    as_of = snapshots_as_of(User.id.in_([idle.id, other.id]), utcnow(), start + timedelta(days=2, hours=1))
+    assert kills(as_of[idle.id]) == [103, 102]
+    assert kills(as_of[other.id]) == [7, 7]
+    before = snapshots_as_of(User.id == idle.id, start + timedelta(days=2), strictly_before=True)
+    assert kills(before[idle.id]) == [101]
+
+
+def test_archives_are_only_read_for_players_in_them(archived, make_user, monkeypatch):
+    idle, _, _ = archived
+    opened = []
+    read_archive = stats_partitions.read_archive
+    monkeypatch.setattr(stats_partitions, 'read_archive',
+                        lambda archive, *args, **kwargs: opened.append(archive.month) or read_archive(archive, *args, **kwargs))
+
+    new = make_user('new')
+    assert latest_snapshots(new.id, 5) == []
+    assert kills(snapshots_as_of(User.id == new.id, utcnow())[new.id]) == [None]
+    assert opened == []
+
+    assert kills(latest_snapshots(idle.id, 5)) == [103, 102, 101]
+    assert len(opened) == 1
+
+
+def test_new_stats_replace_archived_ones(archived, login):
+    idle, _, _ = archived
+    client = login(idle)
+    assert client.get('/stats').get_json()['kills'] == {'current': 103, 'previous': 102}
+
+    payload = {column: 0 for column in COUNTER_COLUMNS} | {'kills': 150, 'total_wins': 5}
+    assert client.post('/stats', json=payload).status_code == 200
+    assert client.get('/stats').get_json()['kills'] == {'current': 150, 'previous': 103}
+
+    # The archived snapshot was swapped out of the sketches, not left behind.
+    incremental = {(b.scope, b.metric, b.bucket): b.count for b in PercentileBucket.query}
+    rebuild_sketches()
+    assert {(b.scope, b.metric, b.bucket): b.count for b in PercentileBucket.query} == incremental
+
+    # And the new period is measured from it rather than from zero.
+    rollup_batch(100)
+    latest = StatsDaily.query.filter_by(user_id=idle.id).order_by(StatsDaily.period_start.desc()).first()
+    assert (latest.kills, latest.kills_delta, latest.total_wins_delta) == (150, 47, 2)
@@ -0,0 +1,151 @@
+from datetime import date, datetime, timedelta
+import pytest
+from models import StatsDaily, StatsWeekly
+from stats_partitions import add_months, archive_month, current_month, month_range
+from stats_rollup import (choose_granularity, pending_rollups, period_start, reset_rollups, rollup_batch,
+                          rollup_watermark)
+from utils import utcnow
+
+
+def rows_by_period(model, user):
+    return {row.period_start: row for row in model.query.filter_by(user_id=user.id)}
+
+
+def test_weeks_start_on_monday():
+    assert period_start('week', datetime(2024, 10, 17, 15)) == date(2024, 10, 14)
+    assert period_start('week', datetime(2024, 10, 14)) == date(2024, 10, 14)
+    assert period_start('day', datetime(2024, 10, 17, 15)) == date(2024, 10, 17)
+
+
+def test_granularity_follows_the_span():
+    start = datetime(2024, 1, 1)
+    assert choose_granularity(start, start + timedelta(days=2)) == 'raw'
+    assert choose_granularity(start, start + timedelta(days=3)) == 'day'
+    assert choose_granularity(start, start + timedelta(days=91)) == 'week'
+
+
+def test_rollups_keep_last_values_and_deltas(app, make_user, add_stats):
+    alice = make_user('alice')
+    add_stats(alice, datetime(2024, 10, 14, 9), kills=10, total_wins=1)
+    add_stats(alice, datetime(2024, 10, 14, 21), kills=15, total_wins=2)
+    add_stats(alice, datetime(2024, 10, 16, 12), kills=40, total_wins=2)
+    add_stats(alice, datetime(2024, 10, 21, 12), kills=45, total_wins=5)
+
+    assert rollup_batch(100) == 4
+    assert rollup_watermark() == 4
+
+    daily = rows_by_period(StatsDaily, alice)
+    assert sorted(daily) == [date(2024, 10, 14), date(2024, 10, 16), date(2024, 10, 21)]
+    # The first period counts from the first snapshot, later ones from the previous period.
+    assert (daily[date(2024, 10, 14)].kills, daily[date(2024, 10, 14)].kills_delta) == (15, 5)
+    assert (daily[date(2024, 10, 16)].kills, daily[date(2024, 10, 16)].kills_delta) == (40, 25)
+    assert daily[date(2024, 10, 14)].snapshot_count == 2
+
+    weekly = rows_by_period(StatsWeekly, alice)
+    assert (weekly[date(2024, 10, 14)].kills, weekly[date(2024, 10, 14)].kills_delta) == (40, 30)
+    assert (weekly[date(2024, 10, 21)].total_wins, weekly[date(2024, 10, 21)].total_wins_delta) == (5, 3)
+
+
+def test_late_snapshots_rebuild_from_their_period(app, make_user, add_stats):
+    alice = make_user('alice')
+    add_stats(alice, datetime(2024, 10, 14, 9), kills=10)
+    add_stats(alice, datetime(2024, 10, 16, 9), kills=30)
+    rollup_batch(100)
+
+    add_stats(alice, datetime(2024, 10, 15, 9), kills=20)
+    assert rollup_batch(100) == 1
+    daily = rows_by_period(StatsDaily, alice)
+    assert [(row.kills, row.kills_delta) for _, row in sorted(daily.items())] == [(10, 0), (20, 10), (30, 10)]
+
+
+def test_lag_leaves_recent_snapshots_for_later(app, make_user, add_stats):
+    alice = make_user('alice')
+    old = add_stats(alice, utcnow() - timedelta(hours=1), kills=1)
+    add_stats(alice, utcnow(), kills=2)
+
+    assert rollup_batch(100, lag=60) == 1
+    assert rollup_watermark() == old.id
+    assert rollup_batch(100) == 1
+
+
+def test_pending_rollups_match_stored_ones(app, make_user, add_stats):
+    alice, bob = make_user('alice'), make_user('bob')
+    start = datetime(2024, 10, 1)
+    for day in range(20):
+        add_stats(alice, start + timedelta(days=day, hours=3), kills=day * 3, total_losses=day)
+        if day % 3:
+            add_stats(bob, start + timedelta(days=day, hours=5), kills=day * 7)
+
+    for granularity, model in [('day', StatsDaily), ('week', StatsWeekly)]:
+        reset_rollups()
+        earliest, pending = pending_rollups(granularity, [alice.id, bob.id])
+        assert earliest == {alice.id: period_start(granularity, start), bob.id: period_start(granularity, start + timedelta(days=1))}
+
+        rollup_batch(1000)
+        assert pending_rollups(granularity, [alice.id, bob.id]) == ({}, [])
+        columns = list(pending[0])
+        stored = [{column: getattr(row, column) for column in columns}
+                  for row in model.query.order_by(model.user_id, model.period_start)]
+        assert sorted(pending, key=lambda row: (row['user_id'], row['period_start'])) == stored
+
+
+def test_partial_rollups_serve_the_same_history(app, login, make_user, add_stats):
+    alice = make_user('alice')
+    start = utcnow() - timedelta(days=40)
+    for hour in range(0, 40 * 24, 5):
+        add_stats(alice, start + timedelta(hours=hour), kills=hour, total_wins=hour // 10)
+
+    client = login(alice)
+    urls = ['/stats/history?from=30d', '/stats/history?from=60d&granularity=week', '/stats/history?granularity=day&limit=7']
+    raw = [client.get(url).get_json() for url in urls]
+    assert all(response['history'] for response in raw)
+
+    rollup_batch(50)
+    assert [client.get(url).get_json() for url in urls] == raw
+    while rollup_batch(1000):
+        pass
+    assert [client.get(url).get_json() for url in urls] == raw
+
+
+def test_relative_history_ranges_move_their_etag(app, login, make_user, add_stats, monkeypatch):
+    alice = make_user('alice')
+    now = utcnow()
+    add_stats(alice, now - timedelta(hours=30), kills=1)
+    add_stats(alice, now - timedelta(hours=1), kills=2)
+    client = login(alice)
+
+    def etags(*urls):
+        return [client.get(url).headers.get('ETag') for url in urls]
+
+    urls = [f'/stats/history?from={(now - timedelta(days=2)).isoformat()}&to={now.isoformat()}',
+            '/stats/history?from=5d&granularity=day']
+    before = etags(*urls)
+    assert etags(*urls) == before
+    # A raw window moves with every request, so it is not cached at all.
+    assert etags('/stats/history?from=1d') == [None]
+
+    monkeypatch.setattr('routes.stats.utcnow', lambda: now + timedelta(days=1))
+    # The absolute range is unchanged; the days of the relative one have moved on.
+    after = etags(*urls)
+    assert after[0] == before[0]
+    assert after[1] != before[1]
+
+
+def test_reset_keeps_rollups_of_archived_months(app, make_user, add_stats):
+    pytest.importorskip('pyarrow')
+    alice = make_user('alice')
+    month = add_months(current_month(), -3)
+    start, _ = month_range(month)
+    add_stats(alice, start + timedelta(days=1), kills=10)
+    add_stats(alice, start + timedelta(days=2), kills=15)
+    add_stats(alice, kills=40)
+    rollup_batch(100)
+    archive_month(month, app.config['STATS_ARCHIVE_DIR'])
+    archived_days = [start.date() + timedelta(days=1), start.date() + timedelta(days=2)]
+
+    reset_rollups()
+    assert sorted(rows_by_period(StatsDaily, alice)) == archived_days
+    rollup_batch(100)
+    daily = rows_by_period(StatsDaily, alice)
+    assert sorted(daily) == archived_days + [utcnow().date()]
+    assert daily[utcnow().date()].kills_delta == 25
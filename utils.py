@@ -0,0 +1,13 @@
+from datetime import datetime, timezone
+
+
+def utcnow():
+    """The current UTC time as a naive datetime, like the DateTime columns store."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def parse_limit(args, default, maximum):
+    """The ``limit`` query argument, capped at ``maximum``. Missing, invalid and
+    non-positive values fall back to ``default``."""
+    limit = args.get('limit', default, type=int)
+    return min(limit, maximum) if limit and limit > 0 else default